@@ -1,17 +1,35 @@
 # app.py
 # ─────────────────────────────────────────────────────────────────────────────
 # Bot PTB: /start /help /health /say /echo + registro de /audit y /audits
+# Arranque en polling (python app.py); modo webhook con N workers: webhook.py
+# - create_app() construye la Application. Importar este módulo no hace nada
+#   pesado: PTB, los handlers (y sus variables de entorno, ya con .env cargado)
+#   y la base de datos se cargan al crear la app / en post_init.
+# - Al arrancar se registra el desglose de tiempos (STARTUP, log y gauge
+#   startup_seconds{phase}).
 # ─────────────────────────────────────────────────────────────────────────────
 
-import logging, time
-from telegram.ext import Application, CommandHandler, ContextTypes, MessageHandler, filters
-from telegram import Update
-from telegram.error import NetworkError
+from __future__ import annotations
 
-from config import setup_logging, load_token
-from db import sqlite_store as store
-from handlers.audit import register_handlers as register_audit
-from handlers.audits_list import register_handlers as register_audits_list
+import asyncio, contextlib, logging, os, random, signal, time
+from typing import TYPE_CHECKING, Dict
+
+from config import setup_logging, load_token, worker_shard
+
+if TYPE_CHECKING:
+    from telegram import Update
+    from telegram.ext import Application, ContextTypes
+
+_T0 = time.perf_counter()
+STARTUP: Dict[str, float] = {}   # fase → segundos (config, imports, build, handlers, store, initialize)
+
+@contextlib.contextmanager
+def _phase(name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        STARTUP[name] = STARTUP.get(name, 0.0) + time.perf_counter() - t0
 
 # ---- comandos básicos ----
 
@@ -27,7 +45,11 @@ async def help_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "/say <msg>\n"
         "/echo <msg>\n"
         "/audit — sube un CSV para auditar\n"
-        "/audits — ver últimos resultados"
+        "/queue — tus auditorías en cola y espera estimada\n"
+        "/audits [archivo:x] [desde:AAAA-MM-DD] [hasta:…] [errores|ok] — historial\n"
+        "/audit_detail <id> [regla] — filas con errores\n"
+        "/trends — evolución y peores archivos\n"
+        "/stats — latencias (admins)"
     )
 
 async def health(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -47,45 +69,147 @@ async def echo_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
 async def on_error(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     logging.exception("Error en handler: %s | update=%r", context.error, update)
 
-# ---- construcción de la app ----
-
-def build_app() -> Application:
-    setup_logging("INFO")
-    logging.getLogger("httpx").setLevel(logging.WARNING)
-    token = load_token()
-
-    app = Application.builder().token(token).build()
+# ---- ciclo de vida ----
+
+async def _open_store(_app: Application) -> None:
+    from db import sqlite_store as store
+    with _phase("store"):   # DDL/migraciones una sola vez, fuera del bucle de eventos
+        await asyncio.to_thread(store.init)
+
+async def _close_store(_app: Application) -> None:
+    from db import sqlite_store as store
+    store.close()   # vacía escrituras agrupadas pendientes
+
+async def _serve_metrics(_app: Application) -> None:
+    from services import metrics
+    port = os.getenv("METRICS_PORT")
+    if port:
+        metrics.serve(int(port) + worker_shard()[0])   # un puerto por worker webhook
+
+async def _report_startup(application: Application) -> None:
+    from services import metrics
+    # initialize: desde create_app() hasta aquí (getMe, hooks, reanudar trabajos) sin la base de datos
+    STARTUP["initialize"] = time.perf_counter() - application.bot_data["built_at"] - STARTUP.get("store", 0.0)
+    total = time.perf_counter() - _T0
+    for name, secs in STARTUP.items():
+        metrics.set_gauge("startup_seconds", secs, phase=name)
+    metrics.set_gauge("startup_seconds", total, phase="total")
+    logging.info("Arranque en %.0f ms: %s", total * 1000,
+                 ", ".join(f"{k}={v * 1000:.0f}" for k, v in STARTUP.items()))
 
-    # comandos
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("help", help_cmd))
-    app.add_handler(CommandHandler("health", health))
-    app.add_handler(CommandHandler("say", say))
-    app.add_handler(CommandHandler("echo", echo_cmd))
-
-    # texto no-comando
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, echo_text))
+# ---- construcción de la app ----
 
-    # errores
-    app.add_error_handler(on_error)
+def create_app() -> Application:
+    """Application lista para arrancar (polling, webhook o bench); cada llamada crea una nueva."""
+    with _phase("config"):
+        setup_logging("INFO")
+        logging.getLogger("httpx").setLevel(logging.WARNING)
+        token = load_token()   # carga .env: antes de importar handlers que leen el entorno
+
+    with _phase("imports"):
+        from telegram.ext import Application, CommandHandler, MessageHandler, filters
+        from handlers.handlers.audit import register_handlers as register_audit
+        from handlers.audits_list import register_handlers as register_audits_list
+        from handlers.audit_detail import register_handlers as register_audit_detail
+        from handlers.stats import register_handlers as register_stats
+        from handlers.trends import register_handlers as register_trends
+        from services import admission, metrics, outbox, retention
+        from services.hooks import add_hook
+        from services.persistence import SQLitePersistence
+
+    with _phase("build"):
+        # HTTPXRequest instrumentado: latencia por método de la Bot API en /stats y /metrics;
+        # todos los envíos pasan por el limitador global/por chat (services/outbox.py)
+        builder = (Application.builder().token(token)
+                   .request(metrics.instrumented_request())
+                   .get_updates_request(metrics.instrumented_request(connection_pool_size=1))
+                   .rate_limiter(outbox.RateLimiter()))
+        # Servidor Bot API propio (local o el falso de scripts/bench.py)
+        api_url = os.getenv("TELEGRAM_API_URL", "").rstrip("/")
+        if api_url:
+            builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+        # chat_data/user_data/conversaciones en SQLite (write-behind, services/persistence.py)
+        if os.getenv("BOT_PERSISTENCE", "1") != "0":
+            builder = builder.persistence(SQLitePersistence())
+        app = builder.build()
+
+    with _phase("handlers"):
+        # límites por chat antes de cualquier handler (grupo -1, services/admission.py)
+        admission.install(app)
+
+        # comandos
+        app.add_handler(CommandHandler("start", start))
+        app.add_handler(CommandHandler("help", help_cmd))
+        app.add_handler(CommandHandler("health", health))
+        app.add_handler(CommandHandler("say", say))
+        app.add_handler(CommandHandler("echo", echo_cmd))
+
+        # texto no-comando
+        app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, echo_text))
+
+        # errores
+        app.add_error_handler(on_error)
+
+        # base de datos: se abre en post_init, antes de que la cola de /audit reanude trabajos
+        # (con persistencia ya la ha abierto initialize() al cargar chat_data, también en un hilo)
+        add_hook(app, "post_init", _open_store)
+        add_hook(app, "post_shutdown", _close_store)
+        # handlers externos
+        register_audit(app)
+        register_audits_list(app)
+        register_audit_detail(app)
+        register_stats(app)
+        register_trends(app)
+        retention.install(app)   # archivo de auditorías antiguas + checkpoints del WAL
+        add_hook(app, "post_init", _serve_metrics)
+        add_hook(app, "post_init", _report_startup)
+        metrics.instrument_app(app)   # al final: envuelve todos los handlers ya registrados
+
+    app.bot_data["built_at"] = time.perf_counter()
     return app
 
-app = build_app()
+# ---- arranque (polling) ----
 
-# registra handlers externos y base de datos
-store.init()
-register_audit(app)
-register_audits_list(app)
-
-# ---- arranque ----
-if __name__ == "__main__":
+async def run_polling(application: Application) -> None:
+    """Polling con reconexión exponencial no bloqueante (mismo orden de hooks que run_polling)."""
+    from telegram.error import NetworkError
+    delay = 1.0
     while True:
         try:
-            app.run_polling(close_loop=False)
+            await application.initialize()
             break
         except NetworkError as e:
-            logging.warning("Conectividad inestable (%s). Reintentamos en 5 s…", e)
-            time.sleep(5)
-        except Exception:
-            logging.exception("Error no controlado. Abortando.")
-            break
+            logging.warning("Conectividad inestable (%s). Reintentamos en %.0f s…", e, delay)
+            await asyncio.sleep(delay * random.uniform(1.0, 1.5))
+            delay = min(delay * 2, 60.0)
+    if application.post_init:
+        await application.post_init(application)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        with contextlib.suppress(NotImplementedError):   # Windows
+            loop.add_signal_handler(sig, stop.set)
+    try:
+        # el Updater reintenta por su cuenta los fallos de red (backoff hasta 30 s)
+        await application.updater.start_polling(bootstrap_retries=-1)
+        await application.start()
+        await stop.wait()
+    finally:
+        if application.updater.running:
+            await application.updater.stop()
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(run_polling(create_app()))
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        logging.exception("Error no controlado. Abortando.")
@@ -48,3 +48,24 @@ def load_token() -> str:
         raise RuntimeError("Falta TELEGRAM_TOKEN. Usa scripts/set_token.py o crea .env")
 
     return token
+
+
+def worker_shard() -> tuple[int, int]:
+    """
+    Devuelve (índice, total) de este proceso dentro del pool de workers.
+    - En modo webhook (webhook.py) cada worker recibe BOT_WORKER_INDEX / BOT_WORKERS
+      y solo atiende los chats con chat_id % total == índice.
+    - En modo polling es (0, 1): un único proceso atiende todo.
+    """
+    total = int(os.getenv("BOT_WORKERS", "1"))
+    index = int(os.getenv("BOT_WORKER_INDEX", "0"))
+    return index, max(total, 1)
+
+
+def admin_chat_ids() -> set[int]:
+    """
+    Chats con acceso a comandos de administración (/stats, /trends_rebuild…).
+    - ADMIN_CHAT_IDS: lista separada por comas; vacía → nadie.
+    """
+    raw = os.getenv("ADMIN_CHAT_IDS", "")
+    return {int(x) for x in raw.replace(" ", "").split(",") if x}
@@ -1,15 +1,40 @@
 # db/sqlite_store.py
-# Persistencia mínima en SQLite para logs de auditoría.
+# Persistencia en SQLite para logs de auditoría.
 # - Archivo: data/bot.db
-# - Tabla: audits
+# - Tablas: audits (con los contadores de cada regla en columnas indexadas,
+#   para paginar/filtrar /audits sin decodificar JSON), audit_jobs (cola de
+#   auditorías en segundo plano),
+#   audit_cache (resultados por hash del CSV, ver services/cache.py),
+#   audit_rollups / audit_file_stats (agregados por chat para /trends, mantenidos
+#   en la misma transacción que cada save_audit; rebuild_rollups() los recalcula),
+#   audit_findings (filas que incumplen cada regla, en bloques comprimidos por
+#   auditoría; formato en engine/findings.py, política en services/findings.py),
+#   ptb_state (chat_data/user_data/conversaciones de PTB, ver services/persistence.py),
+#   admission_state (buckets de admisión por chat, opcional: services/admission.py)
+# - Retención (services/retention.py): las auditorías antiguas o por encima del tope
+#   por chat salen a archivos comprimidos; los agregados de /trends las conservan
+#   (rebuild_rollups recibe además las filas archivadas: retention.rebuild_rollups).
+# - Un único SQLiteStore de larga vida (get_store()):
+#     · 1 hilo escritor con su conexión; agrupa las escrituras que llegan juntas
+#       en una sola transacción (un solo COMMIT/fsync por ráfaga).
+#     · N hilos lectores con conexión propia (WAL → leen sin bloquear al escritor).
+#     · API async: el event loop nunca hace I/O de disco.
+#     · SQL constante → sqlite3 reutiliza las sentencias preparadas (cached_statements).
 
-import json, os, sqlite3, time
+import asyncio, json, logging, queue, sqlite3, threading, time
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import Any, Callable, Dict, Iterable, List, Optional, TypeVar
+
+from services import metrics
+
+log = logging.getLogger(__name__)
 
 DB_DIR = Path("data")
 DB_PATH = DB_DIR / "bot.db"
 
+T = TypeVar("T")
+
 DDL = """
 CREATE TABLE IF NOT EXISTS audits (
   id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -18,61 +43,893 @@ CREATE TABLE IF NOT EXISTS audits (
   run_id INTEGER,
   run_url TEXT,
   summary_json TEXT NOT NULL,
-  created_at REAL NOT NULL
+  created_at REAL NOT NULL,
+  invalid_date INTEGER,            -- contadores del resumen (NULL si no tiene el formato estándar)
+  duplicates_tx INTEGER,
+  unbalanced_tx INTEGER,
+  required_nulls INTEGER,
+  errors INTEGER                   -- suma de los cuatro (filtro "con errores")
 );
-CREATE INDEX IF NOT EXISTS idx_audits_chat_created ON audits(chat_id, created_at DESC);
+
+CREATE TABLE IF NOT EXISTS audit_jobs (
+  id INTEGER PRIMARY KEY AUTOINCREMENT,
+  chat_id INTEGER NOT NULL,
+  file_name TEXT NOT NULL,
+  file_path TEXT NOT NULL,
+  status TEXT NOT NULL,            -- queued | running | done | failed
+  run_id INTEGER,
+  error TEXT,
+  sha256 TEXT,                     -- hash del CSV original (file_path puede ser .gz)
+  raw_size INTEGER,
+  created_at REAL NOT NULL,
+  updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_audit_jobs_status ON audit_jobs(status, id);
+
+CREATE TABLE IF NOT EXISTS audit_cache (
+  key TEXT PRIMARY KEY,            -- sha256(csv) + versión de reglas
+  summary_json TEXT NOT NULL,
+  run_id INTEGER,
+  run_url TEXT,
+  size INTEGER NOT NULL,
+  created_at REAL NOT NULL,
+  last_hit REAL NOT NULL,
+  audit_id INTEGER                 -- auditoría que lo produjo (para copiar sus hallazgos)
+);
+CREATE INDEX IF NOT EXISTS idx_audit_cache_last_hit ON audit_cache(last_hit);
+
+CREATE TABLE IF NOT EXISTS audit_findings (
+  audit_id INTEGER NOT NULL,       -- audits.id
+  rule TEXT NOT NULL,
+  block INTEGER NOT NULL,          -- bloques de engine.findings.BLOCK_SIZE, ordenados por línea
+  n INTEGER NOT NULL,
+  first_line INTEGER NOT NULL,
+  codec TEXT NOT NULL,             -- zstd | zlib
+  data BLOB NOT NULL,
+  PRIMARY KEY (audit_id, rule, block)
+);
+
+CREATE TABLE IF NOT EXISTS audit_rollups (
+  chat_id INTEGER NOT NULL,
+  period TEXT NOT NULL,            -- d (día UTC) | w (semana, lunes) | t (total)
+  bucket INTEGER NOT NULL,         -- epoch de inicio del periodo (0 en 't')
+  audits INTEGER NOT NULL,
+  with_errors INTEGER NOT NULL,    -- auditorías con algún error
+  unparsed INTEGER NOT NULL,       -- resúmenes sin formato estándar (fuera de las tasas)
+  errors INTEGER NOT NULL,
+  invalid_date INTEGER NOT NULL,
+  duplicates_tx INTEGER NOT NULL,
+  unbalanced_tx INTEGER NOT NULL,
+  required_nulls INTEGER NOT NULL,
+  PRIMARY KEY (chat_id, period, bucket)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS audit_file_stats (
+  chat_id INTEGER NOT NULL,
+  file_name TEXT NOT NULL,
+  audits INTEGER NOT NULL,
+  with_errors INTEGER NOT NULL,
+  errors INTEGER NOT NULL,
+  last_errors INTEGER,             -- errores de la auditoría más reciente
+  last_at REAL NOT NULL,
+  PRIMARY KEY (chat_id, file_name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_audit_file_stats_worst ON audit_file_stats(chat_id, errors);
+
+CREATE TABLE IF NOT EXISTS ptb_state (
+  kind TEXT NOT NULL,              -- chat | user | bot | callback | conv:<nombre>
+  key TEXT NOT NULL,               -- chat_id / user_id; clave JSON en conversaciones; '' en bot
+  data BLOB NOT NULL,              -- pickle
+  updated_at REAL NOT NULL,
+  PRIMARY KEY (kind, key)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS admission_state (
+  chat_id INTEGER NOT NULL,
+  kind TEXT NOT NULL,              -- audit | msg
+  tokens REAL NOT NULL,
+  at REAL NOT NULL,                -- epoch en que 'tokens' era válido
+  PRIMARY KEY (chat_id, kind)
+) WITHOUT ROWID;
 """
 
-def _connect() -> sqlite3.Connection:
-    DB_DIR.mkdir(parents=True, exist_ok=True)
-    conn = sqlite3.connect(DB_PATH)
-    conn.execute("PRAGMA journal_mode=WAL;")     # mejor concurrencia básica
-    conn.execute("PRAGMA synchronous=NORMAL;")   # rendimiento razonable
-    return conn
+# Índices sobre columnas que pueden venir de _migrate (se crean después de migrar).
+# Paginación keyset de /audits: (created_at, id) por chat; variantes por nombre de
+# archivo y parcial para "con errores" → cada página es un range scan de índice.
+DDL_INDEXES = """
+DROP INDEX IF EXISTS idx_audits_chat_created;
+CREATE INDEX IF NOT EXISTS idx_audits_chat_page ON audits(chat_id, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_audits_chat_file ON audits(chat_id, file_name, created_at, id);
+CREATE INDEX IF NOT EXISTS idx_audits_chat_errors ON audits(chat_id, created_at, id) WHERE errors > 0;
+CREATE INDEX IF NOT EXISTS idx_audits_chat_ok ON audits(chat_id, created_at, id) WHERE errors = 0;
+CREATE INDEX IF NOT EXISTS idx_audit_jobs_active_sha ON audit_jobs(sha256, id) WHERE status IN ('queued', 'running');
+"""
 
-def init() -> None:
-    """Crea tablas si no existen."""
-    with _connect() as con:
-        con.executescript(DDL)
-
-def save_audit(
-    chat_id: int,
-    file_name: str,
-    summary: dict | str,
-    run_id: Optional[int],
-    run_url: Optional[str],
-) -> int:
-    """Inserta una auditoría. summary puede ser dict (se serializa) o str JSON."""
-    if isinstance(summary, dict):
-        summary_json = json.dumps(summary, ensure_ascii=False)
-    else:
-        summary_json = summary
-
-    with _connect() as con:
-        cur = con.execute(
-            "INSERT INTO audits(chat_id, file_name, run_id, run_url, summary_json, created_at) "
-            "VALUES (?, ?, ?, ?, ?, ?)",
-            (chat_id, file_name, run_id, run_url, summary_json, time.time()),
-        )
-        return cur.lastrowid
-
-def list_audits(chat_id: int, limit: int = 10) -> List[Dict[str, Any]]:
-    """Devuelve últimas auditorías de un chat."""
-    with _connect() as con:
-        rows = con.execute(
-            "SELECT id, file_name, run_id, run_url, summary_json, created_at "
-            "FROM audits WHERE chat_id=? ORDER BY created_at DESC LIMIT ?",
-            (chat_id, limit),
-        ).fetchall()
-    out = []
-    for (id_, fname, rid, rurl, sj, ts) in rows:
-        # intenta parsear JSON
+# Columnas añadidas después de crear la tabla (bases de datos existentes)
+_ADDED_COLUMNS = {
+    "audit_jobs": {"sha256": "TEXT", "raw_size": "INTEGER"},
+    "audit_cache": {"audit_id": "INTEGER"},
+    "audits": {"invalid_date": "INTEGER", "duplicates_tx": "INTEGER", "unbalanced_tx": "INTEGER",
+               "required_nulls": "INTEGER", "errors": "INTEGER"},
+}
+
+# Relleno de columnas recién añadidas en filas existentes: (tabla, columna) → SQL.
+# Se hace en SQL (JSON1), sin pasar cada resumen por Python.
+_BACKFILL = {
+    ("audits", "errors"): (
+        "UPDATE audits SET "
+        "invalid_date=json_extract(summary_json, '$.invalid_date.count'), "
+        "duplicates_tx=json_extract(summary_json, '$.duplicates_tx.count'), "
+        "unbalanced_tx=json_extract(summary_json, '$.unbalanced_tx.count'), "
+        "required_nulls=json_extract(summary_json, '$.required_nulls.count') "
+        "WHERE json_valid(summary_json);"
+        "UPDATE audits SET errors=invalid_date + duplicates_tx + unbalanced_tx + required_nulls "
+        "WHERE invalid_date IS NOT NULL;"
+    ),
+}
+
+def _migrate(con: sqlite3.Connection) -> None:
+    for table, cols in _ADDED_COLUMNS.items():
+        have = {r[1] for r in con.execute(f"PRAGMA table_info({table})")}
+        for col, decl in cols.items():
+            if col not in have:
+                con.execute(f"ALTER TABLE {table} ADD COLUMN {col} {decl}")
+                if (table, col) in _BACKFILL:
+                    t0 = time.perf_counter()
+                    con.executescript("BEGIN;" + _BACKFILL[table, col] + "COMMIT;")
+                    log.info("Migración: %s.%s rellenada en %.1f s", table, col, time.perf_counter() - t0)
+    con.executescript(DDL_INDEXES)
+
+# ---- SQL (constante: se prepara una vez por conexión) ----
+
+SQL_INSERT_AUDIT = (
+    "INSERT INTO audits(chat_id, file_name, run_id, run_url, summary_json, created_at, "
+    "invalid_date, duplicates_tx, unbalanced_tx, required_nulls, errors) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+HEADLINE_RULES = ("invalid_date", "duplicates_tx", "unbalanced_tx", "required_nulls")
+_PAGE_COLS = ("id", "file_name", "run_id", "run_url", "created_at") + HEADLINE_RULES + ("errors",)
+SQL_LIST_AUDITS = (
+    "SELECT id, file_name, run_id, run_url, summary_json, created_at "
+    "FROM audits WHERE chat_id=? ORDER BY created_at DESC LIMIT ?"
+)
+_JOB_COLS = ("id", "chat_id", "file_name", "file_path", "status", "run_id", "error",
+             "sha256", "raw_size", "created_at")
+SQL_INSERT_JOB = (
+    "INSERT INTO audit_jobs(chat_id, file_name, file_path, status, sha256, raw_size, created_at, updated_at) "
+    "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)"
+)
+SQL_UPDATE_JOB = (
+    "UPDATE audit_jobs SET status=COALESCE(?, status), run_id=COALESCE(?, run_id), "
+    "error=COALESCE(?, error), updated_at=? WHERE id=?"
+)
+SQL_PENDING_JOBS = (
+    f"SELECT {', '.join(_JOB_COLS)} FROM audit_jobs "
+    "WHERE status IN ('queued', 'running') ORDER BY id"
+)
+# job anterior con el mismo contenido, en cola o en curso en otro worker (chat_id % total)
+SQL_ACTIVE_JOB_ELSEWHERE = (
+    "SELECT id FROM audit_jobs WHERE sha256=? AND status IN ('queued', 'running') "
+    "AND id<? AND chat_id % ? != ? ORDER BY id LIMIT 1"
+)
+SQL_JOB_STATUS = "SELECT status FROM audit_jobs WHERE id=?"
+# ---- agregados de /trends ----
+
+DAY = 86400
+_DAY_SQL = "CAST(created_at / 86400 AS INTEGER)"
+SQL_ROLLUP_UPSERT = (
+    "INSERT INTO audit_rollups(chat_id, period, bucket, audits, with_errors, unparsed, errors, "
+    "invalid_date, duplicates_tx, unbalanced_tx, required_nulls) VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT(chat_id, period, bucket) DO UPDATE SET audits=audits+1, "
+    "with_errors=with_errors+excluded.with_errors, unparsed=unparsed+excluded.unparsed, "
+    "errors=errors+excluded.errors, invalid_date=invalid_date+excluded.invalid_date, "
+    "duplicates_tx=duplicates_tx+excluded.duplicates_tx, unbalanced_tx=unbalanced_tx+excluded.unbalanced_tx, "
+    "required_nulls=required_nulls+excluded.required_nulls"
+)
+SQL_FILE_STATS_UPSERT = (
+    "INSERT INTO audit_file_stats(chat_id, file_name, audits, with_errors, errors, last_errors, last_at) "
+    "VALUES (?, ?, 1, ?, ?, ?, ?) "
+    "ON CONFLICT(chat_id, file_name) DO UPDATE SET audits=audits+1, "
+    "with_errors=with_errors+excluded.with_errors, errors=errors+excluded.errors, "
+    "last_errors=excluded.last_errors, last_at=excluded.last_at"
+)
+_ROLLUP_SUMS = (
+    "COUNT(*), COALESCE(SUM(errors > 0), 0), SUM(errors IS NULL), COALESCE(SUM(errors), 0), "
+    "COALESCE(SUM(invalid_date), 0), COALESCE(SUM(duplicates_tx), 0), "
+    "COALESCE(SUM(unbalanced_tx), 0), COALESCE(SUM(required_nulls), 0)"
+)
+# Recalculo completo desde las columnas de audits (sin JSON); {where} = "" o "WHERE chat_id=?";
+# {src} = audits o audits + auditorías archivadas (tabla temporal archived_audits)
+SQL_REBUILD_ROLLUPS = (
+    "DELETE FROM audit_rollups {where};",
+    "DELETE FROM audit_file_stats {where};",
+    f"INSERT INTO audit_rollups SELECT chat_id, 'd', {_DAY_SQL} * 86400, {_ROLLUP_SUMS} "
+    "FROM {src} {where} GROUP BY chat_id, 3;",
+    # 1970-01-01 fue jueves: (día + 3) % 7 = días desde el lunes
+    f"INSERT INTO audit_rollups SELECT chat_id, 'w', ({_DAY_SQL} - ({_DAY_SQL} + 3) % 7) * 86400, "
+    f"{_ROLLUP_SUMS} FROM {{src}} {{where}} GROUP BY chat_id, 3;",
+    f"INSERT INTO audit_rollups SELECT chat_id, 't', 0, {_ROLLUP_SUMS} FROM {{src}} {{where}} GROUP BY chat_id;",
+    # columna "desnuda" con MAX(): SQLite toma errors de la fila más reciente
+    "INSERT INTO audit_file_stats SELECT chat_id, file_name, COUNT(*), COALESCE(SUM(errors > 0), 0), "
+    "COALESCE(SUM(errors), 0), errors, MAX(created_at) FROM {src} {where} GROUP BY chat_id, file_name;",
+)
+_AGG_COLS = "chat_id, file_name, created_at, invalid_date, duplicates_tx, unbalanced_tx, required_nulls, errors"
+SQL_ARCHIVED_TEMP = (
+    "CREATE TEMP TABLE archived_audits (id INTEGER PRIMARY KEY, chat_id INTEGER, file_name TEXT, "
+    "created_at REAL, invalid_date INTEGER, duplicates_tx INTEGER, unbalanced_tx INTEGER, "
+    "required_nulls INTEGER, errors INTEGER)"
+)
+# mismo id dos veces (caída a medias al archivar) o aún en audits: cuenta una sola vez
+SQL_ARCHIVED_PUT = "INSERT OR IGNORE INTO archived_audits VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)"
+SQL_ARCHIVED_DEDUP = "DELETE FROM archived_audits WHERE id IN (SELECT id FROM main.audits)"
+_WITH_ARCHIVED = f"(SELECT {_AGG_COLS} FROM audits UNION ALL SELECT {_AGG_COLS} FROM archived_audits)"
+_ROLLUP_COLS = ("bucket", "audits", "with_errors", "unparsed", "errors") + HEADLINE_RULES
+SQL_ROLLUP_RANGE = (
+    f"SELECT {', '.join(_ROLLUP_COLS)} FROM audit_rollups "
+    "WHERE chat_id=? AND period=? AND bucket>=? ORDER BY bucket DESC"
+)
+SQL_WORST_FILES = (
+    "SELECT file_name, audits, with_errors, errors, last_errors, last_at FROM audit_file_stats "
+    "WHERE chat_id=? AND errors>0 ORDER BY errors DESC LIMIT ?"
+)
+
+def _buckets(ts: float) -> tuple[int, int]:
+    """Inicio (epoch) del día UTC y de la semana (lunes) que contienen ts."""
+    day = int(ts // DAY)
+    return day * DAY, (day - (day + 3) % 7) * DAY
+
+def _rollup(con: sqlite3.Connection, chat_id: int, file_name: str, ts: float, head: tuple) -> None:
+    """Suma una auditoría a los agregados (dentro de la transacción de save_audit)."""
+    *counts, errors = head
+    unparsed = int(errors is None)
+    with_errors = int(bool(errors))
+    counts = [c or 0 for c in counts]
+    day, week = _buckets(ts)
+    for period, bucket in (("d", day), ("w", week), ("t", 0)):
+        con.execute(SQL_ROLLUP_UPSERT, (chat_id, period, bucket, with_errors, unparsed, errors or 0, *counts))
+    con.execute(SQL_FILE_STATS_UPSERT, (chat_id, file_name, with_errors, errors or 0, errors, ts))
+
+def _archived_row(r: Dict[str, Any]) -> tuple:
+    try:
+        summary = json.loads(r["summary_json"])
+    except (TypeError, ValueError):
+        summary = None
+    return (r["id"], r["chat_id"], r["file_name"], r["created_at"], *_headline(summary))
+
+def _rebuild_rollups(con: sqlite3.Connection, chat_id: Optional[int] = None,
+                     archived: Iterable[Dict[str, Any]] = ()) -> None:
+    """archived: filas de los archivos de retención (ARCHIVE_COLS), se suman a las de audits."""
+    where, params = ("WHERE chat_id=?", (chat_id,)) if chat_id is not None else ("", ())
+    con.execute("DROP TABLE IF EXISTS temp.archived_audits")
+    con.execute(SQL_ARCHIVED_TEMP)
+    con.executemany(SQL_ARCHIVED_PUT, map(_archived_row, archived))
+    con.execute(SQL_ARCHIVED_DEDUP)
+    src = _WITH_ARCHIVED if con.execute("SELECT 1 FROM archived_audits LIMIT 1").fetchone() else "audits"
+    for sql in SQL_REBUILD_ROLLUPS:
+        con.execute(sql.format(where=where, src=src), params)
+    con.execute("DROP TABLE temp.archived_audits")
+
+# ---- hallazgos fila a fila ----
+
+SQL_INSERT_FINDINGS = (
+    "INSERT INTO audit_findings(audit_id, rule, block, n, first_line, codec, data) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+SQL_COPY_FINDINGS = (
+    "INSERT INTO audit_findings(audit_id, rule, block, n, first_line, codec, data) "
+    "SELECT ?, rule, block, n, first_line, codec, data FROM audit_findings WHERE audit_id=?"
+)
+SQL_GET_AUDIT = (
+    "SELECT id, file_name, created_at, invalid_date, duplicates_tx, unbalanced_tx, required_nulls "
+    "FROM audits WHERE id=? AND chat_id=?"
+)
+SQL_FINDINGS_RULES = (
+    "SELECT rule, SUM(n), COUNT(*) FROM audit_findings WHERE audit_id=? GROUP BY rule"
+)
+SQL_FINDINGS_BLOCKS = (
+    "SELECT block, n, codec, data FROM audit_findings "
+    "WHERE audit_id=? AND rule=? AND block BETWEEN ? AND ? ORDER BY block"
+)
+# ids crecen con created_at: la 1ª auditoría dentro del plazo marca el corte
+SQL_FINDINGS_CUTOFF = "SELECT id FROM audits WHERE created_at >= ? ORDER BY id LIMIT 1"
+SQL_FINDINGS_EXPIRE = "DELETE FROM audit_findings WHERE audit_id < ?"
+SQL_FINDINGS_SIZE = "SELECT COALESCE(SUM(length(data)), 0) FROM audit_findings"
+SQL_FINDINGS_OLDEST = (
+    "SELECT audit_id, SUM(length(data)) FROM audit_findings GROUP BY audit_id ORDER BY audit_id LIMIT 64"
+)
+
+# ---- retención / archivo ----
+
+ARCHIVE_COLS = ("id", "chat_id", "file_name", "run_id", "run_url", "summary_json", "created_at")
+SQL_ARCHIVE_OLD = f"SELECT {', '.join(ARCHIVE_COLS)} FROM audits WHERE id < ? ORDER BY id LIMIT ?"
+SQL_NEXT_ID = "SELECT COALESCE(MAX(id), 0) + 1 FROM audits"
+SQL_CHATS_OVER_CAP = "SELECT chat_id FROM audits GROUP BY chat_id HAVING COUNT(*) > ?"
+# la (tope+1)-ésima más reciente del chat: desde ella hacia atrás, al archivo
+SQL_CHAT_CAP_EDGE = (
+    "SELECT created_at, id FROM audits WHERE chat_id=? ORDER BY created_at DESC, id DESC LIMIT 1 OFFSET ?"
+)
+SQL_ARCHIVE_CHAT = (
+    f"SELECT {', '.join(ARCHIVE_COLS)} FROM audits WHERE chat_id=? AND (created_at, id) <= (?, ?) "
+    "ORDER BY created_at, id LIMIT ?"
+)
+
+SQL_STATE_LOAD = "SELECT key, data FROM ptb_state WHERE kind=?"
+SQL_STATE_PUT = (
+    "INSERT INTO ptb_state(kind, key, data, updated_at) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(kind, key) DO UPDATE SET data=excluded.data, updated_at=excluded.updated_at"
+)
+SQL_STATE_DROP = "DELETE FROM ptb_state WHERE kind=? AND key=?"
+
+SQL_ADMISSION_LOAD = "SELECT chat_id, kind, tokens, at FROM admission_state WHERE at >= ?"
+SQL_ADMISSION_PUT = (
+    "INSERT INTO admission_state(chat_id, kind, tokens, at) VALUES (?, ?, ?, ?) "
+    "ON CONFLICT(chat_id, kind) DO UPDATE SET tokens=excluded.tokens, at=excluded.at"
+)
+SQL_ADMISSION_EXPIRE = "DELETE FROM admission_state WHERE at < ?"
+
+SQL_CACHE_GET = "SELECT summary_json, run_id, run_url, created_at, audit_id FROM audit_cache WHERE key=?"
+SQL_CACHE_TOUCH = "UPDATE audit_cache SET last_hit=? WHERE key=?"
+SQL_CACHE_PUT = (
+    "INSERT OR REPLACE INTO audit_cache(key, summary_json, run_id, run_url, size, created_at, last_hit, audit_id) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+SQL_CACHE_EXPIRE = "DELETE FROM audit_cache WHERE created_at < ?"
+SQL_CACHE_SIZE = "SELECT COALESCE(SUM(size), 0) FROM audit_cache"
+SQL_CACHE_OLDEST = "SELECT key, size FROM audit_cache ORDER BY last_hit LIMIT 256"
+
+def _headline(summary: Any) -> tuple:
+    """Contadores de las reglas (+ total) de un resumen; None si no tiene el formato estándar."""
+    try:
+        counts = tuple(int(summary[r]["count"]) for r in HEADLINE_RULES)
+    except (TypeError, KeyError, ValueError):
+        return (None,) * (len(HEADLINE_RULES) + 1)
+    return counts + (sum(counts),)
+
+def _page_sql(file_name: Optional[str], since: Optional[float], until: Optional[float],
+              has_errors: Optional[bool], before: Optional[tuple], after: Optional[tuple],
+              limit: int, chat_id: int) -> tuple[str, list]:
+    """SELECT de una página de /audits: filtros + keyset (created_at, id), sin OFFSET."""
+    where, params = ["chat_id=?"], [chat_id]
+    if file_name is not None:
+        where.append("file_name=?")
+        params.append(file_name)
+    if since is not None:
+        where.append("created_at>=?")
+        params.append(since)
+    if until is not None:
+        where.append("created_at<?")
+        params.append(until)
+    if has_errors is not None:
+        where.append("errors>0" if has_errors else "errors=0")   # cada uno con su índice parcial
+    if before is not None:
+        where.append("(created_at, id) < (?, ?)")
+        params.extend(before)
+    if after is not None:
+        where.append("(created_at, id) > (?, ?)")
+        params.extend(after)
+    order = "ASC" if after is not None else "DESC"
+    sql = (f"SELECT {', '.join(_PAGE_COLS)} FROM audits WHERE {' AND '.join(where)} "
+           f"ORDER BY created_at {order}, id {order} LIMIT ?")
+    return sql, params + [limit]
+
+def _open(path: Path) -> sqlite3.Connection:
+    con = sqlite3.connect(path, isolation_level=None, check_same_thread=False,
+                          cached_statements=256)
+    # solo tiene efecto en bases nuevas y antes de pasar a WAL (que ya escribe la cabecera):
+    # deja liberar páginas con incremental_vacuum
+    con.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+    con.execute("PRAGMA journal_mode=WAL;")     # lectores concurrentes con el escritor
+    con.execute("PRAGMA synchronous=NORMAL;")   # fsync solo en checkpoints
+    con.execute("PRAGMA busy_timeout=5000;")
+    con.execute("PRAGMA journal_size_limit=67108864;")   # el -wal vuelve a ≤ 64 MB tras cada checkpoint
+    return con
+
+def _incremental_vacuum(con: sqlite3.Connection, pages: int) -> int:
+    """Libera hasta 'pages' páginas libres. Cada paso del PRAGMA libera una página y
+    sqlite3 solo da un paso por execute() (no devuelve filas): se repite."""
+    n = min(int(pages), con.execute("PRAGMA freelist_count").fetchone()[0])
+    for _ in range(n):
+        con.execute("PRAGMA incremental_vacuum(1)")
+    return n
+
+class _WriteOp:
+    __slots__ = ("fn", "future", "op")
+
+    def __init__(self, fn: Callable[[sqlite3.Connection], Any], op: str = "other") -> None:
+        self.fn = fn
+        self.op = op
+        self.future: Future = Future()
+
+class SQLiteStore:
+    """Conexiones de larga vida + hilo escritor con commit agrupado."""
+
+    def __init__(self, path: Path = DB_PATH, *, readers: int = 2, batch_max: int = 256,
+                 group_window: float = 0.002) -> None:
+        self.path = Path(path)
+        self.batch_max = batch_max
+        self.group_window = group_window     # espera extra para agrupar ráfagas
+        self._readers = readers
+        self._ops: "queue.Queue[Optional[_WriteOp]]" = queue.Queue()
+        self._local = threading.local()
+        self._writer: Optional[threading.Thread] = None
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    # ---- ciclo de vida ----
+
+    def start(self) -> "SQLiteStore":
+        """Abre conexiones y ejecuta el DDL una sola vez (idempotente)."""
+        with self._lock:
+            if self._writer is not None:
+                return self
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            con = _open(self.path)
+            had_rollups = con.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='audit_rollups'").fetchone()
+            con.executescript(DDL)
+            _migrate(con)
+            if con.execute("PRAGMA auto_vacuum").fetchone()[0] == 0:
+                # base creada antes de fijar auto_vacuum en _open: la conversión reescribe el
+                # archivo entero (minutos en bases grandes) → paso de mantenimiento aparte
+                log.warning("%s sin auto_vacuum: la retención no devuelve espacio al disco. "
+                            "Con el bot parado: python -m scripts.db_vacuum", self.path)
+            if not had_rollups:   # base de datos anterior a los agregados: se calculan una vez
+                con.execute("BEGIN IMMEDIATE")
+                _rebuild_rollups(con)
+                con.execute("COMMIT")
+            self._writer = threading.Thread(target=self._write_loop, args=(con,),
+                                            name="sqlite-writer", daemon=True)
+            self._writer.start()
+            self._pool = ThreadPoolExecutor(self._readers, thread_name_prefix="sqlite-reader")
+        return self
+
+    def close(self) -> None:
+        """Vacía las escrituras pendientes y cierra."""
+        with self._lock:
+            if self._writer is None:
+                return
+            self._ops.put(None)
+            self._writer.join()
+            self._writer = None
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    # ---- escritor ----
+
+    def _write_loop(self, con: sqlite3.Connection) -> None:
+        while True:
+            op = self._ops.get()
+            if op is None:
+                break
+            batch = [op]
+            if self.group_window:
+                time.sleep(self.group_window)
+            stop = False
+            while len(batch) < self.batch_max:
+                try:
+                    nxt = self._ops.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stop = True
+                    break
+                batch.append(nxt)
+            self._run_batch(con, batch)
+            if stop:
+                break
+        con.close()
+
+    def _run_batch(self, con: sqlite3.Connection, batch: List[_WriteOp]) -> None:
+        # write() cancelado antes de empezar (p.ej. apagado): no se ejecuta. Desde aquí el
+        # futuro está RUNNING y ya no se puede cancelar → set_result nunca falla en este hilo
+        batch = [op for op in batch if op.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        results: List[tuple] = []
         try:
-            summary = json.loads(sj)
-        except Exception:
-            summary = sj
-        out.append({
-            "id": id_, "file_name": fname, "run_id": rid, "run_url": rurl,
-            "summary": summary, "created_at": ts
-        })
-    return out
+            con.execute("BEGIN IMMEDIATE")
+            for op in batch:
+                # savepoint por operación: un fallo no tumba al resto del grupo
+                con.execute("SAVEPOINT op")
+                t0 = time.perf_counter()
+                try:
+                    results.append((op, op.fn(con), None))
+                    con.execute("RELEASE op")
+                except Exception as e:
+                    con.execute("ROLLBACK TO op")
+                    con.execute("RELEASE op")
+                    results.append((op, None, e))
+                metrics.observe("sqlite_query_seconds", time.perf_counter() - t0,
+                                op=op.op, kind="write")
+            t0 = time.perf_counter()
+            con.execute("COMMIT")
+            metrics.observe("sqlite_commit_seconds", time.perf_counter() - t0)
+            metrics.observe("sqlite_commit_batch_size", len(batch),
+                            buckets=metrics.COUNT_BUCKETS)
+        except Exception as e:
+            log.exception("Fallo en commit agrupado de SQLite")
+            if con.in_transaction:
+                con.execute("ROLLBACK")
+            results = [(op, None, e) for op in batch]
+        for op, value, err in results:   # se resuelven tras el COMMIT (durable)
+            if err is None:
+                op.future.set_result(value)
+            else:
+                op.future.set_exception(err)
+
+    # ---- API genérica ----
+
+    def _reader(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = self._local.con = _open(self.path)
+            con.execute("PRAGMA query_only=ON;")
+        return con
+
+    def write_future(self, fn: Callable[[sqlite3.Connection], T], op: str = "other") -> Future:
+        self.start()
+        item = _WriteOp(fn, op)
+        self._ops.put(item)
+        return item.future
+
+    async def write(self, fn: Callable[[sqlite3.Connection], T], op: str = "other") -> T:
+        """Ejecuta fn(con) en el hilo escritor, dentro de la transacción del grupo.
+        `op` solo etiqueta la métrica sqlite_query_seconds."""
+        return await asyncio.wrap_future(self.write_future(fn, op))
+
+    def _timed_read(self, fn: Callable[[sqlite3.Connection], T], op: str) -> T:
+        with metrics.timed("sqlite_query_seconds", op=op, kind="read"):
+            return fn(self._reader())
+
+    async def read(self, fn: Callable[[sqlite3.Connection], T], op: str = "other") -> T:
+        """Ejecuta fn(con) en un hilo lector."""
+        self.start()
+        return await asyncio.get_running_loop().run_in_executor(
+            self._pool, self._timed_read, fn, op)
+
+    def write_sync(self, fn: Callable[[sqlite3.Connection], T], op: str = "other") -> T:
+        """Igual que write() para scripts sin event loop."""
+        return self.write_future(fn, op).result()
+
+    def read_sync(self, fn: Callable[[sqlite3.Connection], T], op: str = "other") -> T:
+        self.start()
+        return self._pool.submit(self._timed_read, fn, op).result()
+
+    # ---- auditorías ----
+
+    async def save_audit(self, chat_id: int, file_name: str, summary: dict | str,
+                         run_id: Optional[int], run_url: Optional[str], *,
+                         findings: Optional[List[tuple]] = None,
+                         findings_from: Optional[int] = None) -> int:
+        """Inserta una auditoría. summary puede ser dict (se serializa) o str JSON.
+        Los contadores de cada regla se guardan también en columnas (ver page_audits).
+        findings: bloques (regla, bloque, n, 1ª línea, codec, datos) de engine.findings;
+        findings_from: copia los hallazgos de otra auditoría (resultado de caché)."""
+        if isinstance(summary, dict):
+            summary_json = json.dumps(summary, ensure_ascii=False)
+        else:
+            summary_json = summary
+            try:
+                summary = json.loads(summary_json)
+            except ValueError:
+                summary = None
+        now, head = time.time(), _headline(summary)
+        row = (chat_id, file_name, run_id, run_url, summary_json, now) + head
+
+        def _insert(con: sqlite3.Connection) -> int:
+            audit_id = con.execute(SQL_INSERT_AUDIT, row).lastrowid
+            _rollup(con, chat_id, file_name, now, head)   # misma transacción: nunca desincronizados
+            if findings:
+                con.executemany(SQL_INSERT_FINDINGS, ((audit_id,) + b for b in findings))
+            elif findings_from is not None:
+                con.execute(SQL_COPY_FINDINGS, (audit_id, findings_from))
+            return audit_id
+        return await self.write(_insert, op="save_audit")
+
+    async def list_audits(self, chat_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+        """Devuelve últimas auditorías de un chat."""
+        rows = await self.read(lambda con: con.execute(SQL_LIST_AUDITS, (chat_id, limit)).fetchall(),
+                               op="list_audits")
+        out = []
+        for (id_, fname, rid, rurl, sj, ts) in rows:
+            # intenta parsear JSON
+            try:
+                summary = json.loads(sj)
+            except Exception:
+                summary = sj
+            out.append({
+                "id": id_, "file_name": fname, "run_id": rid, "run_url": rurl,
+                "summary": summary, "created_at": ts
+            })
+        return out
+
+    async def page_audits(self, chat_id: int, *, limit: int = 5, before: Optional[tuple] = None,
+                          after: Optional[tuple] = None, file_name: Optional[str] = None,
+                          since: Optional[float] = None, until: Optional[float] = None,
+                          has_errors: Optional[bool] = None) -> tuple[List[Dict[str, Any]], bool]:
+        """Página de auditorías (más recientes primero) sin leer summary_json.
+        before/after: cursor (created_at, id) de la página vecina. Devuelve (filas, hay_más)
+        donde hay_más indica si quedan filas más allá en la dirección pedida."""
+        sql, params = _page_sql(file_name, since, until, has_errors, before, after, limit + 1, chat_id)
+        rows = await self.read(lambda con: con.execute(sql, params).fetchall(), op="page_audits")
+        more = len(rows) > limit
+        rows = rows[:limit]
+        if after is not None:
+            rows.reverse()
+        return [dict(zip(_PAGE_COLS, r)) for r in rows], more
+
+    async def trends(self, chat_id: int, days: int = 14, weeks: int = 8, top: int = 5) -> Dict[str, Any]:
+        """Agregados de /trends: total, últimos `days` días, últimas `weeks` semanas y peores
+        archivos. Lecturas por clave primaria/índice acotadas: no depende del historial."""
+        day, week = _buckets(time.time())
+
+        def _read(con: sqlite3.Connection) -> Dict[str, Any]:
+            rows = lambda period, since: [dict(zip(_ROLLUP_COLS, r)) for r in
+                                          con.execute(SQL_ROLLUP_RANGE, (chat_id, period, since))]
+            total = rows("t", 0)
+            worst = con.execute(SQL_WORST_FILES, (chat_id, top)).fetchall()
+            return {
+                "total": total[0] if total else None,
+                "daily": rows("d", day - (days - 1) * DAY),
+                "weekly": rows("w", week - (weeks - 1) * 7 * DAY),
+                "worst_files": [dict(zip(("file_name", "audits", "with_errors", "errors",
+                                          "last_errors", "last_at"), r)) for r in worst],
+            }
+        return await self.read(_read, op="trends")
+
+    async def rebuild_rollups(self, chat_id: Optional[int] = None,
+                              archived: Iterable[Dict[str, Any]] = ()) -> None:
+        """Recalcula los agregados desde audits + 'archived' (de un chat o de todos). Para
+        recuperación; 'archived' se consume en el hilo escritor (puede leer de disco)."""
+        await self.write(lambda con: _rebuild_rollups(con, chat_id, archived), op="rebuild_rollups")
+
+    # ---- hallazgos fila a fila ----
+
+    async def findings_index(self, audit_id: int, chat_id: int) -> Optional[Dict[str, Any]]:
+        """Auditoría (si es de este chat) + {regla: (nº hallazgos guardados, nº bloques)}."""
+        def _read(con: sqlite3.Connection) -> Optional[Dict[str, Any]]:
+            audit = con.execute(SQL_GET_AUDIT, (audit_id, chat_id)).fetchone()
+            if audit is None:
+                return None
+            out = dict(zip(("id", "file_name", "created_at") + HEADLINE_RULES, audit))
+            out["rules"] = {r: (n, blocks) for r, n, blocks in con.execute(SQL_FINDINGS_RULES, (audit_id,))}
+            return out
+        return await self.read(_read, op="findings_index")
+
+    async def findings_blocks(self, audit_id: int, rule: str, first: int, last: int) -> List[tuple]:
+        """Bloques [first, last] de una regla: (bloque, n, codec, datos)."""
+        return await self.read(
+            lambda con: con.execute(SQL_FINDINGS_BLOCKS, (audit_id, rule, first, last)).fetchall(),
+            op="findings_blocks")
+
+    async def purge_findings(self, max_age: float, max_bytes: int, vacuum_pages: int = 2000) -> int:
+        """Borra hallazgos de auditorías más antiguas que max_age y, si se supera max_bytes,
+        los de las auditorías más antiguas. Devuelve nº de bloques borrados."""
+        def _purge(con: sqlite3.Connection) -> int:
+            n = 0
+            cutoff = con.execute(SQL_FINDINGS_CUTOFF, (time.time() - max_age,)).fetchone()
+            if cutoff is not None:
+                n += con.execute(SQL_FINDINGS_EXPIRE, (cutoff[0],)).rowcount
+            total = con.execute(SQL_FINDINGS_SIZE).fetchone()[0]
+            while total > max_bytes:
+                victims = con.execute(SQL_FINDINGS_OLDEST).fetchall()
+                if not victims:
+                    break
+                for audit_id, size in victims:
+                    n += con.execute("DELETE FROM audit_findings WHERE audit_id=?", (audit_id,)).rowcount
+                    total -= size
+                    if total <= max_bytes:
+                        break
+            if n:
+                # devuelve páginas libres al sistema; sin auto_vacuum incremental (bases
+                # creadas antes) es un no-op y SQLite reutiliza esas páginas igualmente
+                _incremental_vacuum(con, vacuum_pages)
+            return n
+        return await self.write(_purge, op="purge_findings")
+
+    # ---- retención / mantenimiento ----
+
+    async def archive_candidates(self, max_age: Optional[float], per_chat: Optional[int],
+                                 limit: int) -> List[Dict[str, Any]]:
+        """Hasta 'limit' auditorías más antiguas que max_age o fuera de las per_chat más
+        recientes de su chat (las más antiguas primero)."""
+        def _read(con: sqlite3.Connection) -> List[tuple]:
+            rows: Dict[int, tuple] = {}
+            if max_age:
+                cutoff = con.execute(SQL_FINDINGS_CUTOFF, (time.time() - max_age,)).fetchone()
+                if cutoff is None:   # ninguna dentro del plazo
+                    cutoff = con.execute(SQL_NEXT_ID).fetchone()
+                rows.update((r[0], r) for r in con.execute(SQL_ARCHIVE_OLD, (cutoff[0], limit)))
+            if per_chat:
+                for (chat_id,) in con.execute(SQL_CHATS_OVER_CAP, (per_chat,)).fetchall():
+                    if len(rows) >= limit:
+                        break
+                    edge = con.execute(SQL_CHAT_CAP_EDGE, (chat_id, per_chat)).fetchone()
+                    rows.update((r[0], r) for r in con.execute(
+                        SQL_ARCHIVE_CHAT, (chat_id, *edge, limit - len(rows))))
+            return sorted(rows.values())[:limit]
+        return [dict(zip(ARCHIVE_COLS, r)) for r in await self.read(_read, op="archive_candidates")]
+
+    async def delete_audits(self, ids: List[int]) -> int:
+        """Borra auditorías (ya archivadas) y sus hallazgos; los agregados no se tocan."""
+        def _delete(con: sqlite3.Connection) -> int:
+            params = [(i,) for i in ids]
+            con.executemany("DELETE FROM audit_findings WHERE audit_id=?", params)
+            return con.executemany("DELETE FROM audits WHERE id=?", params).rowcount
+        return await self.write(_delete, op="delete_audits")
+
+    async def incremental_vacuum(self, pages: int) -> None:
+        await self.write(lambda con: _incremental_vacuum(con, pages), op="incremental_vacuum")
+
+    async def checkpoint(self, mode: str = "PASSIVE") -> tuple:
+        """PRAGMA wal_checkpoint desde un lector (fuera de transacción) → (busy, páginas wal, copiadas)."""
+        assert mode in ("PASSIVE", "FULL", "RESTART", "TRUNCATE")
+        return await self.read(lambda con: con.execute(f"PRAGMA wal_checkpoint({mode})").fetchone(),
+                               op="checkpoint")
+
+    async def db_stats(self) -> Dict[str, int]:
+        def _read(con: sqlite3.Connection) -> Dict[str, int]:
+            page = con.execute("PRAGMA page_size").fetchone()[0]
+            return {"bytes": con.execute("PRAGMA page_count").fetchone()[0] * page,
+                    "free_bytes": con.execute("PRAGMA freelist_count").fetchone()[0] * page,
+                    "audits": con.execute("SELECT COUNT(*) FROM audits").fetchone()[0]}
+        return await self.read(_read, op="db_stats")
+
+    # ---- cola de auditorías (trabajos en segundo plano) ----
+
+    async def create_job(self, chat_id: int, file_name: str, file_path: str,
+                         sha256: Optional[str] = None, raw_size: Optional[int] = None) -> int:
+        """Registra un trabajo en cola y devuelve su id."""
+        now = time.time()
+        row = (chat_id, file_name, file_path, sha256, raw_size, now, now)
+        return await self.write(lambda con: con.execute(SQL_INSERT_JOB, row).lastrowid,
+                                op="create_job")
+
+    async def update_job(self, job_id: int, status: Optional[str] = None, run_id: Optional[int] = None,
+                         error: Optional[str] = None) -> None:
+        """Actualiza estado / run_id / error (los None no se tocan)."""
+        row = (status, run_id, error, time.time(), job_id)
+        await self.write(lambda con: con.execute(SQL_UPDATE_JOB, row), op="update_job")
+
+    async def active_job_elsewhere(self, sha256: str, before_id: int, index: int, total: int) -> Optional[int]:
+        """Id del job más antiguo con este sha256 aún pendiente en otro worker (None si no hay)."""
+        row = await self.read(lambda con: con.execute(
+            SQL_ACTIVE_JOB_ELSEWHERE, (sha256, before_id, total, index)).fetchone(), op="active_job")
+        return row[0] if row else None
+
+    async def job_status(self, job_id: int) -> Optional[str]:
+        row = await self.read(lambda con: con.execute(SQL_JOB_STATUS, (job_id,)).fetchone(), op="job_status")
+        return row[0] if row else None
+
+    async def pending_jobs(self) -> List[Dict[str, Any]]:
+        """Trabajos en cola o en curso (para reanudar tras un reinicio), en orden de llegada."""
+        rows = await self.read(lambda con: con.execute(SQL_PENDING_JOBS).fetchall(),
+                               op="pending_jobs")
+        return [dict(zip(_JOB_COLS, r)) for r in rows]
+
+    # ---- estado persistente de PTB ----
+
+    async def state_load(self, kind: str) -> List[tuple]:
+        """[(key, data)] de un tipo de estado."""
+        return await self.read(lambda con: con.execute(SQL_STATE_LOAD, (kind,)).fetchall(),
+                               op="state_load")
+
+    async def state_save(self, puts: List[tuple], drops: List[tuple]) -> None:
+        """Upsert de (kind, key, data) y borrado de (kind, key), todo en una transacción."""
+        now = time.time()
+
+        def _save(con: sqlite3.Connection) -> None:
+            con.executemany(SQL_STATE_PUT, [(kind, key, data, now) for kind, key, data in puts])
+            con.executemany(SQL_STATE_DROP, drops)
+        await self.write(_save, op="state_save")
+
+    # ---- control de admisión ----
+
+    async def admission_load(self, max_age: float) -> List[tuple]:
+        """[(chat_id, kind, tokens, at)] guardados hace menos de max_age s."""
+        return await self.read(lambda con: con.execute(SQL_ADMISSION_LOAD, (time.time() - max_age,)).fetchall(),
+                               op="admission_load")
+
+    async def admission_save(self, rows: List[tuple], max_age: float) -> None:
+        """Upsert de (chat_id, kind, tokens, at) y borrado de los que ya estarían llenos."""
+        def _save(con: sqlite3.Connection) -> None:
+            con.executemany(SQL_ADMISSION_PUT, rows)
+            con.execute(SQL_ADMISSION_EXPIRE, (time.time() - max_age,))
+        await self.write(_save, op="admission_save")
+
+    # ---- caché de resultados (content-addressed) ----
+
+    async def cache_get(self, key: str) -> Optional[Dict[str, Any]]:
+        row = await self.read(lambda con: con.execute(SQL_CACHE_GET, (key,)).fetchone(),
+                              op="cache_get")
+        if row is None:
+            return None
+        self.write_future(lambda con: con.execute(SQL_CACHE_TOUCH, (time.time(), key)),
+                          op="cache_touch")  # sin esperar
+        return dict(zip(("summary_json", "run_id", "run_url", "created_at", "audit_id"), row))
+
+    async def cache_put(self, key: str, summary_json: str, run_id: Optional[int],
+                        run_url: Optional[str], audit_id: Optional[int] = None) -> None:
+        now = time.time()
+        row = (key, summary_json, run_id, run_url, len(summary_json), now, now, audit_id)
+        await self.write(lambda con: con.execute(SQL_CACHE_PUT, row), op="cache_put")
+
+    async def cache_evict(self, max_age: float, max_bytes: int) -> int:
+        """Borra entradas caducadas y, si se supera max_bytes, las menos usadas."""
+        def _evict(con: sqlite3.Connection) -> int:
+            n = con.execute(SQL_CACHE_EXPIRE, (time.time() - max_age,)).rowcount
+            total = con.execute(SQL_CACHE_SIZE).fetchone()[0]
+            while total > max_bytes:
+                victims = con.execute(SQL_CACHE_OLDEST).fetchall()
+                if not victims:
+                    break
+                for key, size in victims:
+                    con.execute("DELETE FROM audit_cache WHERE key=?", (key,))
+                    total -= size
+                    n += 1
+                    if total <= max_bytes:
+                        break
+            return n
+        return await self.write(_evict, op="cache_evict")
+
+# ---- instancia compartida + atajos a nivel de módulo ----
+
+_store: Optional[SQLiteStore] = None
+
+def get_store() -> SQLiteStore:
+    global _store
+    if _store is None:
+        _store = SQLiteStore()
+    return _store
+
+def convert_incremental(path: Path = DB_PATH) -> Optional[float]:
+    """Pasa una base antigua a auto_vacuum=INCREMENTAL con un VACUUM completo (reescribe el
+    archivo: necesita el bot parado y espacio libre para una copia). Segundos, o None si ya lo estaba."""
+    con = _open(path)
+    try:
+        if con.execute("PRAGMA auto_vacuum").fetchone()[0] != 0:
+            return None
+        t0 = time.perf_counter()
+        con.execute("PRAGMA auto_vacuum=INCREMENTAL;")
+        con.execute("VACUUM")
+        return time.perf_counter() - t0
+    finally:
+        con.close()
+
+def init() -> None:
+    """Abre la base de datos y crea tablas (solo la primera vez; llamadas extra no hacen nada)."""
+    get_store().start()
+
+def close() -> None:
+    if _store is not None:
+        _store.close()
+
+async def save_audit(chat_id: int, file_name: str, summary: dict | str,
+                     run_id: Optional[int], run_url: Optional[str], **findings) -> int:
+    return await get_store().save_audit(chat_id, file_name, summary, run_id, run_url, **findings)
+
+async def list_audits(chat_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+    return await get_store().list_audits(chat_id, limit)
+
+async def page_audits(chat_id: int, **kw) -> tuple[List[Dict[str, Any]], bool]:
+    return await get_store().page_audits(chat_id, **kw)
+
+async def trends(chat_id: int, **kw) -> Dict[str, Any]:
+    return await get_store().trends(chat_id, **kw)
+
+async def rebuild_rollups(chat_id: Optional[int] = None, archived: Iterable[Dict[str, Any]] = ()) -> None:
+    await get_store().rebuild_rollups(chat_id, archived)
+
+async def findings_index(audit_id: int, chat_id: int) -> Optional[Dict[str, Any]]:
+    return await get_store().findings_index(audit_id, chat_id)
+
+async def create_job(chat_id: int, file_name: str, file_path: str,
+                     sha256: Optional[str] = None, raw_size: Optional[int] = None) -> int:
+    return await get_store().create_job(chat_id, file_name, file_path, sha256, raw_size)
+
+async def update_job(job_id: int, status: Optional[str] = None, run_id: Optional[int] = None,
+                     error: Optional[str] = None) -> None:
+    await get_store().update_job(job_id, status, run_id, error)
+
+async def pending_jobs() -> List[Dict[str, Any]]:
+    return await get_store().pending_jobs()
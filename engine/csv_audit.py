@@ -0,0 +1,189 @@
+# engine/csv_audit.py
+# ─────────────────────────────────────────────────────────────────────────────
+# Motor de auditoría local (streaming) para CSV contables.
+# - Una sola pasada sobre el CSV, memoria constante por grupo tx_id.
+# - Produce el mismo esquema de resumen que el Job de Databricks (lo lee /audits):
+#     invalid_date / duplicates_tx / unbalanced_tx / required_nulls → {"count", ...}
+# - Los agregados son fusionables (merge) para poder auditar por trozos.
+# - Opcional: hallazgos fila a fila completos (engine/findings.py) además del resumen.
+# ─────────────────────────────────────────────────────────────────────────────
+
+import csv, gzip, io, datetime as dt
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+
+from engine.findings import Findings
+
+REQUIRED = ("tx_id", "date", "account", "debit", "credit")
+RULES_VERSION = "1"   # súbelo si cambian las reglas (invalida caché de resultados)
+MAX_EXAMPLES = 10     # nº máximo de líneas / tx_id de ejemplo por regla
+
+_DATE_OK: Dict[str, bool] = {}   # caché de validez de fechas (hay pocas distintas)
+
+def _valid_date(s: str) -> bool:
+    ok = _DATE_OK.get(s)
+    if ok is None:
+        try:
+            dt.datetime.strptime(s, "%Y-%m-%d")
+            ok = True
+        except ValueError:
+            ok = False
+        if len(_DATE_OK) < 100_000:
+            _DATE_OK[s] = ok
+    return ok
+
+def _num(s: str) -> Optional[float]:
+    """Importe → float. Vacío o ilegible → None (cuenta como nulo)."""
+    s = s.strip()
+    if not s:
+        return None
+    try:
+        return float(s)
+    except ValueError:
+        try:
+            return float(s.replace(".", "").replace(",", "."))   # 1.234,56
+        except ValueError:
+            return None
+
+def _push(examples: List, value: Any) -> None:
+    if len(examples) < MAX_EXAMPLES:
+        examples.append(value)
+
+class AuditAccumulator:
+    """
+    Agregados parciales de una auditoría.
+    - feed(row, lineno): procesa una fila (dict por cabecera).
+    - merge(other, offset): fusiona otro acumulador cuyas líneas van desplazadas 'offset'.
+    - summary(): dict con el esquema del Job.
+    Por tx_id guarda [debe, haber, nº líneas, {clave_línea: 1ª línea}, 1ª línea del tx].
+    Con findings, anota además cada fila que incumple una regla.
+    """
+
+    def __init__(self, findings: Optional[Findings] = None) -> None:
+        self.findings = findings
+        self.rows = 0
+        self.invalid_date = 0
+        self.invalid_date_lines: List[int] = []
+        self.required_nulls = 0
+        self.required_nulls_lines: List[int] = []
+        self.duplicates = 0
+        self.duplicates_lines: List[int] = []
+        self.tx: Dict[str, list] = {}
+
+    def feed(self, row: Dict[str, str], lineno: int) -> None:
+        self.rows += 1
+        tx_id = (row.get("tx_id") or "").strip()
+        date = (row.get("date") or "").strip()
+        account = (row.get("account") or "").strip()
+        debit = _num(row.get("debit") or "")
+        credit = _num(row.get("credit") or "")
+
+        if not tx_id or not date or not account or debit is None or credit is None:
+            self.required_nulls += 1
+            _push(self.required_nulls_lines, lineno)
+            if self.findings is not None:
+                self.findings.add("required_nulls", lineno, tx_id)
+        if date and not _valid_date(date):
+            self.invalid_date += 1
+            _push(self.invalid_date_lines, lineno)
+            if self.findings is not None:
+                self.findings.add("invalid_date", lineno, tx_id)
+        if not tx_id:
+            return
+
+        g = self.tx.get(tx_id)
+        if g is None:
+            g = self.tx[tx_id] = [0.0, 0.0, 0, {}, lineno]
+        g[0] += debit or 0.0
+        g[1] += credit or 0.0
+        g[2] += 1
+        key = (date, account, debit, credit)
+        if key in g[3]:
+            self.duplicates += 1
+            _push(self.duplicates_lines, lineno)
+            if self.findings is not None:
+                self.findings.add("duplicates_tx", lineno, tx_id)
+        else:
+            g[3][key] = lineno
+
+    def merge(self, other: "AuditAccumulator", offset: int = 0) -> "AuditAccumulator":
+        self.rows += other.rows
+        self.invalid_date += other.invalid_date
+        self.required_nulls += other.required_nulls
+        self.duplicates += other.duplicates
+        dup_lines = [n + offset for n in other.duplicates_lines]
+        if self.findings is not None and other.findings is not None:
+            self.findings.merge(other.findings, offset)
+
+        for tx_id, (d, c, n, keys, first) in other.tx.items():
+            g = self.tx.get(tx_id)
+            if g is None:
+                self.tx[tx_id] = [d, c, n, {k: ln + offset for k, ln in keys.items()}, first + offset]
+                continue
+            g[0] += d
+            g[1] += c
+            g[2] += n
+            for k, ln in keys.items():
+                if k in g[3]:       # 1ª aparición en 'other' es duplicado aquí
+                    self.duplicates += 1
+                    dup_lines.append(ln + offset)
+                    if self.findings is not None:
+                        self.findings.add("duplicates_tx", ln + offset, tx_id)
+                else:
+                    g[3][k] = ln + offset
+
+        self.invalid_date_lines = sorted(
+            self.invalid_date_lines + [n + offset for n in other.invalid_date_lines])[:MAX_EXAMPLES]
+        self.required_nulls_lines = sorted(
+            self.required_nulls_lines + [n + offset for n in other.required_nulls_lines])[:MAX_EXAMPLES]
+        self.duplicates_lines = sorted(self.duplicates_lines + dup_lines)[:MAX_EXAMPLES]
+        return self
+
+    def unbalanced(self) -> List[str]:
+        return [tx_id for tx_id, g in self.tx.items() if round(g[0] - g[1], 2) != 0]
+
+    def summary(self, backend: str = "streaming") -> Dict[str, Any]:
+        unbalanced = self.unbalanced()
+        if self.findings is not None and "unbalanced_tx" not in self.findings.rules:
+            self.findings.extend("unbalanced_tx", (self.tx[t][4] for t in unbalanced), unbalanced)
+        return {
+            "engine": "local",
+            "backend": backend,
+            "rules_version": RULES_VERSION,
+            "rows": self.rows,
+            "transactions": len(self.tx),
+            "invalid_date": {"count": self.invalid_date, "lines": self.invalid_date_lines},
+            "duplicates_tx": {"count": self.duplicates, "lines": self.duplicates_lines},
+            "unbalanced_tx": {"count": len(unbalanced), "tx_ids": unbalanced[:MAX_EXAMPLES]},
+            "required_nulls": {"count": self.required_nulls, "lines": self.required_nulls_lines},
+        }
+
+def check_header(fields: Optional[List[str]]) -> List[str]:
+    """Normaliza la cabecera y falla si faltan columnas obligatorias."""
+    cols = [(f or "").strip().lower() for f in (fields or [])]
+    missing = [c for c in REQUIRED if c not in cols]
+    if missing:
+        raise ValueError(f"Faltan columnas obligatorias: {', '.join(missing)}")
+    return cols
+
+def audit_lines(lines: Iterable[str], findings: Optional[Findings] = None) -> Dict[str, Any]:
+    """Audita un iterable de líneas de texto (con cabecera). Si se pasa findings, lo rellena."""
+    reader = csv.reader(lines)
+    cols = check_header(next(reader, None))
+    acc = AuditAccumulator(findings)
+    for lineno, values in enumerate(reader, start=2):
+        if not values:
+            continue
+        acc.feed(dict(zip(cols, values)), lineno)
+    return acc.summary()
+
+def audit_bytes(data: bytes, findings: Optional[Findings] = None) -> Dict[str, Any]:
+    """Audita un CSV en memoria (UTF-8, con o sin BOM)."""
+    return audit_lines(io.StringIO(data.decode("utf-8-sig", errors="replace"), newline=""), findings)
+
+def audit_path(path: str | Path, findings: Optional[Findings] = None) -> Dict[str, Any]:
+    """Audita un CSV en disco sin cargarlo entero (.gz soportado)."""
+    path = Path(path)
+    opener = gzip.open if path.suffix == ".gz" else open
+    with opener(path, "rt", encoding="utf-8-sig", errors="replace", newline="") as f:
+        return audit_lines(f, findings)
@@ -0,0 +1,152 @@
+# engine/findings.py
+# ─────────────────────────────────────────────────────────────────────────────
+# Hallazgos fila a fila de una auditoría: (regla, línea, tx_id) por cada fila
+# que incumple una regla (en unbalanced_tx, una por transacción: su 1ª línea).
+# - Findings: columnas por regla (array de líneas + lista de tx_id), baratas de
+#   rellenar desde los motores y de enviar entre procesos (engine/parallel.py).
+#   Como mucho AUDIT_FINDINGS_MAX_PER_RULE por regla, ya al recogerlos: un CSV con
+#   millones de filas malas no llena la memoria (el resumen sigue contándolas todas).
+# - Almacenamiento compacto: bloques de BLOCK_SIZE hallazgos por regla; en cada
+#   bloque, líneas en delta (uint32) + tx_id separados por \x1f, comprimidos con
+#   zstd (si está instalado `zstandard`) o zlib. Ver services/findings.py.
+# ─────────────────────────────────────────────────────────────────────────────
+
+import os, struct, zlib
+from itertools import islice
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import zstandard
+except ImportError:       # pragma: no cover - dependencia opcional
+    zstandard = None
+
+RULE_ORDER = ("invalid_date", "duplicates_tx", "unbalanced_tx", "required_nulls")
+BLOCK_SIZE = 4096
+CODEC = "zstd" if zstandard is not None else "zlib"
+MAX_PER_RULE = int(os.getenv("AUDIT_FINDINGS_MAX_PER_RULE", "1000000"))
+
+class Findings:
+    """{regla: (líneas, tx_ids)} con las filas que incumplen cada regla (hasta max_per_rule)."""
+
+    def __init__(self, max_per_rule: Optional[int] = MAX_PER_RULE) -> None:
+        self.max_per_rule = max_per_rule
+        self.rules: Dict[str, Tuple[array, List[str]]] = {}
+
+    def _cols(self, rule: str) -> Tuple[array, List[str]]:
+        cols = self.rules.get(rule)
+        if cols is None:
+            cols = self.rules[rule] = (array("q"), [])
+        return cols
+
+    def room(self, rule: str) -> Optional[int]:
+        """Cuántos hallazgos más caben en 'rule' (None = sin tope)."""
+        if self.max_per_rule is None:
+            return None
+        cols = self.rules.get(rule)
+        return max(0, self.max_per_rule - (len(cols[0]) if cols else 0))
+
+    def add(self, rule: str, line: int, tx_id: str) -> None:
+        lines, txs = self._cols(rule)
+        if self.max_per_rule is not None and len(lines) >= self.max_per_rule:
+            return
+        lines.append(line)
+        txs.append(tx_id)
+
+    def extend(self, rule: str, lines: Iterable[int], tx_ids: Iterable[str]) -> None:
+        room = self.room(rule)
+        cols = self._cols(rule)
+        if room is not None:
+            lines, tx_ids = islice(lines, room), islice(tx_ids, room)
+        cols[0].extend(lines)
+        cols[1].extend(tx_ids)
+
+    def merge(self, other: "Findings", offset: int = 0) -> "Findings":
+        for rule, (lines, txs) in other.rules.items():
+            self.extend(rule, (n + offset for n in lines) if offset else lines, txs)
+        return self
+
+    def __len__(self) -> int:
+        return sum(len(lines) for lines, _ in self.rules.values())
+
+    def counts(self) -> Dict[str, int]:
+        return {rule: len(lines) for rule, (lines, _) in self.rules.items()}
+
+    def sorted_rules(self) -> Iterator[Tuple[str, List[int], List[str]]]:
+        """(regla, líneas, tx_ids) ordenados por línea, reglas en orden estándar."""
+        names = sorted(self.rules, key=lambda r: (RULE_ORDER.index(r) if r in RULE_ORDER else 99, r))
+        for rule in names:
+            lines, txs = self.rules[rule]
+            order = sorted(range(len(lines)), key=lines.__getitem__)
+            yield rule, [lines[i] for i in order], [txs[i] for i in order]
+
+    # ---- formato JSON (salida del job de Databricks / stub) ----
+
+    def to_dict(self) -> Dict[str, Dict[str, list]]:
+        return {rule: {"lines": list(lines), "tx_ids": txs} for rule, (lines, txs) in self.rules.items()}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Dict[str, list]]) -> "Findings":
+        f = cls()
+        for rule, cols in data.items():
+            f.extend(rule, (int(n) for n in cols.get("lines", [])), (str(t) for t in cols.get("tx_ids", [])))
+        return f
+
+    @classmethod
+    def from_summary(cls, summary: Dict[str, Any]) -> "Findings":
+        """Solo los ejemplos del resumen (cuando el motor no devuelve hallazgos completos)."""
+        f = cls()
+        for rule in RULE_ORDER:
+            block = summary.get(rule) if isinstance(summary, dict) else None
+            if not isinstance(block, dict):
+                continue
+            if "lines" in block:
+                f.extend(rule, block["lines"], [""] * len(block["lines"]))
+            elif "tx_ids" in block:
+                f.extend(rule, [0] * len(block["tx_ids"]), block["tx_ids"])
+        return f
+
+# ---- bloques comprimidos ----
+
+def _compress(raw: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=6).compress(raw)
+    return zlib.compress(raw, 6)
+
+def _decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Hallazgos comprimidos con zstd: instala `zstandard`")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+def encode_block(lines: List[int], tx_ids: List[str], codec: str = CODEC) -> bytes:
+    """Líneas (ordenadas) en delta + tx_ids, en columnas dentro de un único comprimido."""
+    deltas = array("I", (b - a for a, b in zip([0] + lines[:-1], lines)))
+    raw = struct.pack("<I", len(lines)) + deltas.tobytes() + "\x1f".join(tx_ids).encode("utf-8")
+    return _compress(raw, codec)
+
+def decode_block(data: bytes, codec: str) -> Tuple[List[int], List[str]]:
+    raw = _decompress(data, codec)
+    (n,) = struct.unpack_from("<I", raw)
+    deltas = array("I")
+    deltas.frombytes(raw[4:4 + 4 * n])
+    lines, acc = [], 0
+    for d in deltas:
+        acc += d
+        lines.append(acc)
+    tail = raw[4 + 4 * n:].decode("utf-8")
+    return lines, (tail.split("\x1f") if n else [])
+
+def encode_blocks(findings: Findings, max_per_rule: Optional[int] = None,
+                  codec: str = CODEC) -> List[Tuple[str, int, int, int, str, bytes]]:
+    """Findings → filas (regla, nº bloque, n, 1ª línea, codec, datos) para audit_findings."""
+    out = []
+    for rule, lines, txs in findings.sorted_rules():
+        if max_per_rule is not None:
+            lines, txs = lines[:max_per_rule], txs[:max_per_rule]
+        for b, start in enumerate(range(0, len(lines), BLOCK_SIZE)):
+            chunk = lines[start:start + BLOCK_SIZE]
+            out.append((rule, b, len(chunk), chunk[0], codec,
+                        encode_block(chunk, txs[start:start + BLOCK_SIZE], codec)))
+    return out
@@ -0,0 +1,176 @@
+# engine/parallel.py
+# ─────────────────────────────────────────────────────────────────────────────
+# Auditoría paralela multi-núcleo para CSV muy grandes:
+# - Divide el archivo en rangos de bytes alineados a fin de línea (chunk_bytes).
+# - Cada rango se audita en un proceso del pool → parcial compacto (arrays):
+#   sumas debe/haber por tx_id y hash de 64 bits de la 1ª aparición de cada línea
+#   (tx_id, date, account, debit, credit) con su nº de línea.
+# - Los parciales se fusionan EN ORDEN con su desplazamiento de línea, así las
+#   transacciones que cruzan trozos cuadran y el resumen es idéntico al de
+#   engine/csv_audit.py.
+# - Con findings=..., cada parcial trae también sus hallazgos fila a fila (líneas
+#   relativas al trozo) y la fusión añade los duplicados entre trozos.
+# - El pool es compartido (lo usan varios workers de la cola desde sus hilos) y
+#   arranca sus procesos con forkserver (spawn donde no existe): hacer fork de un
+#   proceso con hilos puede dejar cerrojos tomados en el hijo.
+# Limitación: se asume que ningún campo entrecomillado contiene saltos de línea.
+# ─────────────────────────────────────────────────────────────────────────────
+
+import csv, gzip, hashlib, io, multiprocessing, os, shutil, tempfile, threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from engine.csv_audit import AuditAccumulator, MAX_EXAMPLES, check_header
+from engine.findings import Findings
+
+PARALLEL_WORKERS = int(os.getenv("AUDIT_PARALLEL_WORKERS", "0")) or (os.cpu_count() or 1)
+CHUNK_BYTES = int(os.getenv("AUDIT_CHUNK_BYTES", str(32 << 20)))   # 32 MiB
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_workers = 0
+_pool_lock = threading.Lock()   # get_pool() se llama desde varios hilos (asyncio.to_thread)
+
+def _mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+def get_pool(workers: int = PARALLEL_WORKERS) -> ProcessPoolExecutor:
+    """Pool de procesos compartido (arrancar procesos cuesta: se reutiliza)."""
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool_workers != workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)   # lo que ya tenía encolado termina igualmente
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context())
+            _pool_workers = workers
+        return _pool
+
+def shutdown_pool() -> None:
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+def split_ranges(path: str | Path, chunk_bytes: int = CHUNK_BYTES) -> Tuple[List[str], List[Tuple[int, int]]]:
+    """Cabecera + rangos [inicio, fin) que empiezan y acaban en frontera de fila."""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        header = f.readline()
+        cols = check_header(next(csv.reader([header.decode("utf-8-sig", errors="replace")]), None))
+        ranges: List[Tuple[int, int]] = []
+        start = f.tell()
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            if f.tell() < size:
+                f.readline()               # avanza hasta el final de la fila en curso
+            end = f.tell()
+            ranges.append((start, end))
+            start = end
+    return cols, ranges
+
+def _key_hash(tx_id: str, key: tuple) -> int:
+    raw = "\x1f".join((tx_id, key[0], key[1], repr(key[2]), repr(key[3]))).encode()
+    return int.from_bytes(hashlib.blake2b(raw, digest_size=8).digest(), "little", signed=True)
+
+def audit_range(path: str, start: int, end: int, cols: List[str],
+                findings: bool = False) -> Dict[str, Any]:
+    """Audita un rango (en un proceso hijo) y devuelve un parcial compacto y barato de enviar."""
+    with open(path, "rb") as f:
+        f.seek(start)
+        text = f.read(end - start).decode("utf-8", errors="replace")
+    acc = AuditAccumulator(Findings() if findings else None)
+    records = 0
+    for records, values in enumerate(csv.reader(io.StringIO(text, newline="")), start=1):
+        if values:
+            acc.feed(dict(zip(cols, values)), records)   # línea relativa al rango
+
+    keys, key_lines, key_tx = array("q"), array("q"), array("q")
+    for i, (tx_id, g) in enumerate(acc.tx.items()):
+        for k, ln in g[3].items():
+            keys.append(_key_hash(tx_id, k))
+            key_lines.append(ln)
+            key_tx.append(i)
+    return {
+        "records": records, "rows": acc.rows,
+        "invalid_date": (acc.invalid_date, acc.invalid_date_lines),
+        "required_nulls": (acc.required_nulls, acc.required_nulls_lines),
+        "duplicates": (acc.duplicates, acc.duplicates_lines),
+        "tx_ids": list(acc.tx),
+        "debit": array("d", (g[0] for g in acc.tx.values())),
+        "credit": array("d", (g[1] for g in acc.tx.values())),
+        "first_lines": array("q", (g[4] for g in acc.tx.values())),
+        "keys": keys, "key_lines": key_lines,
+        "key_tx": key_tx if findings else None,
+        "findings": acc.findings,
+    }
+
+def _first(lines: List[int], more: List[int]) -> List[int]:
+    return sorted(lines + more)[:MAX_EXAMPLES]
+
+def merge_parts(parts: List[Dict[str, Any]], findings: Optional[Findings] = None) -> AuditAccumulator:
+    """Fusiona parciales en orden de archivo (las líneas se desplazan por trozo)."""
+    total = AuditAccumulator(findings)
+    seen: Dict[int, int] = {}
+    offset = 1   # la cabecera es la línea 1
+    for p in parts:
+        total.rows += p["rows"]
+        n, lines = p["invalid_date"]
+        total.invalid_date += n
+        total.invalid_date_lines = _first(total.invalid_date_lines, [x + offset for x in lines])
+        n, lines = p["required_nulls"]
+        total.required_nulls += n
+        total.required_nulls_lines = _first(total.required_nulls_lines, [x + offset for x in lines])
+        n, lines = p["duplicates"]
+        total.duplicates += n
+        dup_lines = [x + offset for x in lines]
+        if findings is not None and p["findings"] is not None:
+            findings.merge(p["findings"], offset)
+
+        for tx_id, d, c, first in zip(p["tx_ids"], p["debit"], p["credit"], p["first_lines"]):
+            g = total.tx.get(tx_id)
+            if g is None:
+                total.tx[tx_id] = [d, c, 0, None, first + offset]
+            else:
+                g[0] += d
+                g[1] += c
+        for i, (h, ln) in enumerate(zip(p["keys"], p["key_lines"])):
+            if h in seen:           # ya apareció en un trozo anterior → duplicado
+                total.duplicates += 1
+                dup_lines.append(ln + offset)
+                if findings is not None:
+                    findings.add("duplicates_tx", ln + offset, p["tx_ids"][p["key_tx"][i]])
+            else:
+                seen[h] = ln + offset
+        total.duplicates_lines = _first(total.duplicates_lines, dup_lines)
+        offset += p["records"]
+    return total
+
+def _plain_copy(path: Path) -> Tuple[Path, bool]:
+    """Los .gz no se pueden trocear por bytes: se descomprimen a un temporal."""
+    if path.suffix != ".gz":
+        return path, False
+    fd, tmp = tempfile.mkstemp(suffix=".csv", dir=path.parent)
+    with os.fdopen(fd, "wb") as out, gzip.open(path, "rb") as src:
+        shutil.copyfileobj(src, out, 1 << 20)
+    return Path(tmp), True
+
+def audit_path(path: str | Path, *, workers: int = PARALLEL_WORKERS,
+               chunk_bytes: int = CHUNK_BYTES, findings: Optional[Findings] = None) -> Dict[str, Any]:
+    """Audita un CSV (o .gz) repartiendo trozos entre 'workers' procesos."""
+    plain, is_tmp = _plain_copy(Path(path))
+    want = findings is not None
+    try:
+        cols, ranges = split_ranges(plain, chunk_bytes)
+        if workers <= 1 or len(ranges) <= 1:
+            parts = [audit_range(str(plain), s, e, cols, want) for s, e in ranges]
+        else:
+            pool = get_pool(workers)
+            futures = [pool.submit(audit_range, str(plain), s, e, cols, want) for s, e in ranges]
+            parts = [f.result() for f in futures]
+    finally:
+        if is_tmp:
+            plain.unlink(missing_ok=True)
+    return merge_parts(parts, findings).summary(backend="parallel")
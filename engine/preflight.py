@@ -0,0 +1,180 @@
+# engine/preflight.py
+# ─────────────────────────────────────────────────────────────────────────────
+# Pre-chequeo de un CSV con solo su primer trozo (antes de descargar el resto):
+# - Codificación: BOM (UTF-8 / UTF-16), UTF-8 válido o, si no, cp1252/latin-1
+#   (típico de Excel en español: tildes y ñ en 'desc').
+# - Separador: ',', ';', tabulador o '|' (el que deja en la cabecera las
+#   columnas obligatorias de engine/csv_audit.py).
+# - Estimación de filas por tamaño medio de línea (exacta si cabe en la muestra).
+# - Rechazo temprano (ValueError) de binarios, comprimidos, vacíos o sin columnas.
+# - Normalizer: si no es UTF-8 con comas, reescribe en streaming a UTF-8 + ','
+#   → motores locales y job de Databricks ven siempre el mismo formato.
+#   La codificación sale de la muestra; con UTF-8 sin BOM el Normalizer valida el
+#   resto: si aparece un byte inválido y hasta ahí todo era ASCII pasa a cp1252;
+#   si ya había UTF-8 no ASCII el archivo mezcla codificaciones → ValueError.
+# ─────────────────────────────────────────────────────────────────────────────
+
+import codecs, csv, io
+from dataclasses import dataclass
+from typing import List, Optional
+
+from engine.csv_audit import REQUIRED, check_header
+
+HEAD_BYTES = 64 * 1024        # muestra: basta para cabecera + cientos de filas
+DELIMITERS = (",", ";", "\t", "|")
+_MAGIC = ((b"\x1f\x8b", "comprimido con gzip"), (b"PK\x03\x04", "un .zip o .xlsx"),
+          (b"%PDF", "un PDF"), (b"\xd0\xcf\x11\xe0", "un Excel .xls"))
+
+@dataclass
+class Preflight:
+    encoding: str
+    delimiter: str
+    columns: List[str]
+    rows_estimate: Optional[int]    # None si no se conoce el tamaño total
+    exact: bool                     # la muestra era el archivo entero
+
+    @property
+    def normalize(self) -> bool:
+        return self.delimiter != "," or self.encoding not in ("utf-8", "utf-8-sig")
+
+    def describe(self) -> str:
+        """Texto corto para el usuario: filas estimadas y conversión aplicada."""
+        parts = []
+        if self.rows_estimate is not None:
+            parts.append(f"{self.rows_estimate} filas" if self.exact else f"~{self.rows_estimate} filas")
+        if self.encoding not in ("utf-8", "utf-8-sig"):
+            parts.append(f"convertido de {self.encoding}")
+        if self.delimiter != ",":
+            parts.append(f"separador {self.delimiter!r}")
+        return ", ".join(parts)
+
+def _encoding(head: bytes) -> str:
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig"
+    if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return "utf-16"
+    try:   # final=False: la muestra puede cortar un carácter multibyte
+        codecs.getincrementaldecoder("utf-8")().decode(head, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    try:
+        head.decode("cp1252")
+        return "cp1252"
+    except UnicodeDecodeError:
+        return "latin-1"
+
+def _complete(text: str) -> int:
+    """Índice tras el último salto de línea que no cae dentro de un campo entrecomillado."""
+    cut = text.rfind("\n") + 1
+    odd = text.count('"', 0, cut) % 2
+    while cut and odd:
+        prev = text.rfind("\n", 0, cut - 1) + 1
+        odd ^= text.count('"', prev, cut) % 2
+        cut = prev
+    return cut
+
+def _header(sample: str) -> tuple[str, List[str]]:
+    """(separador, columnas normalizadas): el candidato que encuentra más columnas obligatorias."""
+    best = None
+    for d in DELIMITERS:
+        cols = [c.strip().lower() for c in next(csv.reader(io.StringIO(sample, newline=""), delimiter=d), [])]
+        found = sum(c in cols for c in REQUIRED)
+        if best is None or found > best[0]:
+            best = (found, d, cols)
+    return best[1], best[2]
+
+def inspect(head: bytes, total_size: Optional[int] = None) -> Preflight:
+    """Analiza el primer trozo; ValueError (mensaje para el usuario) si el archivo no es auditable."""
+    head = head[:HEAD_BYTES]
+    exact = total_size is not None and total_size <= len(head)
+    if not head.strip():
+        raise ValueError("el archivo está vacío")
+    for magic, what in _MAGIC:
+        if head.startswith(magic):
+            raise ValueError(f"parece {what}, no un CSV de texto")
+    encoding = _encoding(head)
+    if encoding != "utf-16" and b"\x00" in head:
+        raise ValueError("contiene bytes nulos: no parece un CSV de texto")
+
+    text = codecs.getincrementaldecoder(encoding)(errors="replace").decode(head, final=exact)
+    cut = len(text) if exact else _complete(text)
+    if not cut:
+        raise ValueError(f"sin saltos de línea en los primeros {len(head) // 1024} KB")
+    sample = text[:cut]
+    delimiter, cols = _header(sample)
+    check_header(cols)   # falta alguna columna → ValueError
+
+    rows = sum(1 for r in csv.reader(io.StringIO(sample, newline=""), delimiter=delimiter) if r) - 1
+    if exact and rows <= 0:
+        raise ValueError("no tiene filas de datos (solo cabecera)")
+    estimate = None
+    if exact:
+        estimate = rows
+    elif total_size and rows > 0:
+        sample_bytes = len(head) * cut / len(text)   # aprox.: la muestra es casi todo el trozo
+        estimate = round(rows * total_size / sample_bytes)
+    return Preflight(encoding, delimiter, cols, estimate, exact)
+
+class Normalizer:
+    """Trozos en la codificación/separador detectados → CSV UTF-8 separado por comas.
+    'encoding' puede pasar de utf-8 a cp1252 a mitad de archivo (ver cabecera)."""
+
+    def __init__(self, pf: Preflight) -> None:
+        self.delimiter = pf.delimiter
+        self.encoding = pf.encoding
+        strict = pf.encoding == "utf-8"
+        self._decoder = codecs.getincrementaldecoder(pf.encoding)(errors="strict" if strict else "replace")
+        self._ascii = strict   # UTF-8 y todo lo visto hasta ahora es ASCII (vale igual en cp1252)
+        self._pending = ""   # final de trozo que puede seguir dentro de un campo entrecomillado
+
+    @property
+    def passthrough(self) -> bool:
+        """UTF-8 sin BOM y con comas: los bytes salen tal cual, solo se validan."""
+        return self.encoding == "utf-8" and self.delimiter == ","
+
+    def _decode(self, chunk: bytes, final: bool = False) -> str:
+        if self.encoding != "utf-8":
+            return self._decoder.decode(chunk, final)
+        held = self._decoder.getstate()[0]   # inicio de un carácter multibyte del trozo anterior
+        if self._ascii and not held and chunk.isascii():
+            return chunk.decode("ascii")
+        try:
+            text = self._decoder.decode(chunk, final)
+        except UnicodeDecodeError as e:
+            data = held + chunk
+            if not (self._ascii and data[:e.start].isascii()):
+                raise ValueError("mezcla UTF-8 con otra codificación a partir del byte "
+                                 "inválido; guárdalo entero como UTF-8") from None
+            # la muestra era UTF-8 solo por ser ASCII: en realidad es un export ANSI
+            self.encoding = "cp1252"
+            self._decoder = codecs.getincrementaldecoder("cp1252")(errors="replace")
+            return self._decoder.decode(data, final)
+        self._ascii = self._ascii and text.isascii()
+        return text
+
+    def _rewrite(self, text: str) -> bytes:
+        if self.delimiter == ",":
+            return text.encode("utf-8")
+        out = io.StringIO()
+        csv.writer(out, lineterminator="\n").writerows(
+            csv.reader(io.StringIO(text, newline=""), delimiter=self.delimiter))
+        return out.getvalue().encode("utf-8")
+
+    def feed(self, chunk: bytes) -> bytes:
+        if self.passthrough:
+            data = self._decoder.getstate()[0] + chunk
+            text = self._decode(chunk)
+            if self.passthrough:   # válido: sale tal cual salvo un carácter a medias del final
+                return data[:len(data) - len(self._decoder.getstate()[0])]
+            return text.encode("utf-8")   # acaba de pasar a cp1252
+        text = self._pending + self._decode(chunk)
+        if self.delimiter == ",":   # solo transcodificar: no hace falta respetar filas
+            return text.encode("utf-8")
+        cut = _complete(text)
+        self._pending = text[cut:]
+        return self._rewrite(text[:cut])
+
+    def flush(self) -> bytes:
+        text, self._pending = self._pending + self._decode(b"", final=True), ""
+        return self._rewrite(text) if text else b""
@@ -0,0 +1,38 @@
+# engine/rules.py
+# ─────────────────────────────────────────────────────────────────────────────
+# Registro de reglas del motor columnar (engine/columnar.py).
+# Cada regla recibe el Ledger (columnas NumPy) y devuelve el bloque del resumen
+# ({"count": …, "lines" | "tx_ids": […]}, más "_rows" opcional con las posiciones de
+# todas las filas que la incumplen → hallazgos fila a fila). Para añadir un chequeo:
+#
+#     @rule("negative_amounts")
+#     def negative_amounts(lg):
+#         mask = (lg.debit < 0) | (lg.credit < 0)
+#         return lines_result(lg, mask)
+#
+# Las reglas se ejecutan en orden de registro.
+# Solo las ejecuta el backend columnar: streaming (engine/csv_audit.py), paralelo y
+# Databricks aplican las cuatro de BUILTIN. Por eso una regla extra cambia la versión
+# de reglas del columnar (version() → clave de caché y "rules_version" del resumen):
+# sus resultados no se mezclan con los de los demás backends.
+# ─────────────────────────────────────────────────────────────────────────────
+
+from typing import Any, Callable, Dict
+
+RULES: Dict[str, Callable[[Any], Dict[str, Any]]] = {}
+BUILTIN = ("invalid_date", "duplicates_tx", "unbalanced_tx", "required_nulls")
+
+def rule(name: str):
+    """Decorador: registra (o sustituye) la regla 'name'."""
+    def deco(fn: Callable[[Any], Dict[str, Any]]):
+        RULES[name] = fn
+        return fn
+    return deco
+
+def version(base: str) -> str:
+    """'base' si solo están las reglas comunes; si no, 'base+regla_extra+…'."""
+    extra = [name for name in RULES if name not in BUILTIN]
+    return "+".join([base, *extra])
+
+def run_rules(ledger) -> Dict[str, Dict[str, Any]]:
+    return {name: fn(ledger) for name, fn in RULES.items()}
@@ -0,0 +1,81 @@
+# handlers/audit_detail.py
+# /audit_detail <id> [regla] — filas que incumplen cada regla en una auditoría del chat,
+# paginadas con botones (solo se descomprimen los bloques de la página, ver services/findings.py).
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import CallbackQueryHandler, ContextTypes, CommandHandler
+from db import sqlite_store as store
+from engine.findings import RULE_ORDER
+from services import findings as findings_svc
+
+USAGE = "Uso: /audit_detail <id> [" + "|".join(RULE_ORDER) + "]"
+
+def _rule(arg: str) -> str | None:
+    """Nombre de regla completo o prefijo único (p.ej. 'dup' → duplicates_tx)."""
+    arg = arg.lower()
+    matches = [r for r in RULE_ORDER if r.startswith(arg)]
+    return matches[0] if len(matches) == 1 else None
+
+def _overview(idx: dict):
+    lines = [f"Auditoría #{idx['id']} · {idx['file_name']}"]
+    buttons = []
+    for rule in RULE_ORDER:
+        count = idx[rule]
+        stored = idx["rules"].get(rule, (0, 0))[0]
+        extra = f" (guardados {stored})" if count is not None and stored != count else ""
+        lines.append(f"  {rule}: {count if count is not None else '?'}{extra}")
+        if stored:
+            buttons.append([InlineKeyboardButton(f"{rule} ({stored})", callback_data=f"det:{idx['id']}:{rule}:0")])
+    if not buttons:
+        lines.append("\nSin detalle fila a fila guardado (caducado por retención o sin hallazgos).")
+    return "\n".join(lines), InlineKeyboardMarkup(buttons) if buttons else None
+
+async def _rule_page(idx: dict, rule: str, page_no: int):
+    stored = idx["rules"].get(rule, (0, 0))[0]
+    if not stored:
+        return f"Auditoría #{idx['id']}: sin filas guardadas para {rule}.", None
+    last_page = (stored - 1) // findings_svc.PAGE_SIZE
+    page_no = max(0, min(page_no, last_page))
+    rows = await findings_svc.page(idx["id"], rule, page_no)
+    start = page_no * findings_svc.PAGE_SIZE
+    head = f"#{idx['id']} · {idx['file_name']} · {rule}: {start + 1}–{start + len(rows)} de {stored}"
+    if idx[rule] is not None and stored < idx[rule]:
+        head += f" (el resumen cuenta {idx[rule]})"
+    body = [f"  línea {line} · tx {tx or '—'}" if line else f"  tx {tx}" for line, tx in rows]
+
+    buttons = []
+    if page_no > 0:
+        buttons.append(InlineKeyboardButton("« Anterior", callback_data=f"det:{idx['id']}:{rule}:{page_no - 1}"))
+    if page_no < last_page:
+        buttons.append(InlineKeyboardButton("Siguiente »", callback_data=f"det:{idx['id']}:{rule}:{page_no + 1}"))
+    return head + "\n" + "\n".join(body), InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def audit_detail_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    args = context.args or []
+    if not args or not args[0].lstrip("#").isdigit():
+        return await update.message.reply_text(USAGE)
+    rule = None
+    if len(args) > 1:
+        rule = _rule(args[1])
+        if rule is None:
+            return await update.message.reply_text(f"Regla desconocida: {args[1]}\n{USAGE}")
+    audit_id = int(args[0].lstrip("#"))
+    idx = await store.findings_index(audit_id, update.effective_chat.id)
+    if idx is None:
+        return await update.message.reply_text(f"No hay ninguna auditoría #{audit_id} en este chat.")
+    text, keyboard = await _rule_page(idx, rule, 0) if rule else _overview(idx)
+    await update.message.reply_text(text, reply_markup=keyboard)
+
+async def audit_detail_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Botones: det:<id>:<regla>:<página>."""
+    query = update.callback_query
+    await query.answer()
+    _, audit_id, rule, page_no = query.data.split(":")
+    idx = await store.findings_index(int(audit_id), update.effective_chat.id)
+    if idx is None:
+        return await query.edit_message_reply_markup(None)
+    text, keyboard = await _rule_page(idx, rule, int(page_no))
+    await query.edit_message_text(text, reply_markup=keyboard)
+
+def register_handlers(app):
+    app.add_handler(CommandHandler("audit_detail", audit_detail_cmd))
+    app.add_handler(CallbackQueryHandler(audit_detail_cb, pattern=r"^det:"))
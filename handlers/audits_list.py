@@ -1,38 +1,115 @@
 # handlers/audits_list.py
+# /audits [archivo:<nombre>] [desde:AAAA-MM-DD] [hasta:AAAA-MM-DD] [errores|ok]
+# Historial paginado (keyset por (created_at, id)) con botones « más recientes / anteriores ».
+# Los contadores salen de columnas indexadas: no se decodifica ningún summary_json.
 import datetime as dt
-from telegram import Update
-from telegram.ext import ContextTypes, CommandHandler
+import hashlib, json
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram.ext import CallbackQueryHandler, ContextTypes, CommandHandler
 from db import sqlite_store as store
 
+PAGE_SIZE = 5
+
 def _fmt_ts(ts: float) -> str:
     return dt.datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S")
 
-async def audits_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    store.init()
-    rows = store.list_audits(update.effective_chat.id, limit=5)
+def _day(s: str) -> float:
+    return dt.datetime.strptime(s, "%Y-%m-%d").timestamp()
+
+def parse_filters(args: list[str]) -> dict:
+    """Argumentos de /audits → filtros de store.page_audits (ValueError si no se entienden)."""
+    f: dict = {}
+    for arg in args:
+        key, _, value = arg.partition(":")
+        key = key.lower()
+        try:
+            if key in ("archivo", "file") and value:
+                f["file_name"] = value
+            elif key in ("desde", "from") and value:
+                f["since"] = _day(value)
+            elif key in ("hasta", "to") and value:
+                f["until"] = _day(value) + 86400   # día incluido
+            elif key in ("errores", "errors") and not value:
+                f["has_errors"] = True
+            elif key == "ok" and not value:
+                f["has_errors"] = False
+            else:
+                raise ValueError
+        except ValueError:
+            raise ValueError(arg) from None
+    return f
+
+def _filters_token(context: ContextTypes.DEFAULT_TYPE, filters: dict) -> str:
+    """Los filtros no caben en callback_data (64 bytes): se guardan en chat_data con un token corto."""
+    token = hashlib.blake2s(json.dumps(filters, sort_keys=True).encode(), digest_size=4).hexdigest()
+    context.chat_data.setdefault("audits_filters", {})[token] = filters
+    return token
+
+def _headline(r: dict) -> str:
+    if r["errors"] is None:
+        return "(resumen sin formato estándar)"
+    return (f"invalid_date={r['invalid_date']}, duplicates={r['duplicates_tx']}, "
+            f"unbalanced={r['unbalanced_tx']}, required_nulls={r['required_nulls']}")
+
+def _keyboard(rows: list[dict], token: str, has_newer: bool, has_older: bool):
+    buttons = []
+    if has_newer:
+        first = rows[0]
+        buttons.append(InlineKeyboardButton(
+            "« Más recientes", callback_data=f"aud:{token}:a:{first['created_at']!r}:{first['id']}"))
+    if has_older:
+        last = rows[-1]
+        buttons.append(InlineKeyboardButton(
+            "Anteriores »", callback_data=f"aud:{token}:b:{last['created_at']!r}:{last['id']}"))
+    return InlineKeyboardMarkup([buttons]) if buttons else None
+
+async def _page(chat_id: int, filters: dict, token: str, direction: str = "", cursor=None):
+    """(texto, teclado) de una página; direction 'b' = más antiguas que cursor, 'a' = más recientes."""
+    kw = dict(filters, limit=PAGE_SIZE)
+    if direction == "b":
+        kw["before"] = cursor
+    elif direction == "a":
+        kw["after"] = cursor
+    rows, more = await store.page_audits(chat_id, **kw)
     if not rows:
-        return await update.message.reply_text("No hay auditorías registradas aún.")
+        return None, None
 
     lines = []
     for r in rows:
-        s = r["summary"]
-        # intenta extraer datos clave del resumen JSON
-        try:
-            inv = s.get("invalid_date", {}).get("count")
-            dup = s.get("duplicates_tx", {}).get("count")
-            unb = s.get("unbalanced_tx", {}).get("count")
-            req = s.get("required_nulls", {}).get("count")
-            headline = f"invalid_date={inv}, duplicates={dup}, unbalanced={unb}, required_nulls={req}"
-        except Exception:
-            headline = (s[:120] + "…") if isinstance(s, str) and len(s) > 120 else str(s)
-
         lines.append(
             f"#{r['id']} · {r['file_name']} · { _fmt_ts(r['created_at']) }\n"
-            f"  {headline}\n"
+            f"  {_headline(r)}\n"
             f"  {r['run_url'] or ''}"
         )
+    has_newer = more if direction == "a" else direction == "b"
+    has_older = more if direction != "a" else True
+    return "Auditorías:\n\n" + "\n".join(lines), _keyboard(rows, token, has_newer, has_older)
+
+async def audits_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        filters = parse_filters(context.args or [])
+    except ValueError as e:
+        return await update.message.reply_text(
+            f"Filtro no válido: {e}\n"
+            "Uso: /audits [archivo:<nombre>] [desde:AAAA-MM-DD] [hasta:AAAA-MM-DD] [errores|ok]")
+    token = _filters_token(context, filters)
+    text, keyboard = await _page(update.effective_chat.id, filters, token)
+    if text is None:
+        msg = "No hay auditorías que cumplan el filtro." if filters else "No hay auditorías registradas aún."
+        return await update.message.reply_text(msg)
+    await update.message.reply_text(text, reply_markup=keyboard)
 
-    await update.message.reply_text("Últimas auditorías:\n\n" + "\n".join(lines))
+async def audits_page_cb(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Botones de paginación: aud:<token>:<a|b>:<created_at>:<id>."""
+    query = update.callback_query
+    await query.answer()
+    _, token, direction, ts, id_ = query.data.split(":")
+    filters = context.chat_data.get("audits_filters", {}).get(token, {})   # tras reinicio: sin filtros
+    text, keyboard = await _page(update.effective_chat.id, filters, token, direction, (float(ts), int(id_)))
+    if text is None:
+        return await query.edit_message_reply_markup(None)
+    await query.edit_message_text(text, reply_markup=keyboard)
 
 def register_handlers(app):
     app.add_handler(CommandHandler("audits", audits_cmd))
+    app.add_handler(CallbackQueryHandler(audits_page_cb, pattern=r"^aud:"))
@@ -1,117 +1,744 @@
 # handlers/audit.py
 # ─────────────────────────────────────────────────────────────────────────────
 # /audit → guía
-# Documento .csv → lo codifica en base64 y lanza un Job (run-now) en Databricks
-# Polling → get-output → responde resumen y guarda log en SQLite
+# Documento .csv → se descarga en streaming a staging (gzip al vuelo, sha256);
+#                  con el primer trozo se comprueba formato y columnas (rechazo al
+#                  momento) y se normaliza a UTF-8 con comas (engine/preflight.py);
+#                  si su hash ya está en caché responde al momento,
+#                  si no se registra en audit_jobs y se encola (respuesta inmediata)
+# Worker (services/jobs.py):
+#   - .csv pequeño → auditoría local: streaming (engine/csv_audit.py) o, a partir de
+#     AUDIT_COLUMNAR_MIN_BYTES y con NumPy, columnar (engine/columnar.py)
+#   - .csv grande → según AUDIT_EXECUTION:
+#       · Job (run-now) en Databricks: inline en base64 si cabe, si no se sube el
+#         .gz por trozos y el job recibe solo la ruta; con DATABRICKS_BATCH_WINDOW,
+#         varios CSV seguidos van en un único run (lote) y el resultado se reparte
+#       · modo paralelo multi-núcleo en el propio bot (engine/parallel.py)
+#   Polling → get-output → envía el resumen al chat y guarda log en SQLite
+#   (si el run no termina en DATABRICKS_POLL_TIMEOUT, el job sigue 'running' con su
+#   run_id y se vuelve a consultar más tarde: jobs.Deferred)
+# Envíos idénticos simultáneos (mismo sha256 + reglas) → un único run; cada chat
+#   recibe el resultado y su fila en audits (ver _inflight). Entre workers webhook
+#   (chats repartidos por chat_id % N) se detectan por audit_jobs en SQLite: el
+#   seguidor espera a que termine el job del otro worker y responde desde la caché
+#   ("en cola" → "job lanzado" es un único mensaje editado; el resumen, troceado
+#   si es largo, sale como mensaje nuevo — ver services/outbox.py)
+#   (+ hallazgos fila a fila comprimidos → /audit_detail <id> [regla])
 # ─────────────────────────────────────────────────────────────────────────────
 
-import os, asyncio, base64, requests
+import os, json, asyncio, base64, logging
+from typing import Any, Dict, List, Optional, Set, Tuple
 from pathlib import Path
 from telegram import Update
 from telegram.ext import ContextTypes, CommandHandler, MessageHandler, filters
+from config import worker_shard
 from db import sqlite_store as store
+from engine.csv_audit import audit_path, RULES_VERSION
+from engine import parallel
+from engine.findings import Findings
+from services.databricks import aclose_all, get_client, get_poller
+from services.cache import get_cache, file_digest, cache_key
+from services.hooks import add_hook
+from services import findings as findings_svc, jobs, metrics, outbox, staging
+
+log = logging.getLogger(__name__)
 
 # Config Databricks (.env)
 DBX_HOST  = (os.getenv("DATABRICKS_HOST") or "").rstrip("/")
 DBX_TOKEN = os.getenv("DATABRICKS_TOKEN") or ""
 JOB_ID    = int(os.getenv("DATABRICKS_JOB_ID_AUDIT", "0"))
+# Destino remoto de los CSV grandes: dbfs:/… o /Volumes/<catálogo>/<esquema>/<volumen>/…
+DBX_STAGING_DIR = os.getenv("DATABRICKS_STAGING_DIR", "dbfs:/tmp/telegram-bot-audits").rstrip("/")
+
+INLINE_MAX_BYTES = 350_000  # hasta aquí se envía inline como csv_b64 (la base64 crece ~33%)
+# Tope de seguridad; la API cloud de Telegram solo descarga hasta 20 MB
+# (para más, servidor Bot API local)
+AUDIT_MAX_BYTES = int(os.getenv("AUDIT_MAX_BYTES", str(2_000_000_000)))
+# Por debajo de este tamaño se audita en proceso (milisegundos, sin cluster)
+LOCAL_MAX_BYTES = int(os.getenv("AUDIT_LOCAL_MAX_BYTES", "200000"))
+# A partir de este tamaño la auditoría local usa el backend columnar (vectorizado; ya
+# gana al streaming desde ~40 KB). Por debajo de LOCAL_MAX_BYTES para que en modo auto
+# se use: lo que pasa de LOCAL_MAX_BYTES va a Databricks o al modo paralelo
+COLUMNAR_MIN_BYTES = int(os.getenv("AUDIT_COLUMNAR_MIN_BYTES", "64000"))
+# Dónde se auditan los CSV mayores que LOCAL_MAX_BYTES:
+#   auto → Databricks si está configurado, si no paralelo · databricks · parallel · local
+AUDIT_EXECUTION = os.getenv("AUDIT_EXECUTION", "auto").lower()
+POLL_TIMEOUT = float(os.getenv("DATABRICKS_POLL_TIMEOUT", "600"))
+# Run aún en curso tras POLL_TIMEOUT: el job libera su worker y se vuelve a consultar tras esto
+REPOLL_DELAY = float(os.getenv("DATABRICKS_REPOLL_DELAY", "60"))
+# Versión de las reglas del notebook de Databricks (forma parte de la clave de caché)
+DBX_RULES_VERSION = os.getenv("DATABRICKS_RULES_VERSION", "dbx-1")
+# Lotes: un worker espera DATABRICKS_BATCH_WINDOW s y lanza en el mismo run los CSV
+# pendientes del chat (o de cualquier chat con DATABRICKS_BATCH_SCOPE=global), hasta
+# DATABRICKS_BATCH_MAX. Requiere que el notebook acepte el parámetro "batch" (ver
+# scripts/dbx_stub.py); 0 = un run por CSV.
+DBX_BATCH_WINDOW = float(os.getenv("DATABRICKS_BATCH_WINDOW", "0"))
+DBX_BATCH_MAX = int(os.getenv("DATABRICKS_BATCH_MAX", "20"))
+DBX_BATCH_SCOPE = os.getenv("DATABRICKS_BATCH_SCOPE", "chat").lower()   # chat | global
+
+# Límites de la cola de auditorías en segundo plano
+AUDIT_WORKERS  = int(os.getenv("AUDIT_WORKERS", "4"))       # concurrencia global
+AUDIT_PER_CHAT = int(os.getenv("AUDIT_PER_CHAT", "1"))      # concurrencia por chat
+AUDIT_QUEUE_MAX = int(os.getenv("AUDIT_QUEUE_MAX", "100"))  # trabajos pendientes máx.
+# Reparto justo entre chats (WFQ, services/jobs.py): coste = 1 + tamaño / AUDIT_COST_BYTES;
+# AUDIT_CHAT_WEIGHTS="chat_id:peso,…" da más turno a algunos chats (peso 1 por defecto)
+AUDIT_COST_BYTES = int(os.getenv("AUDIT_COST_BYTES", "5000000"))
+AUDIT_CHAT_WEIGHTS = {int(c): float(w) for c, w in
+                      (p.split(":") for p in os.getenv("AUDIT_CHAT_WEIGHTS", "").replace(" ", "").split(",") if p)}
+
+def _dbx_ready() -> bool:
+    return bool(DBX_HOST and DBX_TOKEN and JOB_ID)
+
+def _route(raw_size: int) -> str:
+    """'local' | 'parallel' | 'dbx' para un CSV de este tamaño."""
+    if AUDIT_EXECUTION == "databricks":
+        return "dbx"
+    if raw_size <= LOCAL_MAX_BYTES or AUDIT_EXECUTION == "local":
+        return "local"
+    if AUDIT_EXECUTION == "parallel" or not _dbx_ready():
+        return "parallel"
+    return "dbx"
+
+def _columnar(raw_size: int):
+    """engine.columnar si la auditoría local de este tamaño lo usa (y hay NumPy), si no None."""
+    if _route(raw_size) != "local" or raw_size < COLUMNAR_MIN_BYTES:
+        return None
+    from engine import columnar   # NumPy solo se importa si llega un archivo grande
+    return columnar if columnar.AVAILABLE else None
+
+def _rules_version(raw_size: int) -> str:
+    """Versión de reglas del motor que auditaría un CSV de este tamaño (el columnar
+    puede tener reglas extra: engine/rules.py)."""
+    if _route(raw_size) == "dbx":
+        return DBX_RULES_VERSION
+    columnar = _columnar(raw_size)
+    return columnar.rules_version() if columnar else RULES_VERSION
+
+async def _ensure_meta(job: jobs.Job) -> None:
+    """Completa sha256/raw_size de jobs antiguos (CSV sin comprimir o sin metadatos)."""
+    if job.get("sha256") and job.get("raw_size") is not None:
+        return
+    path = Path(job["file_path"])
+    if path.suffix == ".gz":
+        job["sha256"], job["raw_size"] = await asyncio.to_thread(staging.staged_digest, path)
+    else:
+        job["sha256"] = await asyncio.to_thread(file_digest, path)
+        job["raw_size"] = path.stat().st_size
+
+# ---- API de Jobs (cliente asíncrono con pool keep-alive, ver services/databricks.py) ----
+
+async def _run_now_b64(job_id: int, csv_b64: str, file_name: str) -> int:
+    return await get_client(DBX_HOST, DBX_TOKEN).run_now(
+        job_id, {"csv_b64": csv_b64, "file_name": file_name})
+
+async def _run_now_ref(job_id: int, remote: str, file_name: str) -> int:
+    return await get_client(DBX_HOST, DBX_TOKEN).run_now(
+        job_id, {"file_path": remote, "compression": "gzip", "file_name": file_name})
+
+async def _run_now_batch(job_id: int, files: List[Dict[str, Any]]) -> int:
+    return await get_client(DBX_HOST, DBX_TOKEN).run_now(
+        job_id, {"batch": json.dumps(files, ensure_ascii=False)})
+
+def _job_cost(job: jobs.Job) -> float:
+    return 1.0 + (job.get("raw_size") or 0) / AUDIT_COST_BYTES
+
+def _wait_text(queue: jobs.AuditQueue, pos: int) -> str:
+    eta = queue.eta(pos)
+    if eta is None:
+        return f"posición {pos}"
+    return f"posición {pos}, ~{max(1, round(eta / 60))} min"
+
+def _remote_path(path: Path) -> str:
+    return f"{DBX_STAGING_DIR}/{path.name}"
+
+def _local_audit(path: Path, raw_size: int) -> tuple[dict, Findings]:
+    findings = Findings()
+    if _route(raw_size) == "parallel":
+        return parallel.audit_path(path, findings=findings), findings
+    columnar = _columnar(raw_size)
+    if columnar:
+        return columnar.audit_path(path, findings), findings
+    return audit_path(path, findings), findings
+
+def _split_findings(summary_text: str) -> tuple[str, Findings | None]:
+    """Separa "findings" del output del job; si no los trae, usa los ejemplos del resumen."""
+    try:
+        summary = json.loads(summary_text)
+    except ValueError:
+        return summary_text, None
+    if not isinstance(summary, dict):
+        return summary_text, None
+    if "findings" in summary:
+        findings = Findings.from_dict(summary.pop("findings") or {})
+        return json.dumps(summary, ensure_ascii=False), findings
+    return summary_text, Findings.from_summary(summary)
+
+def _read_inline(path: Path) -> str:
+    data = b"".join(staging.iter_gzip_chunks(path)) if path.suffix == ".gz" else path.read_bytes()
+    return base64.b64encode(data).decode("utf-8")
+
+# ---- Procesado en segundo plano (lo ejecutan los workers de la cola) ----
+
+async def _save(job: jobs.Job, summary_text: str, run_id=None, run_url=None, findings=None) -> int:
+    blocks = await findings_svc.encode(findings)
+    audit_id = await store.save_audit(
+        chat_id=job["chat_id"],
+        file_name=job["file_name"],
+        summary=summary_text,
+        run_id=run_id,
+        run_url=run_url,
+        findings=blocks,
+    )
+    if blocks:
+        await findings_svc.saved()
+    return audit_id
+
+async def _cache(job: jobs.Job, summary_text: str, run_id=None, run_url=None, audit_id=None) -> None:
+    """Guarda el resultado en caché si es un resumen JSON. La caché es un atajo: si falla,
+    el resumen ya guardado se entrega igual."""
+    try:
+        json.loads(summary_text)
+    except ValueError:
+        return   # output del notebook que no es JSON: se entrega, pero no se reutiliza
+    try:
+        await get_cache().put(job["cache_key"], summary_text, run_id, run_url, audit_id)
+    except Exception as e:
+        log.warning("No se pudo cachear la auditoría %s: %s", audit_id, e)
+
+def _progress_key(job: jobs.Job) -> str:
+    return f"job:{job['id']}"
+
+async def _notify_failed(bot, job: jobs.Job, error: BaseException) -> None:
+    """Avisa al chat de que su auditoría falló (el job queda 'failed'). Nunca lanza:
+    se llama desde los except, antes de relanzar el error original."""
+    try:
+        await outbox.finish(bot, job["chat_id"], _progress_key(job),
+                            f"❌ La auditoría de {job['file_name']} falló: {str(error)[:300] or type(error).__name__}")
+    except Exception:
+        log.exception("No se pudo avisar del fallo del job %s", job["id"])
+
+def _detail_hint(audit_id: int, detail: bool) -> str:
+    return f"\nDetalle fila a fila: /audit_detail {audit_id}" if detail else ""
+
+# Resultado de una auditoría (lo que se comparte con los envíos duplicados):
+#   {"kind": "summary", "summary", "run_id", "run_url", "audit_id", "detail"}
+#   {"kind": "invalid", "error"}
+#   {"kind": "no_output", "run_url", "error"} · {"kind": "no_config"}
+#   {"kind": "failed"} / {"kind": "cancelled"} → el líder no terminó (solo _inflight)
+Outcome = Dict[str, Any]
+
+def _render(job: jobs.Job, out: Outcome, audit_id: Optional[int] = None) -> str:
+    kind = out["kind"]
+    if kind == "summary":
+        where = "" if out["run_url"] else " (local)"
+        text = f"Resumen auditoría{where} · {job['file_name']}:\n{out['summary']}"
+        if out["run_url"]:
+            text += f"\n{out['run_url']}"
+        return text + _detail_hint(audit_id, out["detail"])
+    if kind == "invalid":
+        return f"{job['file_name']}: CSV no válido: {out['error']}"
+    if kind == "no_output":
+        return f"Terminado. Revisa detalles en el run:\n{out['run_url']}\n(no se pudo leer el output: {out['error']})"
+    return "⚠️ Config de Databricks incompleta. Revisa .env"
+
+async def _audit_local(job: jobs.Job, path: Path) -> Outcome:
+    """Auditoría en proceso: una pasada streaming, sin Databricks."""
+    try:
+        summary, findings = await asyncio.to_thread(_local_audit, path, job["raw_size"])
+    except ValueError as e:
+        return {"kind": "invalid", "error": str(e)}
+
+    summary_text = json.dumps(summary, ensure_ascii=False)
+    audit_id = await _save(job, summary_text, findings=findings)
+    await _cache(job, summary_text, audit_id=audit_id)
+    return {"kind": "summary", "summary": summary_text, "run_id": None, "run_url": None,
+            "audit_id": audit_id, "detail": bool(findings)}
+
+async def _launch(group: List[jobs.Job], remotes: Dict[int, str]) -> int:
+    """run-now de un CSV (parámetros de siempre) o de un lote ("batch": lista JSON de archivos)."""
+    client = get_client(DBX_HOST, DBX_TOKEN)
+    if len(group) == 1:
+        job = group[0]
+        path = Path(job["file_path"])
+        if job["id"] not in remotes:
+            return await _run_now_b64(JOB_ID, await asyncio.to_thread(_read_inline, path), job["file_name"])
+        await client.upload(path, remotes[job["id"]])
+        return await _run_now_ref(JOB_ID, remotes[job["id"]], job["file_name"])
+    files = []
+    for job in group:
+        entry: Dict[str, Any] = {"job_id": job["id"], "file_name": job["file_name"]}
+        if job["id"] in remotes:
+            entry.update(file_path=remotes[job["id"]], compression="gzip")
+        else:
+            entry["csv_b64"] = await asyncio.to_thread(_read_inline, Path(job["file_path"]))
+        files.append(entry)
+    await asyncio.gather(*(client.upload(Path(j["file_path"]), remotes[j["id"]])
+                           for j in group if j["id"] in remotes))
+    return await _run_now_batch(JOB_ID, files)
+
+def _run_outputs(output: str, group: List[jobs.Job]) -> List[Optional[str]]:
+    """Output del run → texto del resumen de cada job del grupo (None si falta el suyo).
+    Un lote devuelve {"batch": [{"job_id", "file_name", …resumen}, …]}."""
+    try:
+        data = json.loads(output)
+    except ValueError:
+        data = None
+    if not (isinstance(data, dict) and isinstance(data.get("batch"), list)):
+        if len(group) > 1:
+            raise ValueError("el run del lote no devolvió 'batch'")
+        return [output]
+    by_job = {}
+    for item in data["batch"]:
+        if isinstance(item, dict):
+            by_job[str(item.pop("job_id", ""))] = item
+            item.pop("file_name", None)
+    items = [by_job.get(str(job["id"])) for job in group]
+    return [json.dumps(item, ensure_ascii=False) if item is not None else None for item in items]
+
+async def _audit_dbx(bot, group: List[jobs.Job]) -> List[Outcome]:
+    """run-now (uno o varios CSV) → polling compartido → get-output → un Outcome por job.
+    Un job reanudado (ya con run_id) llega solo y no se relanza."""
+    client = get_client(DBX_HOST, DBX_TOKEN)
+    run_id = group[0].get("run_id")
+    # inline (csv_b64) mientras quepa en INLINE_MAX_BYTES entre todos; el resto, .gz subido.
+    # Reanudado: no se sabe cómo se repartió (p.ej. en un lote) → se borra la ruta de todos
+    remotes: Dict[int, str] = {}
+    budget = INLINE_MAX_BYTES
+    for job in group:
+        if job["raw_size"] <= budget and not run_id:
+            budget -= job["raw_size"]
+        else:
+            remotes[job["id"]] = _remote_path(Path(job["file_path"]))
+
+    keep = False   # run aún vivo que se volverá a consultar: su entrada tiene que seguir ahí
+    try:
+        if not run_id:
+            run_id = await _launch(group, remotes)
+            batch = f" (lote de {len(group)} archivos)" if len(group) > 1 else ""
+            by_chat: Dict[int, List[jobs.Job]] = {}
+            for job in group:
+                job["run_id"] = run_id   # si se aplaza, al volver a la cola solo se consulta
+                await store.update_job(job["id"], run_id=run_id)
+                by_chat.setdefault(job["chat_id"], []).append(job)
+            # un solo aviso por chat (en el mensaje de su primer job): el límite por chat es ~1 msg/s
+            for chat_id, chat_jobs in by_chat.items():
+                ids = ", ".join(f"#{j['id']}" for j in chat_jobs)
+                await outbox.progress(bot, chat_id, _progress_key(chat_jobs[0]),
+                                      f"Auditoría{'s' if len(chat_jobs) > 1 else ''} {ids} · job lanzado ✅ "
+                                      f"run_id={run_id}{batch}\n{client.run_url(run_id)}\nConsultando estado…")
+        run_url = client.run_url(run_id)
 
-MAX_SIZE = 350_000  # ~350 KB (la base64 crece ~33%)
+        # Polling compartido con backoff (un único task para todas las ejecuciones)
+        try:
+            await get_poller(DBX_HOST, DBX_TOKEN).wait(JOB_ID, run_id, timeout=POLL_TIMEOUT)
+        except asyncio.TimeoutError:
+            keep = True
+            for job in group:
+                await outbox.progress(bot, job["chat_id"], _progress_key(job),
+                                      f"Auditoría #{job['id']}: el run sigue en curso tras {POLL_TIMEOUT:.0f} s. "
+                                      f"Te aviso al terminar ⏳\n{run_url}")
+            raise jobs.Deferred(REPOLL_DELAY)
 
-def _h():
-    return {"Authorization": f"Bearer {DBX_TOKEN}", "Content-Type": "application/json"}
+        try:
+            texts = _run_outputs(await client.get_output(run_id), group)
+        except Exception as e:
+            return [{"kind": "no_output", "run_url": run_url, "error": str(e)} for _ in group]
 
-def _url(p: str) -> str:
-    return f"{DBX_HOST}{p}"
+        # Persistencia por archivo: cada uno su fila en audits y su entrada de caché
+        outcomes: List[Outcome] = []
+        for job, text in zip(group, texts):
+            try:
+                if text is None:
+                    raise ValueError("el lote no trae resultado para este archivo")
+                summary_text, findings = _split_findings(text)
+                audit_id = await _save(job, summary_text, run_id, run_url, findings)
+                await _cache(job, summary_text, run_id, run_url, audit_id)
+                outcomes.append({"kind": "summary", "summary": summary_text, "run_id": run_id,
+                                 "run_url": run_url, "audit_id": audit_id, "detail": bool(findings)})
+            except Exception as e:
+                outcomes.append({"kind": "no_output", "run_url": run_url, "error": str(e)})
+        return outcomes
+    except asyncio.CancelledError:
+        keep = run_id is not None   # apagado con el run lanzado: se reanuda y lo sigue consultando
+        raise
+    finally:
+        # se borra cuando el run terminó (y se leyó su output) o si no llegó a lanzarse;
+        # si no, la borra el job al reanudarse y terminar
+        for remote in (() if keep else remotes.values()):
+            try:
+                await client.delete(remote)
+            except Exception as e:
+                log.warning("No se pudo borrar %s: %s", remote, e)
 
-# ---- Llamadas síncronas a la API (se usarán con asyncio.to_thread) ----
+# ---- Envíos idénticos en vuelo: un solo run, resultado para todos ----
+# cache_key → (id del job líder, futuro con su Outcome). Si llega el mismo contenido
+# (mismas reglas) mientras el líder está en cola o en curso, el nuevo job no se encola:
+# espera el resultado y recibe su propio mensaje y su propia fila en audits (los
+# hallazgos se copian del líder). Los seguidores conservan su CSV en staging hasta
+# entonces: si el bot se reinicia, se reanudan como jobs normales (y la caché responde).
 
-def _run_now_b64_sync(job_id: int, csv_b64: str, file_name: str) -> int:
-    payload = {
-        "job_id": job_id,
-        "notebook_params": {
-            "csv_b64": csv_b64,
-            "file_name": file_name
-        },
-    }
-    r = requests.post(_url("/api/2.2/jobs/run-now"), headers=_h(), json=payload, timeout=60)
-    r.raise_for_status()
-    return r.json()["run_id"]
+_inflight: Dict[str, Tuple[int, asyncio.Future]] = {}
+_followers: set = set()   # tasks de _follow_task / _follow_remote (referencia fuerte + cancelación al parar)
+REMOTE_POLL = 2.0         # s entre consultas del estado de un job de otro worker
 
-def _get_state_sync(run_id: int) -> dict:
-    r = requests.get(_url("/api/2.2/jobs/runs/get"), headers=_h(), params={"run_id": run_id}, timeout=60)
-    r.raise_for_status()
-    return r.json()["state"]
+def _lead(job: jobs.Job) -> None:
+    if job["cache_key"] not in _inflight:
+        _inflight[job["cache_key"]] = (job["id"], asyncio.get_running_loop().create_future())
 
-def _get_output_sync(run_id: int) -> str:
-    r = requests.get(_url("/api/2.1/jobs/runs/get-output"), headers=_h(), params={"run_id": run_id}, timeout=60)
-    r.raise_for_status()
-    out = r.json().get("notebook_output", {})
-    return out.get("result", "(sin resultado)")
+def _leader_of(job: jobs.Job) -> Optional[asyncio.Future]:
+    """Futuro del líder en vuelo con el mismo contenido (None si no hay o es este job)."""
+    entry = _inflight.get(job["cache_key"])
+    return entry[1] if entry and entry[0] != job["id"] else None
+
+def _resolve(job: jobs.Job, outcome: Outcome) -> None:
+    entry = _inflight.get(job["cache_key"])
+    if entry and entry[0] == job["id"]:
+        del _inflight[job["cache_key"]]
+        entry[1].set_result(outcome)
+
+async def _follow(bot, job: jobs.Job, leader: asyncio.Future) -> bool:
+    """Entrega al chat de 'job' el resultado del líder. False si el líder no terminó."""
+    outcome = await asyncio.shield(leader)
+    if outcome["kind"] in ("failed", "cancelled"):
+        return False
+    audit_id = None
+    if outcome["kind"] == "summary":
+        audit_id = await store.save_audit(
+            chat_id=job["chat_id"],
+            file_name=job["file_name"],
+            summary=outcome["summary"],
+            run_id=outcome["run_id"],
+            run_url=outcome["run_url"],
+            findings_from=outcome["audit_id"],
+        )
+    await outbox.finish(bot, job["chat_id"], _progress_key(job), _render(job, outcome, audit_id))
+    return True
+
+async def _follow_task(app, job: jobs.Job, leader: asyncio.Future) -> None:
+    """Seguidor lanzado desde audit_doc: no ocupa worker de la cola mientras espera."""
+    try:
+        if await _follow(app.bot, job, leader):
+            await store.update_job(job["id"], "done")
+            Path(job["file_path"]).unlink(missing_ok=True)
+            return
+        if leader.result()["kind"] == "cancelled":
+            return   # apagado: el job sigue 'queued' y se reanuda al arrancar
+        # el líder falló: el primer seguidor pasa a líder y los demás le siguen
+        nxt = _leader_of(job)
+        if nxt is not None:
+            return await _follow_task(app, job, nxt)
+        _lead(job)
+        app.bot_data["audit_queue"].submit(job, force=True)
+    except Exception as e:
+        log.exception("Entrega de auditoría duplicada %s falló", job["id"])
+        await _notify_failed(app.bot, job, e)
+        await store.update_job(job["id"], "failed", error=str(e)[:500])
+        Path(job["file_path"]).unlink(missing_ok=True)
+
+# El _inflight de cada proceso solo ve sus chats. Con varios workers webhook, el mismo
+# contenido en cola o en curso en otro worker se encuentra en audit_jobs (sha256): se
+# consulta su estado en SQLite hasta que termina y se responde con su entrada de caché
+# (compartida). Si no la dejó (falló, output no JSON…), el job se audita aquí.
+
+async def _remote_leader(job: jobs.Job) -> Optional[int]:
+    index, total = worker_shard()
+    if total <= 1:
+        return None
+    return await store.get_store().active_job_elsewhere(job["sha256"], job["id"], index, total)
+
+async def _follow_remote(app, job: jobs.Job, leader_id: int) -> None:
+    try:
+        while await store.get_store().job_status(leader_id) in ("queued", "running"):
+            await asyncio.sleep(REMOTE_POLL)
+        hit = await get_cache().get(job["cache_key"])
+        if hit is None:
+            leader = _leader_of(job)   # entretanto pudo llegar aquí otro igual
+            if leader is not None:
+                return await _follow_task(app, job, leader)
+            _lead(job)
+            app.bot_data["audit_queue"].submit(job, force=True)
+            return
+        audit_id = await store.save_audit(
+            chat_id=job["chat_id"],
+            file_name=job["file_name"],
+            summary=hit["summary_json"],
+            run_id=hit["run_id"],
+            run_url=hit["run_url"],
+            findings_from=hit.get("audit_id"),
+        )
+        out = {"kind": "summary", "summary": hit["summary_json"], "run_id": hit["run_id"],
+               "run_url": hit["run_url"], "detail": bool(hit.get("audit_id"))}
+        await outbox.finish(app.bot, job["chat_id"], _progress_key(job), _render(job, out, audit_id))
+        await store.update_job(job["id"], "done")
+        Path(job["file_path"]).unlink(missing_ok=True)
+    except asyncio.CancelledError:
+        raise   # apagado: el job sigue 'queued' y se reanuda al arrancar
+    except Exception as e:
+        log.exception("Entrega de auditoría duplicada %s (otro worker) falló", job["id"])
+        await _notify_failed(app.bot, job, e)
+        await store.update_job(job["id"], "failed", error=str(e)[:500])
+        Path(job["file_path"]).unlink(missing_ok=True)
+
+def _spawn_follower(coro) -> None:
+    task = asyncio.create_task(coro)
+    _followers.add(task)
+    task.add_done_callback(_followers.discard)
+
+# ---- Lotes: varios CSV en un único run de Databricks ----
+
+def _batchable(job: jobs.Job) -> bool:
+    """Job en cola que puede ir en el mismo run que otro (Databricks, sin lanzar, sin duplicado en vuelo)."""
+    if job.get("run_id") or not job.get("sha256") or job.get("raw_size") is None:
+        return False
+    if _route(job["raw_size"]) != "dbx":
+        return False
+    if not job.get("cache_key"):   # jobs reanudados tras reinicio
+        job["cache_key"] = cache_key(job["sha256"], _rules_version(job["raw_size"]))
+    return _leader_of(job) is None
+
+def _batch_scope(job: jobs.Job) -> Optional[int]:
+    return None if DBX_BATCH_SCOPE == "global" else job["chat_id"]
+
+class _Batch:
+    """Lote abierto durante la ventana: otros workers que sacan un CSV compatible se unen."""
+    def __init__(self) -> None:
+        self.joined: List[Tuple[jobs.Job, asyncio.Future]] = []
+
+    def join(self, job: jobs.Job) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self.joined.append((job, fut))
+        return fut
+
+_batches: Dict[Optional[int], _Batch] = {}   # ámbito (chat_id o None = global) → lote abierto
+
+async def _run_batch(bot, queue: jobs.AuditQueue, job: jobs.Job,
+                     claimed: List[jobs.Job]) -> Dict[int, Outcome]:
+    """Abre un lote, espera DBX_BATCH_WINDOW y lanza en un único run este CSV, los que se
+    unieron desde otros workers y los compatibles que sigan en cola (reclamados: se
+    añaden a 'claimed' en cuanto salen de la cola, así el llamador los cierra aunque
+    esto falle). Devuelve el Outcome de este job y de los reclamados."""
+    scope = _batch_scope(job)
+    batch = _batches[scope] = _Batch()
+    try:
+        try:
+            await asyncio.sleep(DBX_BATCH_WINDOW)
+        finally:
+            # lleno, otro worker pudo abrir ya el siguiente lote con el mismo ámbito
+            if _batches.get(scope) is batch:
+                del _batches[scope]
+        claimed.extend(queue.claim(_batchable, DBX_BATCH_MAX - 1 - len(batch.joined), chat_id=scope))
+        group = [job, *(j for j, _ in batch.joined), *claimed]
+        for other in claimed:
+            _lead(other)
+            await store.update_job(other["id"], "running")
+        if len(group) > 1:
+            metrics.observe("databricks_batch_size", len(group), buckets=metrics.COUNT_BUCKETS)
+        outcomes = dict(zip([j["id"] for j in group], await _audit_dbx(bot, group)))
+    except BaseException as e:
+        # nadie que se unió al lote puede quedarse esperando (ni ocupando su worker)
+        for _, fut in batch.joined:
+            if fut.done():
+                continue
+            if isinstance(e, asyncio.CancelledError):
+                fut.cancel()
+            else:
+                fut.set_exception(e)
+        raise
+    for j, fut in batch.joined:
+        out = outcomes.pop(j["id"])
+        if not fut.done():   # su worker se canceló mientras esperaba
+            fut.set_result(out)
+    return outcomes
+
+def _processor(app):
+    async def process(job: jobs.Job) -> None:
+        queue: jobs.AuditQueue = app.bot_data["audit_queue"]
+        path = Path(job["file_path"])
+        batch: List[jobs.Job] = []             # reclamados de la cola para el mismo run (lotes)
+        outcomes: Dict[int, Outcome] = {}
+        delivered: Set[int] = set()            # ya recibieron su resultado
+        deferred = False
+        try:
+            await _ensure_meta(job)
+            if not job.get("cache_key"):   # jobs reanudados tras reinicio
+                job["cache_key"] = cache_key(job["sha256"], _rules_version(job["raw_size"]))
+            # reanudado tras reinicio mientras otro job igual sigue en curso: le espera
+            leader = _leader_of(job)
+            if leader is None or not await _follow(app.bot, job, leader):
+                _lead(job)
+                if job.get("run_id") or _route(job["raw_size"]) == "dbx":
+                    if not _dbx_ready():
+                        outcomes[job["id"]] = {"kind": "no_config"}
+                    elif DBX_BATCH_WINDOW > 0 and not job.get("run_id"):
+                        open_batch = _batches.get(_batch_scope(job))
+                        if open_batch is not None and len(open_batch.joined) < DBX_BATCH_MAX - 1:
+                            outcomes[job["id"]] = await open_batch.join(job)
+                        else:
+                            outcomes.update(await _run_batch(app.bot, queue, job, batch))
+                    else:
+                        outcomes[job["id"]] = (await _audit_dbx(app.bot, [job]))[0]
+                else:
+                    outcomes[job["id"]] = await _audit_local(job, path)
+                for j in (job, *batch):
+                    out = outcomes[j["id"]]
+                    await outbox.finish(app.bot, j["chat_id"], _progress_key(j), _render(j, out, out.get("audit_id")))
+                    delivered.add(j["id"])
+        except jobs.Deferred as e:
+            # run aún en curso: todos siguen 'running' con su run_id y su CSV en staging;
+            # los duplicados en vuelo siguen esperando a este líder
+            deferred = True
+            for j in batch:
+                queue.defer(j, e.delay)
+            raise
+        except asyncio.CancelledError:
+            outcomes = {j["id"]: {"kind": "cancelled"} for j in (job, *batch)}
+            raise   # apagado: se conservan los archivos (y los reclamados siguen 'running') para reanudar
+        except Exception as e:
+            # el job queda 'failed' (la cola lo anota al relanzar): cada chat recibe el error
+            for j in (job, *batch):
+                if j["id"] not in delivered:
+                    await _notify_failed(app.bot, j, e)
+            for j in batch:
+                Path(j["file_path"]).unlink(missing_ok=True)
+                await queue.finish(j, error=str(e))
+            path.unlink(missing_ok=True)
+            raise
+        finally:
+            for j in (job, *batch):
+                if deferred:
+                    continue
+                if j.get("cache_key"):
+                    _resolve(j, outcomes.get(j["id"], {"kind": "failed"}))
+                outbox.drop(_progress_key(j))
+        for j in batch:
+            Path(j["file_path"]).unlink(missing_ok=True)
+            await queue.finish(j)
+        path.unlink(missing_ok=True)
+    return process
+
+async def _stop_followers(_app) -> None:
+    for task in list(_followers):
+        task.cancel()   # sus jobs siguen 'queued' en SQLite: se reanudan al arrancar
+    await asyncio.gather(*_followers, return_exceptions=True)
+
+async def _shutdown_pool(_app) -> None:
+    await asyncio.to_thread(parallel.shutdown_pool)
+
+async def _close_databricks(_app) -> None:
+    await aclose_all()   # pool HTTP keep-alive y task del poller (si se llegaron a crear)
+
+async def _sweep_staging(_app) -> None:
+    """Tras reanudar la cola, borra restos de staging sin job pendiente."""
+    keep = [j["file_path"] for j in await store.pending_jobs()]
+    await asyncio.to_thread(staging.sweep, keep)
 
 # ---- Handlers ----
 
 async def audit_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Muestra cómo usar /audit."""
-    if not (DBX_HOST and DBX_TOKEN and JOB_ID):
-        return await update.message.reply_text("⚠️ Configura DATABRICKS_HOST, DATABRICKS_TOKEN y DATABRICKS_JOB_ID_AUDIT en .env")
-    await update.message.reply_text(
-        "Envía un archivo .csv (como documento) y lo auditaré en Databricks.\n"
-        "Tamaño máximo para la demo: ~350 KB."
+    msg = (
+        "Envía un archivo .csv (como documento) y lo auditaré.\n"
+        f"Hasta ~{LOCAL_MAX_BYTES // 1000} KB se audita al momento en el bot"
     )
+    if _route(AUDIT_MAX_BYTES) == "parallel":
+        msg += f"; los mayores se auditan en paralelo ({parallel.PARALLEL_WORKERS} procesos)."
+    elif _route(AUDIT_MAX_BYTES) == "local":
+        msg += "; los mayores también, en el propio bot."
+    elif _dbx_ready():
+        msg += "; los mayores se envían a Databricks."
+    else:
+        msg += ".\n⚠️ Para archivos mayores configura DATABRICKS_HOST, DATABRICKS_TOKEN y DATABRICKS_JOB_ID_AUDIT en .env"
+    await update.message.reply_text(msg)
 
 async def audit_doc(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Recibe un CSV → run-now (csv_b64) → polling → get-output → responde y guarda log."""
-    if not (DBX_HOST and DBX_TOKEN and JOB_ID):
-        return await update.message.reply_text("⚠️ Config de Databricks incompleta. Revisa .env")
-
+    """Recibe un CSV → lo descarga a staging y lo encola; el resultado llega al chat al terminar."""
     doc = update.message.document
     if not doc or not doc.file_name.lower().endswith(".csv"):
         return await update.message.reply_text("Adjunta un archivo con extensión .csv.")
+    if doc.file_size and _route(doc.file_size) == "dbx" and not _dbx_ready():
+        return await update.message.reply_text("⚠️ Config de Databricks incompleta. Revisa .env")
+    if doc.file_size and doc.file_size > AUDIT_MAX_BYTES:
+        return await update.message.reply_text(f"CSV demasiado grande (máx {AUDIT_MAX_BYTES // 1_000_000} MB).")
 
-    # Descargar a tmp local del bot
-    tmp_dir = Path("tmp"); tmp_dir.mkdir(exist_ok=True)
-    local_path = tmp_dir / f"{update.effective_chat.id}_{doc.file_name}"
-    tg_file = await context.bot.get_file(doc.file_id)
-    await tg_file.download_to_drive(str(local_path))
+    queue: jobs.AuditQueue = context.application.bot_data["audit_queue"]
+    if len(queue) >= queue.maxsize:
+        return await update.message.reply_text("La cola de auditorías está llena. Inténtalo en unos minutos.")
 
-    data = local_path.read_bytes()
-    if len(data) > MAX_SIZE:
-        return await update.message.reply_text("CSV demasiado grande para este PoC (máx ~350 KB).")
+    # Descarga en streaming → staging (.csv.gz); el job lo reanuda tras reinicio
+    tg_file = await context.bot.get_file(doc.file_id)
+    try:
+        staged = await staging.stage_telegram_file(tg_file, doc.file_name, AUDIT_MAX_BYTES)
+    except ValueError as e:
+        return await update.message.reply_text(f"CSV rechazado: {e}")
 
-    b64 = base64.b64encode(data).decode("utf-8")
+    # Mismo contenido + mismas reglas → resultado guardado, sin re-auditar
+    key = cache_key(staged.sha256, _rules_version(staged.raw_size))
+    hit = await get_cache().get(key)
+    if hit:
+        staged.path.unlink(missing_ok=True)
+        audit_id = await store.save_audit(
+            chat_id=update.effective_chat.id,
+            file_name=doc.file_name,
+            summary=hit["summary_json"],
+            run_id=hit["run_id"],
+            run_url=hit["run_url"],
+            findings_from=hit.get("audit_id"),
+        )
+        return await outbox.send(
+            context.bot, update.effective_chat.id,
+            f"Resumen auditoría (caché) · {doc.file_name}:\n{hit['summary_json']}\n{hit['run_url'] or ''}".rstrip()
+            + _detail_hint(audit_id, bool(hit.get("audit_id"))))
 
-    # Lanzar Job
-    run_id = await asyncio.to_thread(_run_now_b64_sync, JOB_ID, b64, doc.file_name)
-    run_url = f"{DBX_HOST}/jobs/runs/{run_id}"
-    await update.message.reply_text(f"Job lanzado ✅ run_id={run_id}\n{run_url}\nConsultando estado…")
+    job_id = await store.create_job(update.effective_chat.id, doc.file_name, str(staged.path),
+                                    staged.sha256, staged.raw_size)
+    job = {"id": job_id, "chat_id": update.effective_chat.id, "file_name": doc.file_name,
+           "file_path": str(staged.path), "status": "queued", "run_id": None,
+           "sha256": staged.sha256, "raw_size": staged.raw_size, "cache_key": key}
 
-    # Polling (hasta ~2 min)
-    for _ in range(20):
-        state = await asyncio.to_thread(_get_state_sync, run_id)
-        if state.get("life_cycle_state") in {"TERMINATED", "INTERNAL_ERROR", "SKIPPED"}:
-            break
-        await asyncio.sleep(6)
+    # Mismo contenido ya en cola o en curso → no se lanza otro run: espera su resultado
+    leader = _leader_of(job)
+    remote = None if leader is not None else await _remote_leader(job)
+    if leader is not None or remote is not None:
+        if leader is not None:
+            metrics.inc("audit_dedup_total")
+            _spawn_follower(_follow_task(context.application, job, leader))
+        else:
+            metrics.inc("audit_dedup_remote_total")
+            _spawn_follower(_follow_remote(context.application, job, remote))
+        return await outbox.progress(context.bot, update.effective_chat.id, _progress_key(job),
+                                     f"Auditoría #{job_id}: el mismo archivo ya se está auditando. "
+                                     "Te aviso con su resultado ⏳")
 
-    # Output + persistencia
+    _lead(job)
     try:
-        summary_text = await asyncio.to_thread(_get_output_sync, run_id)  # ← DENTRO de una función async
-        await update.message.reply_text(f"Resumen auditoría:\n{summary_text}\n{run_url}")
+        pos = queue.submit(job)
+    except jobs.QueueFull:
+        _resolve(job, {"kind": "failed"})
+        staged.path.unlink(missing_ok=True)
+        await store.update_job(job_id, "failed", error="cola llena")
+        return await update.message.reply_text("La cola de auditorías está llena. Inténtalo en unos minutos.")
+    note = staged.preflight.describe() if staged.preflight else ""
+    await outbox.progress(context.bot, update.effective_chat.id, _progress_key(job),
+                          f"Auditoría #{job_id} en cola ({_wait_text(queue, pos)}{', ' + note if note else ''}). "
+                          "Te aviso al terminar ⏳")
 
-        store.init()
-        store.save_audit(
-            chat_id=update.effective_chat.id,
-            file_name=doc.file_name,
-            summary=summary_text,
-            run_id=run_id,
-            run_url=run_url,
-        )
-    except Exception as e:
-        await update.message.reply_text(
-            f"Terminado. Revisa detalles en el run:\n{run_url}\n(no se pudo leer el output: {e})"
-        )
+async def queue_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/queue — auditorías del chat que esperan turno, con posición y espera estimada."""
+    queue: jobs.AuditQueue = context.application.bot_data["audit_queue"]
+    pending = queue.positions(update.effective_chat.id)
+    if not pending:
+        return await update.message.reply_text(f"No tienes auditorías esperando turno ({len(queue)} en total en cola).")
+    lines = [f"#{job['id']} {job['file_name']} · {_wait_text(queue, pos)}" for job, pos in pending]
+    await update.message.reply_text("En cola:\n" + "\n".join(lines))
 
 def register_handlers(app):
+    jobs.install(app, _processor(app), workers=AUDIT_WORKERS, per_chat=AUDIT_PER_CHAT,
+                 maxsize=AUDIT_QUEUE_MAX, cost=_job_cost, weights=AUDIT_CHAT_WEIGHTS)
+    add_hook(app, "post_init", _sweep_staging)
+    add_hook(app, "post_stop", _stop_followers)
+    add_hook(app, "post_shutdown", _shutdown_pool)
+    add_hook(app, "post_shutdown", _close_databricks)
     app.add_handler(CommandHandler("audit", audit_cmd))
+    app.add_handler(CommandHandler("queue", queue_cmd))
     app.add_handler(MessageHandler(filters.Document.MimeType("text/csv"), audit_doc))
     app.add_handler(MessageHandler(filters.Document.ALL & filters.Regex(r"\.csv$"), audit_doc))
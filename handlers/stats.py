@@ -0,0 +1,46 @@
+# handlers/stats.py
+# /stats — resumen de métricas en proceso (p50/p99 y nº de llamadas) para admins.
+# Solo responde a los chats de ADMIN_CHAT_IDS (lista separada por comas).
+from telegram import Update
+from telegram.ext import ContextTypes, CommandHandler
+from config import admin_chat_ids
+from services import metrics
+
+SECTIONS = (
+    ("Handlers", "bot_handler_seconds"),
+    ("Bot API", "telegram_api_seconds"),
+    ("Databricks", "databricks_request_seconds"),
+    ("Espera de runs", "databricks_run_wait_seconds"),
+    ("SQLite", "sqlite_query_seconds"),
+    ("Cola (espera)", "audit_queue_wait_seconds"),
+    ("Jobs", "audit_job_seconds"),
+)
+
+def _fmt_s(v: float) -> str:
+    if v == float("inf"):
+        return ">600s"
+    return f"{v * 1000:.0f}ms" if v < 1 else f"{v:.1f}s"
+
+def render_stats(limit: int = 8) -> str:
+    out = []
+    for title, name in SECTIONS:
+        rows = metrics.histograms(name)
+        if not rows:
+            continue
+        rows.sort(key=lambda r: -r[1].count)
+        out.append(f"{title}:")
+        for labels, h in rows[:limit]:
+            tag = " ".join(labels.values()) or "total"
+            out.append(f"  {tag}: n={h.count} p50={_fmt_s(h.quantile(0.5))} p99={_fmt_s(h.quantile(0.99))}")
+    backlog = metrics.gauge("audit_queue_backlog")
+    if backlog is not None:
+        out.append(f"Cola: {backlog:.0f} jobs pendientes")
+    return "\n".join(out) or "Sin métricas todavía."
+
+async def stats_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_chat.id not in admin_chat_ids():
+        return await update.message.reply_text("Comando solo para administradores.")
+    await update.message.reply_text(render_stats())
+
+def register_handlers(app):
+    app.add_handler(CommandHandler("stats", stats_cmd))
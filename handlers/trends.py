@@ -0,0 +1,58 @@
+# handlers/trends.py
+# /trends — evolución de las auditorías del chat (agregados incrementales, ver db/sqlite_store.py):
+# total, % con errores por semana y por día (UTC) y los archivos con más errores.
+# /trends_rebuild [all] — recalcula los agregados desde audits y el archivo de
+# retención (services/retention.py) (solo ADMIN_CHAT_IDS).
+import datetime as dt
+from telegram import Update
+from telegram.ext import ContextTypes, CommandHandler
+from config import admin_chat_ids
+from db import sqlite_store as store
+from services import retention
+
+def _rate(r: dict) -> str:
+    parsed = r["audits"] - r["unparsed"]
+    return f"{100 * r['with_errors'] / parsed:.0f}%" if parsed else "—"
+
+def _date(bucket: int) -> dt.date:
+    return dt.datetime.fromtimestamp(bucket, dt.timezone.utc).date()
+
+def render_trends(t: dict) -> str:
+    total = t["total"]
+    if not total:
+        return "No hay auditorías registradas aún."
+    out = [
+        f"Total: {total['audits']} auditorías · {_rate(total)} con errores",
+        f"  invalid_date={total['invalid_date']}, duplicates={total['duplicates_tx']}, "
+        f"unbalanced={total['unbalanced_tx']}, required_nulls={total['required_nulls']}",
+    ]
+    if t["weekly"]:
+        out.append("\nPor semana (UTC):")
+        for r in t["weekly"]:
+            year, week, _ = _date(r["bucket"]).isocalendar()
+            out.append(f"  {year}-S{week:02d}: {r['audits']} · {_rate(r)} con errores · {r['errors']} errores")
+    if t["daily"]:
+        out.append("\nPor día (UTC):")
+        for r in t["daily"]:
+            out.append(f"  {_date(r['bucket'])}: {r['audits']} · {_rate(r)} con errores · {r['errors']} errores")
+    if t["worst_files"]:
+        out.append("\nArchivos con más errores:")
+        for f in t["worst_files"]:
+            out.append(f"  {f['file_name']}: {f['errors']} errores en {f['audits']} auditorías "
+                       f"(última: {f['last_errors'] if f['last_errors'] is not None else '?'})")
+    return "\n".join(out)
+
+async def trends_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    t = await store.trends(update.effective_chat.id)
+    await update.message.reply_text(render_trends(t))
+
+async def trends_rebuild_cmd(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_chat.id not in admin_chat_ids():
+        return await update.message.reply_text("Comando solo para administradores.")
+    everything = bool(context.args) and context.args[0].lower() in ("all", "todos")
+    await retention.rebuild_rollups(None if everything else update.effective_chat.id)
+    await update.message.reply_text("Agregados recalculados ✅" + (" (todos los chats)" if everything else ""))
+
+def register_handlers(app):
+    app.add_handler(CommandHandler("trends", trends_cmd))
+    app.add_handler(CommandHandler("trends_rebuild", trends_rebuild_cmd))
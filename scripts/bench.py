@@ -0,0 +1,643 @@
+# scripts/bench.py
+"""
+Benchmarks reproducibles de los caminos calientes del bot, sin red real:
+- Bot API falsa en proceso (FakeBotAPI) + stub de Databricks (scripts/dbx_stub.py)
+  con latencia configurable.
+- updates   → build_app() con updates sintéticos: updates/s en ráfaga y latencia
+              p50/p99 extremo a extremo (update → sendMessage) con N chats concurrentes.
+- audit_e2e → documentos .csv: descarga → staging → cola → Databricks stub → resumen
+              (segunda pasada con el mismo contenido: camino de caché; y el mismo CSV
+              nuevo desde varios chats a la vez: un solo run compartido).
+- store     → save_audit / list_audits / page_audits con 10^6 filas (SQLite con commit agrupado);
+              después compactación (services/retention.py) con tope por chat de la mitad de
+              sus filas: filas archivadas, duración, tamaño de la base y list_audits de nuevo.
+- ledger    → tiempo de auditoría streaming / columnar / paralelo con libros crecientes.
+- outbox    → envíos a muchos chats con la Bot API falsa aplicando los límites de
+              Telegram (429 + retry_after): caudal frente al máximo teórico y nº de 429.
+              En el resto de suites la Bot API falsa no limita (limitador desactivado).
+- persistence → SQLitePersistence con decenas de miles de chats: coste por update_chat_data,
+              flush agrupado a SQLite y recarga (get_chat_data) tras "reiniciar".
+Todo se ejecuta en un directorio temporal (data/, tmp/staging) y el resultado
+es un JSON (--out) para seguir regresiones entre versiones (--compare anterior.json).
+
+Uso:
+  python -m scripts.bench --quick
+  python -m scripts.bench --suites store,ledger --out bench/$(git rev-parse --short HEAD).json
+  python -m scripts.bench --compare bench/old.json --out bench/new.json
+"""
+
+import argparse, asyncio, contextlib, itertools, json, logging, os, platform, random
+import statistics, subprocess, sys, tempfile, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qs
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))   # se ejecuta desde un directorio temporal
+
+from engine import columnar, parallel
+from engine.csv_audit import audit_path as streaming_audit
+from scripts.dbx_stub import start_stub
+
+TOKEN = "123456:BENCH"
+SUITES = ("updates", "audit_e2e", "store", "ledger", "outbox", "persistence")
+# Límites de Telegram que emula la Bot API falsa con limits=True (msg/s, ráfaga)
+TG_GLOBAL, TG_CHAT = (30.0, 31.0), (1.0, 4.0)
+
+# ---- utilidades ----
+
+def _pcts(xs: List[float]) -> Dict[str, float]:
+    """Percentiles exactos (ms) de una lista de latencias en segundos."""
+    if not xs:
+        return {"n": 0}
+    s = sorted(xs)
+    at = lambda q: s[min(len(s) - 1, int(q * len(s)))] * 1000
+    return {"n": len(s), "mean_ms": round(statistics.fmean(s) * 1000, 3),
+            "p50_ms": round(at(0.50), 3), "p99_ms": round(at(0.99), 3),
+            "max_ms": round(s[-1] * 1000, 3)}
+
+def gen_ledger(path: Path, rows: int, seed: int = 1) -> Path:
+    """Libro contable sintético con ~1% de errores de cada tipo (fechas, nulos, descuadres, duplicados)."""
+    r = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("tx_id,date,account,debit,credit,desc\n")
+        tx = 0
+        while rows > 0:
+            tx += 1
+            amt = r.randint(1, 1000)
+            d = f"2025-{r.randint(1, 13):02d}-{r.randint(1, 28):02d}"   # mes 13 → fecha inválida
+            lines = [(d, "430", amt, 0), (d, "700", 0, amt)]
+            if r.random() < 0.05:
+                lines.append((d, "570", 0, r.randint(1, 9)))            # descuadre
+            if r.random() < 0.05:
+                lines.append(lines[0])                                  # duplicado
+            for dd, acc, de, cr in lines:
+                dd = "" if r.random() < 0.01 else dd
+                acc = "" if r.random() < 0.01 else acc
+                de = "" if r.random() < 0.01 else de
+                f.write(f"{tx},{dd},{acc},{de},{cr},\"desc, {tx}\"\n")
+                rows -= 1
+    return path
+
+def _git_rev() -> Optional[str]:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                             capture_output=True, text=True, timeout=5)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+def _hist_summary(name: str) -> Dict[str, Any]:
+    """p50/p99 (límite superior del bucket) de un histograma de services/metrics por etiquetas."""
+    from services import metrics
+    out = {}
+    for labels, h in metrics.histograms(name):
+        key = ",".join(f"{k}={v}" for k, v in sorted(labels.items())) or "total"
+        out[key] = {"n": h.count, "p50": h.quantile(0.5), "p99": h.quantile(0.99)}
+    return out
+
+# ---- Bot API falsa ----
+
+class FakeBotAPI:
+    """Servidor HTTP mínimo compatible con la Bot API para PTB (getMe, sendMessage, getFile…)."""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.files: Dict[str, bytes] = {}
+        self.calls: Dict[str, int] = {}
+        self.on_message: Callable[[int, str], None] = lambda chat_id, text: None
+        self.limits = False      # True → 429 con retry_after al superar TG_GLOBAL / TG_CHAT
+        self.floods = 0
+        self._allowance: Dict[Any, list] = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True, name="fake-bot-api").start()
+
+    def add_file(self, file_id: str, data: bytes) -> None:
+        self.files[file_id] = data
+
+    def close(self) -> None:
+        self.server.shutdown()
+
+    def _message(self, chat_id: int, text: str) -> Dict[str, Any]:
+        return {"message_id": next(self._ids), "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"}, "text": text}
+
+    def _flooded(self, chat_id: int) -> int:
+        """0 si el envío entra en los límites (y lo consume); si no, retry_after en segundos."""
+        now = time.monotonic()
+        with self._lock:
+            state = []
+            for key, (rate, burst) in (("*", TG_GLOBAL), (chat_id, TG_CHAT)):
+                tokens, stamp = self._allowance.get(key, (burst, now))
+                tokens = min(burst, tokens + (now - stamp) * rate)
+                if tokens < 1:
+                    self.floods += 1
+                    return max(1, int((1 - tokens) / rate + 0.999))
+                state.append((key, tokens))
+            for key, tokens in state:
+                self._allowance[key] = [tokens - 1, now]
+        return 0
+
+    def call(self, method: str, params: Dict[str, str]) -> Any:
+        with self._lock:
+            self.calls[method] = self.calls.get(method, 0) + 1
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        if method in ("sendMessage", "editMessageText"):
+            chat_id, text = int(params["chat_id"]), params.get("text", "")
+            self.on_message(chat_id, text)
+            return self._message(chat_id, text)
+        if method == "getFile":
+            fid = params["file_id"]
+            return {"file_id": fid, "file_unique_id": fid, "file_size": len(self.files[fid]),
+                    "file_path": f"documents/{fid}.csv"}
+        return True
+
+    def _handler(self):
+        api = self
+
+        class H(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, code: int, body: bytes, ctype: str = "application/json") -> None:
+                self.send_response(code)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                if api.latency:
+                    time.sleep(api.latency)
+                method = self.path.rsplit("/", 1)[-1]
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                if self.headers.get("Content-Type", "").startswith("application/json"):
+                    params = json.loads(raw or b"{}")
+                else:
+                    params = {k: v[0] for k, v in parse_qs(raw.decode()).items()}
+                if api.limits and "chat_id" in params:
+                    retry = api._flooded(params["chat_id"])
+                    if retry:
+                        return self._send(429, json.dumps({
+                            "ok": False, "error_code": 429, "parameters": {"retry_after": retry},
+                            "description": f"Too Many Requests: retry after {retry}"}).encode())
+                result = api.call(method, params)
+                self._send(200, json.dumps({"ok": True, "result": result}).encode())
+
+            def do_GET(self):
+                # /file/bot<token>/documents/<file_id>.csv
+                fid = self.path.rsplit("/", 1)[-1].removesuffix(".csv")
+                data = api.files.get(fid)
+                if data is None:
+                    return self._send(404, b"not found", "text/plain")
+                self._send(200, data, "text/csv")
+
+        return H
+
+class Inbox:
+    """Recoge los sendMessage del bot (desde el hilo del servidor) en el event loop."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.loop = loop
+        self.count = 0
+        self.target = 0
+        self.done = asyncio.Event()
+        self._waiters: Dict[int, tuple] = {}
+
+    def push(self, chat_id: int, text: str) -> None:
+        self.loop.call_soon_threadsafe(self._deliver, chat_id, text)
+
+    def _deliver(self, chat_id: int, text: str) -> None:
+        self.count += 1
+        if self.target and self.count >= self.target:
+            self.done.set()
+        w = self._waiters.get(chat_id)
+        if w and w[0](text) and not w[1].done():
+            del self._waiters[chat_id]
+            w[1].set_result(text)
+
+    def reset(self, target: int = 0) -> None:
+        self.count, self.target = 0, target
+        self.done.clear()
+
+    def expect(self, chat_id: int, match: Callable[[str], bool] = lambda t: True) -> asyncio.Future:
+        fut = self.loop.create_future()
+        self._waiters[chat_id] = (match, fut)
+        return fut
+
+# ---- updates sintéticos ----
+
+_update_ids = itertools.count(1)
+
+def _message(chat_id: int, **extra) -> Dict[str, Any]:
+    uid = next(_update_ids)
+    msg = {"message_id": uid, "date": int(time.time()),
+           "chat": {"id": chat_id, "type": "private"},
+           "from": {"id": chat_id, "is_bot": False, "first_name": "bench"}, **extra}
+    return {"update_id": uid, "message": msg}
+
+def text_update(chat_id: int, text: str) -> Dict[str, Any]:
+    extra: Dict[str, Any] = {"text": text}
+    if text.startswith("/"):
+        extra["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+    return _message(chat_id, **extra)
+
+def document_update(chat_id: int, file_id: str, file_name: str, size: int) -> Dict[str, Any]:
+    return _message(chat_id, document={"file_id": file_id, "file_unique_id": file_id,
+                                       "file_name": file_name, "mime_type": "text/csv",
+                                       "file_size": size})
+
+@contextlib.asynccontextmanager
+async def running(app):
+    """Mismo orden de arranque/parada que app.run_polling, pero sin getUpdates."""
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    await app.start()
+    try:
+        yield app
+    finally:
+        await app.stop()
+        if app.post_stop:
+            await app.post_stop(app)
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+# ---- suites ----
+
+async def bench_updates(app, inbox: Inbox, n: int, clients: int) -> Dict[str, Any]:
+    from telegram import Update
+    put = lambda d: app.update_queue.put_nowait(Update.de_json(d, app.bot))
+    texts = ("/echo bench", "/health", "hola bench", "/say bench")
+
+    # 1) ráfaga: n updates de golpe (mezcla de comandos y texto), 1 respuesta cada uno
+    inbox.reset(target=n)
+    t0 = time.perf_counter()
+    for i in range(n):
+        put(text_update(1_000 + i % 100, texts[i % len(texts)]))
+    await asyncio.wait_for(inbox.done.wait(), timeout=60 + n / 50)
+    burst = time.perf_counter() - t0
+
+    # 2) bucle cerrado: `clients` chats con un update en vuelo cada uno
+    lat: List[float] = []
+    inbox.reset()
+
+    async def client(chat_id: int, count: int) -> None:
+        for k in range(count):
+            fut = inbox.expect(chat_id)
+            t = time.perf_counter()
+            put(text_update(chat_id, f"/echo {k}"))
+            await asyncio.wait_for(fut, timeout=30)
+            lat.append(time.perf_counter() - t)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(client(5_000 + c, max(1, n // clients)) for c in range(clients)))
+    closed = time.perf_counter() - t0
+    return {"updates": n,
+            "burst_updates_per_s": round(n / burst, 1),
+            "closed_loop": {"clients": clients, "updates_per_s": round(len(lat) / closed, 1),
+                            "latency": _pcts(lat)}}
+
+async def bench_audit_e2e(app, api: FakeBotAPI, inbox: Inbox, stub, sizes: List[int],
+                          per_size: int, workdir: Path) -> Dict[str, Any]:
+    from telegram import Update
+    put = lambda d: app.update_queue.put_nowait(Update.de_json(d, app.bot))
+    is_summary = lambda t: t.startswith("Resumen auditoría") or "CSV no válido" in t
+    docs = []
+    for rows in sizes:
+        for k in range(per_size):
+            fid = f"r{rows}-{k}"
+            data = gen_ledger(workdir / f"{fid}.csv", rows, seed=rows * 1000 + k).read_bytes()
+            api.add_file(fid, data)
+            docs.append((rows, fid, len(data)))
+
+    async def one(chat_id: int, rows: int, fid: str, size: int) -> tuple:
+        fut = inbox.expect(chat_id, is_summary)
+        t = time.perf_counter()
+        put(document_update(chat_id, fid, f"{fid}.csv", size))
+        text = await asyncio.wait_for(fut, timeout=300)
+        return rows, time.perf_counter() - t, text
+
+    out: Dict[str, Any] = {"sizes": sizes, "per_size": per_size}
+    for phase, base in (("cold", 20_000), ("cache", 30_000)):
+        calls0 = dict(stub.state.calls)
+        t0 = time.perf_counter()
+        results = await asyncio.gather(*(one(base + i, *d) for i, d in enumerate(docs)))
+        wall = time.perf_counter() - t0
+        by_size = {str(rows): _pcts([s for r, s, _ in results if r == rows]) for rows in sizes}
+        calls = {k: v - calls0.get(k, 0) for k, v in stub.state.calls.items() if v - calls0.get(k, 0)}
+        out[phase] = {"wall_s": round(wall, 3), "audits": len(results), "latency_by_rows": by_size,
+                      "dbx_calls": calls}
+
+    # mismo CSV nuevo enviado a la vez desde varios chats: un único run para todos
+    rows = sizes[-1]
+    data = gen_ledger(workdir / "dup.csv", rows, seed=7).read_bytes()
+    api.add_file("dup", data)
+    calls0 = dict(stub.state.calls)
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(one(40_000 + i, rows, "dup", len(data)) for i in range(len(docs))))
+    out["duplicates"] = {"wall_s": round(time.perf_counter() - t0, 3), "audits": len(results),
+                         "latency": _pcts([s for _, s, _ in results]),
+                         "runs": stub.state.calls.get("run-now", 0) - calls0.get("run-now", 0)}
+    out["telegram_api"] = _hist_summary("telegram_api_seconds")
+    out["databricks_requests"] = _hist_summary("databricks_request_seconds")
+    out["databricks_polls_per_run"] = _hist_summary("databricks_polls_per_run")
+    return out
+
+async def bench_store(rows: int, chats: int, queries: int, clients: int) -> Dict[str, Any]:
+    from db.sqlite_store import SQLiteStore
+    path = Path("bench-store.db")
+    st = SQLiteStore(path).start()
+    summary = json.dumps(streaming_audit(gen_ledger(Path("store-sample.csv"), 50)), ensure_ascii=False)
+    window = 2048
+    t0 = time.perf_counter()
+    for start in range(0, rows, window):
+        await asyncio.gather(*(st.save_audit(i % chats, f"f{i}.csv", summary, None, None)
+                               for i in range(start, min(rows, start + window))))
+    insert = time.perf_counter() - t0
+
+    rnd = random.Random(7)
+
+    async def reads(query) -> Dict[str, Any]:
+        lat: List[float] = []
+
+        async def client(count: int) -> None:
+            for _ in range(count):
+                t = time.perf_counter()
+                await query(rnd.randrange(chats))
+                lat.append(time.perf_counter() - t)
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(client(max(1, queries // clients)) for _ in range(clients)))
+        return {"clients": clients, "queries_per_s": round(len(lat) / (time.perf_counter() - t0), 1),
+                "latency": _pcts(lat)}
+
+    async def deep_page(chat_id: int) -> None:
+        # primera página con filtro "con errores" y la siguiente (keyset)
+        rows, _ = await st.page_audits(chat_id, limit=5, has_errors=True, before=(time.time() - 1, 0))
+        if rows:
+            await st.page_audits(chat_id, limit=5, before=(rows[-1]["created_at"], rows[-1]["id"]))
+
+    db_bytes = lambda: path.stat().st_size + sum(p.stat().st_size for p in path.parent.glob(path.name + "-*"))
+    result = {"list_audits": await reads(lambda c: st.list_audits(c, limit=5)),
+              "page_audits": await reads(deep_page), "db_bytes": db_bytes()}
+
+    from db import sqlite_store as store
+    from services import retention
+    store._store = st
+    retention.ARCHIVE_DIR = Path("bench-archive")
+    t0 = time.perf_counter()
+    done = await retention.compact(max_age=0, per_chat=max(1, rows // chats // 2))
+    result["compact"] = {"archived": done["archived"], "seconds": round(time.perf_counter() - t0, 2),
+                         "db_bytes": db_bytes(), "free_bytes": done["free_bytes"],
+                         "archive_bytes": sum(p.stat().st_size for p in retention.ARCHIVE_DIR.iterdir()),
+                         "list_audits": await reads(lambda c: st.list_audits(c, limit=5))}
+    st.close()
+    store._store = None
+    return {"rows": rows, "chats": chats, "save_audit_per_s": round(rows / insert, 1), **result}
+
+async def bench_persistence(chats: int, rounds: int) -> Dict[str, Any]:
+    from db import sqlite_store as store
+    from services.persistence import SQLitePersistence
+    store._store = store.SQLiteStore(Path("bench-persistence.db")).start()
+    pers = SQLitePersistence()
+    await pers.get_chat_data()
+    flush_s, lat = [], []
+    for r in range(rounds):
+        # una pasada de Application.update_persistence: todos los chats tocados (½ sin cambios)
+        for chat_id in range(chats):
+            data = {"lang": "es", "last_audit": chat_id if r and chat_id % 2 else r * chats + chat_id}
+            t = time.perf_counter()
+            await pers.update_chat_data(chat_id, data)
+            lat.append(time.perf_counter() - t)
+        t = time.perf_counter()
+        await pers.flush()
+        flush_s.append(time.perf_counter() - t)
+    t = time.perf_counter()
+    loaded = await SQLitePersistence().get_chat_data()
+    load_s = time.perf_counter() - t
+    store.close()
+    store._store = None
+    return {"chats": chats, "rounds": rounds, "update_chat_data": _pcts(lat),
+            "flush_ms": [round(s * 1000, 1) for s in flush_s],
+            "reload_ms": round(load_s * 1000, 1), "reloaded": len(loaded)}
+
+def bench_ledger(sizes: List[int], workdir: Path) -> Dict[str, Any]:
+    backends = {"streaming": streaming_audit, "parallel": parallel.audit_path}
+    if columnar.AVAILABLE:
+        backends["columnar"] = columnar.audit_path
+    parallel.get_pool()   # el arranque del pool no cuenta en la medida
+    out: Dict[str, Any] = {"numpy": columnar.AVAILABLE, "parallel_workers": parallel.PARALLEL_WORKERS,
+                           "sizes": {}}
+    for rows in sizes:
+        path = gen_ledger(workdir / f"ledger-{rows}.csv", rows, seed=rows)
+        mb = path.stat().st_size / 1e6
+        res, counts = {}, set()
+        for name, fn in backends.items():
+            t0 = time.perf_counter()
+            summary = fn(path)
+            secs = time.perf_counter() - t0
+            counts.add(tuple(summary[r]["count"] for r in
+                             ("invalid_date", "duplicates_tx", "unbalanced_tx", "required_nulls")))
+            res[name] = {"seconds": round(secs, 4), "rows_per_s": round(rows / secs, 1),
+                         "mb_per_s": round(mb / secs, 2)}
+        out["sizes"][str(rows)] = {"mb": round(mb, 2), "consistent": len(counts) == 1, **res}
+        path.unlink()
+    parallel.shutdown_pool()
+    return out
+
+async def bench_outbox(api: FakeBotAPI, chats: int, per_chat: int) -> Dict[str, Any]:
+    """chats × per_chat mensajes de golpe contra la Bot API falsa con límites de Telegram."""
+    from telegram.error import RetryAfter
+    from telegram.ext import ExtBot
+    from telegram.request import HTTPXRequest
+    from services import outbox
+
+    async def blast(bot, base: int) -> tuple:
+        async def one(chat_id: int, k: int) -> bool:
+            try:
+                await bot.send_message(chat_id, f"mensaje {k}")
+                return True
+            except RetryAfter:
+                return False
+        t0 = time.perf_counter()
+        ok = await asyncio.gather(*(one(base + c, k) for k in range(per_chat) for c in range(chats)))
+        return time.perf_counter() - t0, sum(ok)
+
+    total = chats * per_chat
+    # cota inferior del tiempo con los límites emulados (ráfaga inicial incluida)
+    ideal = max((total - TG_GLOBAL[1]) / TG_GLOBAL[0], (per_chat - TG_CHAT[1]) / TG_CHAT[0], 0)
+    api.limits, api.floods = True, 0
+    out: Dict[str, Any] = {"chats": chats, "per_chat": per_chat, "ideal_s": round(ideal, 2)}
+    try:
+        limiter = outbox.RateLimiter(global_rate=TG_GLOBAL[0], chat_rate=TG_CHAT[0])
+        async with ExtBot(TOKEN, base_url=f"{api.url}/bot", rate_limiter=limiter,
+                          request=HTTPXRequest(connection_pool_size=64)) as bot:
+            wall, ok = await blast(bot, 70_000)
+        out["limited"] = {"wall_s": round(wall, 2), "delivered": ok, "msgs_per_s": round(ok / wall, 1),
+                          "efficiency": round(ideal / wall, 3) if wall else None, "http_429": api.floods}
+        # sin limitador: lo que Telegram rechazaría con 429
+        await asyncio.sleep(TG_CHAT[1] / TG_CHAT[0])
+        api.floods = 0
+        async with ExtBot(TOKEN, base_url=f"{api.url}/bot",
+                          request=HTTPXRequest(connection_pool_size=64)) as bot:
+            wall, ok = await blast(bot, 80_000)
+        out["unlimited"] = {"wall_s": round(wall, 2), "delivered": ok, "rejected_429": total - ok}
+    finally:
+        api.limits = False
+    return out
+
+# ---- comparación entre versiones ----
+
+_HIGHER_IS_BETTER = ("_per_s",)
+
+def _flatten(d: Any, prefix: str = "") -> Dict[str, float]:
+    if isinstance(d, dict):
+        out = {}
+        for k, v in d.items():
+            out.update(_flatten(v, f"{prefix}.{k}" if prefix else str(k)))
+        return out
+    if isinstance(d, (int, float)) and not isinstance(d, bool):
+        return {prefix: float(d)}
+    return {}
+
+def compare(old: Dict[str, Any], new: Dict[str, Any], threshold: float = 0.10) -> Dict[str, Any]:
+    """Cambios > threshold en métricas de rendimiento (throughput ↑ mejor, tiempos ↓ mejor)."""
+    a, b = _flatten(old.get("results", {})), _flatten(new.get("results", {}))
+    changes = {}
+    for key in sorted(a.keys() & b.keys()):
+        if not (key.endswith(_HIGHER_IS_BETTER) or key.endswith(("_ms", "seconds", "wall_s"))):
+            continue
+        if not a[key]:
+            continue
+        delta = (b[key] - a[key]) / a[key]
+        if abs(delta) < threshold:
+            continue
+        better = delta > 0 if key.endswith(_HIGHER_IS_BETTER) else delta < 0
+        changes[key] = {"old": a[key], "new": b[key], "delta_pct": round(delta * 100, 1),
+                        "verdict": "mejora" if better else "regresión"}
+    return {"against": old.get("meta", {}).get("git_rev"), "threshold": threshold, "changes": changes}
+
+# ---- main ----
+
+async def run(args, workdir: Path) -> Dict[str, Any]:
+    suites = args.suites
+    results: Dict[str, Any] = {}
+    if "store" in suites:
+        results["store"] = await bench_store(args.store_rows, args.store_chats,
+                                             args.store_queries, args.clients)
+    if "ledger" in suites:
+        results["ledger"] = await asyncio.to_thread(bench_ledger, args.ledger_sizes, workdir)
+    if "persistence" in suites:
+        results["persistence"] = await bench_persistence(args.persistence_chats, 3)
+    if not {"updates", "audit_e2e", "outbox"} & set(suites):
+        return results
+
+    # build_app() lee la configuración del entorno al importar: todo antes del import
+    stub, dbx_url = start_stub(run_seconds=args.dbx_run_seconds, latency=args.dbx_latency)
+    api = FakeBotAPI(latency=args.api_latency)
+    os.environ.update({
+        "TELEGRAM_TOKEN": TOKEN, "TELEGRAM_API_URL": api.url,
+        "DATABRICKS_HOST": dbx_url, "DATABRICKS_TOKEN": "bench", "DATABRICKS_JOB_ID_AUDIT": "1",
+        "AUDIT_EXECUTION": args.execution,
+        "DATABRICKS_BATCH_WINDOW": str(args.dbx_batch_window),
+        "DATABRICKS_BATCH_SCOPE": "global",   # cada documento llega desde un chat distinto
+        # la Bot API falsa no limita salvo en la suite outbox: limitador del bot sin efecto
+        "TG_GLOBAL_RATE": "1e9", "TG_CHAT_RATE": "1e9", "TG_GROUP_RATE_PER_MIN": "1e9",
+        # ni el control de admisión por chat (mide el camino completo, no el rechazo)
+        "ADMIT_AUDIT_PER_HOUR": "1e9", "ADMIT_MSG_RATE": "1e9",
+    })
+    try:
+        if "outbox" in suites:
+            results["outbox"] = await bench_outbox(api, args.outbox_chats, args.outbox_per_chat)
+        if not {"updates", "audit_e2e"} & set(suites):
+            return results
+        import app as bot
+        inbox = Inbox(asyncio.get_running_loop())
+        api.on_message = inbox.push
+        async with running(bot.create_app()) as app:
+            if "updates" in suites:
+                results["updates"] = await bench_updates(app, inbox, args.updates, args.clients)
+            if "audit_e2e" in suites:
+                results["audit_e2e"] = await bench_audit_e2e(
+                    app, api, inbox, stub, args.e2e_sizes, args.e2e_per_size, workdir)
+                results["audit_e2e"]["execution"] = args.execution
+                results["audit_e2e"]["batch_window"] = args.dbx_batch_window
+    finally:
+        api.close()
+        stub.shutdown()
+    return results
+
+def _ints(s: str) -> List[int]:
+    return [int(float(x)) for x in s.split(",") if x]
+
+def main() -> None:
+    p = argparse.ArgumentParser(description="Benchmarks del bot (Bot API falsa + stub Databricks)")
+    p.add_argument("--suites", default=",".join(SUITES), help=f"subconjunto de {','.join(SUITES)}")
+    p.add_argument("--quick", action="store_true", help="tamaños reducidos (humo, ~1 min)")
+    p.add_argument("--out", help="ruta del JSON de resultados (por defecto solo stdout)")
+    p.add_argument("--compare", help="JSON de una ejecución anterior para marcar regresiones")
+    p.add_argument("--updates", type=int, default=5_000)
+    p.add_argument("--clients", type=int, default=16, help="clientes concurrentes (updates/list_audits)")
+    p.add_argument("--store-rows", type=int, default=1_000_000)
+    p.add_argument("--store-chats", type=int, default=1_000)
+    p.add_argument("--store-queries", type=int, default=20_000)
+    p.add_argument("--ledger-sizes", type=_ints, default=_ints("1e4,1e5,1e6"))
+    p.add_argument("--e2e-sizes", type=_ints, default=_ints("1e3,1e4,1e5"))
+    p.add_argument("--e2e-per-size", type=int, default=4)
+    p.add_argument("--outbox-chats", type=int, default=200)
+    p.add_argument("--outbox-per-chat", type=int, default=10)
+    p.add_argument("--persistence-chats", type=int, default=50_000)
+    p.add_argument("--execution", default="databricks", choices=("databricks", "parallel", "local", "auto"))
+    p.add_argument("--api-latency", type=float, default=0.0, help="latencia de la Bot API falsa (s)")
+    p.add_argument("--dbx-latency", type=float, default=0.02, help="latencia por llamada del stub (s)")
+    p.add_argument("--dbx-run-seconds", type=float, default=0.5, help="duración de cada run del stub (s)")
+    p.add_argument("--dbx-batch-window", type=float, default=0.0,
+                   help="DATABRICKS_BATCH_WINDOW del bot (s, lotes globales; 0 = un run por CSV)")
+    p.add_argument("-v", "--verbose", action="store_true")
+    args = p.parse_args()
+    args.suites = [s for s in args.suites.split(",") if s]
+    if unknown := set(args.suites) - set(SUITES):
+        p.error(f"suites desconocidas: {','.join(sorted(unknown))}")
+    if args.quick:
+        args.updates, args.store_rows, args.store_queries = 500, 20_000, 2_000
+        args.ledger_sizes, args.e2e_sizes, args.e2e_per_size = [1_000, 10_000, 100_000], [1_000, 10_000], 2
+        args.outbox_chats, args.outbox_per_chat = 40, 6
+        args.persistence_chats = 10_000
+
+    # antes de importar app: su setup_logging() no pisa este nivel
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+    out_path = Path(args.out).resolve() if args.out else None
+    old = json.loads(Path(args.compare).read_text()) if args.compare else None
+
+    with tempfile.TemporaryDirectory(prefix="bot-bench-") as tmp:
+        os.chdir(tmp)   # data/bot.db y tmp/staging del bot quedan aislados
+        t0 = time.perf_counter()
+        results = asyncio.run(run(args, Path(tmp)))
+        os.chdir(ROOT)
+    report = {
+        "meta": {"git_rev": _git_rev(), "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+                 "python": platform.python_version(), "platform": platform.platform(),
+                 "cpus": os.cpu_count(), "elapsed_s": round(time.perf_counter() - t0, 1),
+                 "args": {k: v for k, v in vars(args).items() if k not in ("out", "compare")}},
+        "results": results,
+    }
+    if old is not None:
+        report["compare"] = compare(old, report)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if out_path:
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        out_path.write_text(text + "\n", encoding="utf-8")
+    print(text)
+
+if __name__ == "__main__":
+    main()
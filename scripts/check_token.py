@@ -1,31 +1,38 @@
 # scripts/check_token.py
-import asyncio
+# getMe directo con la librería estándar: sin construir la Application de PTB
+# (arranca en una fracción del tiempo). Respeta TELEGRAM_API_URL como app.py.
+import json
+import os
 import sys
-from telegram.ext import Application
-from telegram.error import InvalidToken, NetworkError
+import urllib.error
+import urllib.request
 from config import load_token, setup_logging
 
-async def check_token_async() -> int:
-    token = load_token()
-    app = Application.builder().token(token).build()
-    await app.initialize()
-    try:
-        me = await app.bot.get_me()
-        print("Bot OK ✅")
-        print(f"id: {me.id} | username: @{me.username} | name: {me.first_name}")
-        return 0
-    finally:
-        await app.shutdown()
+TIMEOUT = 10.0
+
+def get_me(token: str) -> dict:
+    api_url = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org").rstrip("/")
+    with urllib.request.urlopen(f"{api_url}/bot{token}/getMe", timeout=TIMEOUT) as resp:
+        return json.load(resp)["result"]
+
+def check_token() -> int:
+    me = get_me(load_token())
+    print("Bot OK ✅")
+    print(f"id: {me['id']} | username: @{me.get('username')} | name: {me.get('first_name')}")
+    return 0
 
 def main() -> None:
     setup_logging("INFO")
     try:
-        sys.exit(asyncio.run(check_token_async()))
-    except InvalidToken:
-        print("❌ Token inválido. Revisa/rota tu TELEGRAM_TOKEN y vuelve a probar.")
-        sys.exit(1)
-    except NetworkError as e:
-        print(f"🌐 Error de red: {e}")
+        sys.exit(check_token())
+    except urllib.error.HTTPError as e:
+        if e.code in (401, 404):   # la Bot API responde así a tokens inválidos/revocados
+            print("❌ Token inválido. Revisa/rota tu TELEGRAM_TOKEN y vuelve a probar.")
+            sys.exit(1)
+        print(f"⚠️ Error inesperado: HTTP {e.code}")
+        sys.exit(99)
+    except (urllib.error.URLError, TimeoutError) as e:
+        print(f"🌐 Error de red: {getattr(e, 'reason', e)}")
         sys.exit(2)
     except Exception as e:
         print(f"⚠️ Error inesperado: {e}")
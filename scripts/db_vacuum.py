@@ -0,0 +1,26 @@
+# scripts/db_vacuum.py
+# Convierte data/bot.db (o la ruta indicada) a auto_vacuum=INCREMENTAL con un VACUUM
+# completo: las bases creadas antes de que el store lo fijase no devuelven al disco lo
+# que libera la retención (services/retention.py). Reescribe el archivo entero: con el
+# bot parado y espacio libre para una copia. Si ya está convertida no hace nada.
+#   python -m scripts.db_vacuum [ruta/bot.db]
+import sys
+from pathlib import Path
+from config import setup_logging
+from db import sqlite_store as store
+
+def main() -> None:
+    setup_logging("INFO")
+    path = Path(sys.argv[1]) if len(sys.argv) > 1 else store.DB_PATH
+    if not path.exists():
+        print(f"❌ No existe {path}")
+        sys.exit(1)
+    before = path.stat().st_size
+    seconds = store.convert_incremental(path)
+    if seconds is None:
+        print(f"{path} ya usa auto_vacuum=INCREMENTAL ✅")
+        return
+    print(f"{path} convertido en {seconds:.1f} s ✅ ({before / 1e6:.1f} MB → {path.stat().st_size / 1e6:.1f} MB)")
+
+if __name__ == "__main__":
+    main()
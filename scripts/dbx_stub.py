@@ -0,0 +1,207 @@
+# scripts/dbx_stub.py
+"""
+Stub local de la API de Databricks Jobs (sin workspace real).
+Implementa run-now, runs/get, runs/list, runs/get-output y la subida de
+archivos (dbfs/create|add-block|close|delete y PUT fs/files para Volumes).
+Cada run termina tras RUN_SECONDS y su output es la auditoría local del
+csv_b64 o del file_path (gzip) recibido, con los hallazgos fila a fila en
+"findings" (el formato que el bot separa del resumen, ver engine/findings.py).
+Lotes: con el parámetro "batch" (lista JSON de {job_id, file_name, csv_b64 |
+file_path}) el output es {"batch": [{job_id, file_name, …resumen}, …]}.
+
+Uso:
+  python -m scripts.dbx_stub --port 8765 --run-seconds 3 --latency 0.05
+  DATABRICKS_HOST=http://127.0.0.1:8765 DATABRICKS_TOKEN=x DATABRICKS_JOB_ID_AUDIT=1 python app.py
+
+Desde código (pruebas/benchmarks):
+  server, url = start_stub(run_seconds=0.5)
+  ...
+  server.shutdown()
+"""
+
+import argparse, base64, itertools, json, tempfile, threading, time
+from pathlib import Path
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, unquote
+
+from engine.csv_audit import audit_bytes, audit_path
+from engine.findings import Findings
+
+class _State:
+    def __init__(self, run_seconds: float, latency: float) -> None:
+        self.run_seconds = run_seconds
+        self.latency = latency
+        self.ids = itertools.count(1000)
+        self.lock = threading.Lock()
+        self.runs: dict[int, dict] = {}
+        self.calls: dict[str, int] = {}
+        self.files_dir = Path(tempfile.mkdtemp(prefix="dbx-stub-"))
+        self.handles: dict[int, Path] = {}
+
+    def local(self, remote: str) -> Path:
+        """Ruta remota (dbfs:/… o /Volumes/…) → archivo dentro del directorio del stub."""
+        name = remote.removeprefix("dbfs:").strip("/").replace("/", "__")
+        return self.files_dir / name
+
+    def life(self, run: dict) -> str:
+        elapsed = time.time() - run["start"]
+        if elapsed >= self.run_seconds:
+            return "TERMINATED"
+        return "RUNNING" if elapsed > self.run_seconds / 3 else "PENDING"
+
+    def state(self, run: dict) -> dict:
+        life = self.life(run)
+        return {"life_cycle_state": life,
+                "result_state": "SUCCESS" if life == "TERMINATED" else None}
+
+    def output(self, params: dict) -> str:
+        if "batch" in params:
+            items = []
+            for f in json.loads(params["batch"]):
+                item = json.loads(self.output(f))
+                items.append({"job_id": f.get("job_id"), "file_name": f.get("file_name"), **item})
+            return json.dumps({"batch": items, "engine": "dbx-stub"}, ensure_ascii=False)
+        findings = Findings()
+        try:
+            if "csv_b64" in params:
+                summary = audit_bytes(base64.b64decode(params["csv_b64"]), findings)
+            elif "file_path" in params:
+                summary = audit_path(self.local(params["file_path"]), findings)   # .gz → gzip
+            else:
+                summary = {"params": params}
+            summary["findings"] = findings.to_dict()
+        except Exception as e:
+            summary = {"error": str(e)}
+        summary["engine"] = "dbx-stub"
+        return json.dumps(summary, ensure_ascii=False)
+
+def _handler(st: _State):
+    class H(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"   # keep-alive
+
+        def log_message(self, *args):   # silencio
+            pass
+
+        def _send(self, code: int, body: dict) -> None:
+            data = json.dumps(body).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _body(self) -> bytes:
+            if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                out = bytearray()
+                while size := int(self.rfile.readline().split(b";")[0], 16):
+                    out += self.rfile.read(size)
+                    self.rfile.readline()
+                self.rfile.readline()
+                return bytes(out)
+            n = int(self.headers.get("Content-Length") or 0)
+            return self.rfile.read(n)
+
+        def _files(self, method: str, path: str) -> None:
+            if path.startswith("/api/2.0/fs/files/"):     # Volumes: cuerpo = archivo
+                remote = unquote(path.removeprefix("/api/2.0/fs/files"))
+                if method == "PUT":
+                    st.local(remote).write_bytes(self._body())
+                else:
+                    st.local(remote).unlink(missing_ok=True)
+                return self._send(200, {})
+            body = json.loads(self._body() or b"{}")
+            op = path.rsplit("/", 1)[-1]
+            if op == "create":
+                handle = next(st.ids)
+                st.handles[handle] = st.local(body["path"])
+                st.handles[handle].write_bytes(b"")
+                return self._send(200, {"handle": handle})
+            if op == "add-block":
+                with open(st.handles[body["handle"]], "ab") as f:
+                    f.write(base64.b64decode(body["data"]))
+                return self._send(200, {})
+            if op == "close":
+                st.handles.pop(body["handle"], None)
+                return self._send(200, {})
+            if op == "delete":
+                st.local(body["path"]).unlink(missing_ok=True)
+                return self._send(200, {})
+            self._send(404, {"error_code": "NOT_FOUND"})
+
+        def _route(self, method: str) -> None:
+            u = urlparse(self.path)
+            q = {k: v[0] for k, v in parse_qs(u.query).items()}
+            route = u.path.split("/jobs/", 1)[-1]
+            with st.lock:
+                st.calls[route] = st.calls.get(route, 0) + 1
+            if st.latency:
+                time.sleep(st.latency)
+            if "/dbfs/" in u.path or "/fs/files/" in u.path:
+                return self._files(method, u.path)
+            if method == "POST" and route == "run-now":
+                body = json.loads(self._body() or b"{}")
+                run_id = next(st.ids)
+                with st.lock:
+                    st.runs[run_id] = {"job_id": body.get("job_id"), "start": time.time(),
+                                       "params": body.get("notebook_params", {})}
+                return self._send(200, {"run_id": run_id})
+            if method != "GET":
+                return self._send(404, {"error_code": "NOT_FOUND"})
+            if route == "runs/list":
+                with st.lock:
+                    runs = [{"run_id": rid, "state": st.state(r)} for rid, r in st.runs.items()
+                            if str(r["job_id"]) == q.get("job_id")
+                            and (q.get("active_only") != "true" or st.life(r) != "TERMINATED")]
+                return self._send(200, {"runs": runs, "has_more": False})
+            run = st.runs.get(int(q.get("run_id", 0)))
+            if run is None:
+                return self._send(400, {"error_code": "INVALID_PARAMETER_VALUE"})
+            if route == "runs/get":
+                return self._send(200, {"run_id": int(q["run_id"]), "state": st.state(run)})
+            if route == "runs/get-output":
+                if st.life(run) != "TERMINATED":
+                    return self._send(400, {"error_code": "INVALID_STATE"})
+                if "output" not in run:
+                    run["output"] = st.output(run["params"])
+                return self._send(200, {"notebook_output": {"result": run["output"]}})
+            self._send(404, {"error_code": "NOT_FOUND"})
+
+        def do_GET(self):
+            self._route("GET")
+
+        def do_POST(self):
+            self._route("POST")
+
+        def do_PUT(self):
+            self._route("PUT")
+
+        def do_DELETE(self):
+            self._route("DELETE")
+    return H
+
+def start_stub(host: str = "127.0.0.1", port: int = 0, *, run_seconds: float = 2.0,
+               latency: float = 0.0) -> tuple[ThreadingHTTPServer, str]:
+    """Arranca el stub en un hilo y devuelve (server, base_url). server.state tiene contadores."""
+    st = _State(run_seconds, latency)
+    server = ThreadingHTTPServer((host, port), _handler(st))
+    server.daemon_threads = True
+    server.state = st
+    threading.Thread(target=server.serve_forever, daemon=True, name="dbx-stub").start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stub local de Databricks Jobs")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--run-seconds", type=float, default=3.0)
+    parser.add_argument("--latency", type=float, default=0.0, help="latencia por llamada (s)")
+    args = parser.parse_args()
+    server, url = start_stub(port=args.port, run_seconds=args.run_seconds, latency=args.latency)
+    print(f"Stub Databricks escuchando en {url} (Ctrl+C para salir)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
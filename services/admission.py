@@ -0,0 +1,150 @@
+# services/admission.py
+# ─────────────────────────────────────────────────────────────────────────────
+# Control de admisión por chat, antes de cualquier handler (grupo -1 de PTB):
+# - Dos buckets de tokens por chat: "audit" (documentos .csv → descarga, staging
+#   y trabajo en la cola) y "msg" (todo lo demás: comandos, texto, botones).
+#   Sin token, el update no llega a los handlers (ApplicationHandlerStop) y se
+#   avisa una sola vez por espera, sin contestar a cada mensaje del flood.
+# - ADMIN_CHAT_IDS no tienen límite.
+# - Estado en memoria; con ADMISSION_PERSIST=1 se guarda en SQLite
+#   (admission_state) cada ADMISSION_SAVE_INTERVAL s y al parar, y se recupera al
+#   arrancar → reiniciar no regala una ráfaga nueva.
+# El reparto justo del trabajo de /audit entre chats ya admitidos está en
+# services/jobs.py (WFQ); la posición y espera estimada las da /queue.
+# ─────────────────────────────────────────────────────────────────────────────
+
+import asyncio, logging, math, os, time
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Update
+from telegram.ext import ApplicationHandlerStop, ContextTypes, TypeHandler
+
+from config import admin_chat_ids, worker_shard
+from db import sqlite_store as store
+from services import metrics
+from services.outbox import TokenBucket
+
+log = logging.getLogger(__name__)
+
+# (tokens/s, ráfaga) por tipo
+LIMITS: Dict[str, Tuple[float, float]] = {
+    "audit": (float(os.getenv("ADMIT_AUDIT_PER_HOUR", "30")) / 3600, float(os.getenv("ADMIT_AUDIT_BURST", "5"))),
+    "msg": (float(os.getenv("ADMIT_MSG_RATE", "1")), float(os.getenv("ADMIT_MSG_BURST", "20"))),
+}
+PERSIST = os.getenv("ADMISSION_PERSIST", "0") == "1"
+SAVE_INTERVAL = float(os.getenv("ADMISSION_SAVE_INTERVAL", "60"))
+
+_NOTICE = {
+    "audit": "Has enviado demasiados CSV seguidos. Podrás enviar otro en ~{wait}.",
+    "msg": "Vas demasiado rápido. Espera ~{wait} antes de seguir.",
+}
+
+def _kind(update: Update) -> str:
+    doc = update.message.document if update.message else None
+    if doc and ((doc.file_name or "").lower().endswith(".csv") or doc.mime_type == "text/csv"):
+        return "audit"
+    return "msg"
+
+def _wait_text(seconds: float) -> str:
+    return f"{math.ceil(seconds)} s" if seconds < 90 else f"{math.ceil(seconds / 60)} min"
+
+class Admission:
+    """Buckets por (tipo, chat); check_update() es el callback del TypeHandler."""
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]] = LIMITS) -> None:
+        self.limits = limits
+        self.exempt = admin_chat_ids()
+        self._buckets: Dict[Tuple[str, int], TokenBucket] = {}
+        self._notified: Dict[Tuple[str, int], float] = {}   # hasta cuándo ya está avisado
+        self._sweep_at = 0.0
+        # tras este tiempo sin uso cualquier bucket estaría lleno: no hace falta guardarlo
+        self.max_age = max(burst / rate for rate, burst in limits.values())
+
+    def _bucket(self, kind: str, chat_id: int, now: float) -> TokenBucket:
+        if now >= self._sweep_at:   # olvida chats inactivos (su bucket estaría lleno)
+            self._buckets = {k: b for k, b in self._buckets.items() if not b.idle(now)}
+            self._notified = {k: t for k, t in self._notified.items() if t > now}
+            self._sweep_at = now + 60
+        bucket = self._buckets.get((kind, chat_id))
+        if bucket is None:
+            bucket = self._buckets[kind, chat_id] = TokenBucket(*self.limits[kind])
+        return bucket
+
+    def admit(self, kind: str, chat_id: int, now: Optional[float] = None) -> float:
+        """0 si se admite (gasta un token); si no, segundos hasta el siguiente token."""
+        if chat_id in self.exempt:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        return self._bucket(kind, chat_id, now).take(now)
+
+    async def check_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        chat = update.effective_chat
+        if chat is None:
+            return
+        kind = _kind(update)
+        now = time.monotonic()
+        wait = self.admit(kind, chat.id, now)
+        if not wait:
+            return
+        metrics.inc("admission_rejected_total", kind=kind)
+        if self._notified.get((kind, chat.id), 0.0) <= now and update.effective_message:
+            self._notified[kind, chat.id] = now + wait
+            await update.effective_message.reply_text(_NOTICE[kind].format(wait=_wait_text(wait)))
+        raise ApplicationHandlerStop
+
+    # ---- persistencia opcional ----
+
+    def snapshot(self) -> List[tuple]:
+        """(chat_id, kind, tokens, epoch) de los buckets que no están llenos."""
+        now, wall = time.monotonic(), time.time()
+        rows = []
+        for (kind, chat_id), b in self._buckets.items():
+            tokens = min(b.burst, b.tokens + (now - b.stamp) * b.rate)
+            if tokens < b.burst:
+                rows.append((chat_id, kind, tokens, wall))
+        return rows
+
+    def restore(self, rows: List[tuple]) -> None:
+        index, total = worker_shard()
+        now, wall = time.monotonic(), time.time()
+        for chat_id, kind, tokens, at in rows:
+            if kind not in self.limits or chat_id % total != index:
+                continue
+            b = self._bucket(kind, chat_id, now)
+            b.tokens = min(b.burst, tokens + max(0.0, wall - at) * b.rate)
+
+def install(app) -> Admission:
+    """Registra el filtro de admisión (grupo -1) y, con ADMISSION_PERSIST, su guardado en SQLite."""
+    from services.hooks import add_hook
+    adm = Admission()
+    app.add_handler(TypeHandler(Update, adm.check_update), group=-1)
+    app.bot_data["admission"] = adm
+    if not PERSIST:
+        return adm
+    task: Optional[asyncio.Task] = None
+
+    async def _save() -> None:
+        await store.get_store().admission_save(adm.snapshot(), adm.max_age)
+
+    async def _loop() -> None:
+        while True:
+            await asyncio.sleep(SAVE_INTERVAL)
+            try:
+                await _save()
+            except Exception:
+                log.exception("No se pudo guardar el estado de admisión")
+
+    async def _on_init(_app) -> None:
+        nonlocal task
+        adm.restore(await store.get_store().admission_load(adm.max_age))
+        task = asyncio.create_task(_loop())
+
+    async def _on_stop(_app) -> None:
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        await _save()
+
+    add_hook(app, "post_init", _on_init)
+    add_hook(app, "post_stop", _on_stop)
+    return adm
@@ -0,0 +1,76 @@
+# services/cache.py
+# ─────────────────────────────────────────────────────────────────────────────
+# Caché de resultados de auditoría direccionada por contenido:
+# - Clave = sha256(bytes del CSV) + versión de reglas del motor que lo audita.
+# - LRU en memoria (TTL + nº máximo de entradas) delante de la tabla audit_cache.
+# - En SQLite: caducidad por edad y desalojo por tamaño total (menos usadas).
+# Re-subir el mismo export devuelve el summary_json guardado en milisegundos.
+# ─────────────────────────────────────────────────────────────────────────────
+
+import hashlib, os, time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from db import sqlite_store as store
+
+CACHE_TTL = float(os.getenv("AUDIT_CACHE_TTL", str(7 * 24 * 3600)))        # segundos
+CACHE_MEM_ENTRIES = int(os.getenv("AUDIT_CACHE_MEM_ENTRIES", "512"))
+CACHE_DB_MAX_BYTES = int(os.getenv("AUDIT_CACHE_DB_MAX_BYTES", str(50_000_000)))
+_EVICT_EVERY = 100   # puts entre pasadas de desalojo en SQLite
+
+def file_digest(path: str | Path) -> str:
+    """sha256 del archivo en streaming (llamar en un hilo)."""
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+def cache_key(digest: str, rules_version: str) -> str:
+    return f"{digest}:{rules_version}"
+
+class ResultCache:
+    def __init__(self, *, ttl: float = CACHE_TTL, mem_entries: int = CACHE_MEM_ENTRIES,
+                 db_max_bytes: int = CACHE_DB_MAX_BYTES) -> None:
+        self.ttl = ttl
+        self.mem_entries = mem_entries
+        self.db_max_bytes = db_max_bytes
+        self._lru: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._puts = 0
+        self.hits = self.misses = 0
+
+    def _remember(self, key: str, entry: Dict[str, Any]) -> None:
+        self._lru[key] = entry
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.mem_entries:
+            self._lru.popitem(last=False)
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Entrada {summary_json, run_id, run_url, created_at, audit_id} o None."""
+        entry = self._lru.get(key)
+        if entry is None:
+            entry = await store.get_store().cache_get(key)
+        if entry is None or time.time() - entry["created_at"] > self.ttl:
+            self._lru.pop(key, None)
+            self.misses += 1
+            return None
+        self._remember(key, entry)
+        self.hits += 1
+        return entry
+
+    async def put(self, key: str, summary_json: str, run_id: Optional[int] = None,
+                  run_url: Optional[str] = None, audit_id: Optional[int] = None) -> None:
+        """audit_id: auditoría que produjo el resultado (los aciertos copian sus hallazgos)."""
+        entry = {"summary_json": summary_json, "run_id": run_id, "run_url": run_url,
+                 "created_at": time.time(), "audit_id": audit_id}
+        self._remember(key, entry)
+        await store.get_store().cache_put(key, summary_json, run_id, run_url, audit_id)
+        self._puts += 1
+        if self._puts % _EVICT_EVERY == 0:
+            await store.get_store().cache_evict(self.ttl, self.db_max_bytes)
+
+_cache: Optional[ResultCache] = None
+
+def get_cache() -> ResultCache:
+    global _cache
+    if _cache is None:
+        _cache = ResultCache()
+    return _cache
@@ -0,0 +1,238 @@
+# services/databricks.py
+# ─────────────────────────────────────────────────────────────────────────────
+# Cliente asíncrono de Databricks Jobs:
+# - Un pool HTTP keep-alive por host (httpx.AsyncClient), sin hilos ni TLS por llamada.
+# - Reintentos con backoff en errores transitorios (5xx, 429, red).
+# - RunPoller: un único task consulta el estado de TODAS las ejecuciones en curso
+#   (jobs/runs/list?active_only=true) con backoff adaptativo + jitter.
+# - Subida por trozos de archivos en staging a DBFS (create/add-block/close) o a
+#   Volumes (PUT /fs/files en streaming): el job recibe solo la ruta.
+# ─────────────────────────────────────────────────────────────────────────────
+
+import asyncio, base64, logging, random, time
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional
+import httpx
+
+from services import metrics
+
+log = logging.getLogger(__name__)
+
+TERMINAL_STATES = {"TERMINATED", "INTERNAL_ERROR", "SKIPPED"}
+_RETRY_STATUS = {429, 500, 502, 503, 504}
+
+class DatabricksClient:
+    """Cliente de la API de Jobs con pool de conexiones persistente."""
+
+    def __init__(self, host: str, token: str, *, timeout: float = 60.0,
+                 max_connections: int = 10, retries: int = 3) -> None:
+        self.host = host.rstrip("/")
+        self.retries = retries
+        self._http = httpx.AsyncClient(
+            base_url=self.host,
+            headers={"Authorization": f"Bearer {token}", "Content-Type": "application/json"},
+            timeout=timeout,
+            limits=httpx.Limits(max_connections=max_connections,
+                                max_keepalive_connections=max_connections,
+                                keepalive_expiry=120),
+        )
+
+    async def _call(self, method: str, path: str, **kw) -> Dict[str, Any]:
+        delay = 0.5
+        endpoint = path.split("/", 3)[-1]          # /api/2.2/jobs/run-now → jobs/run-now
+        for attempt in range(self.retries + 1):
+            t0 = time.perf_counter()
+            try:
+                r = await self._http.request(method, path, **kw)
+                metrics.observe("databricks_request_seconds", time.perf_counter() - t0,
+                                endpoint=endpoint, status=r.status_code)
+                if r.status_code not in _RETRY_STATUS or attempt == self.retries:
+                    r.raise_for_status()
+                    return r.json()
+                wait = float(r.headers.get("Retry-After") or delay)
+            except httpx.TransportError as e:
+                metrics.observe("databricks_request_seconds", time.perf_counter() - t0,
+                                endpoint=endpoint, status="network")
+                if attempt == self.retries:
+                    raise
+                log.warning("Databricks %s %s falló (%s); reintento %d", method, path, e, attempt + 1)
+                wait = delay
+            await asyncio.sleep(wait * random.uniform(0.8, 1.2))
+            delay = min(delay * 2, 8.0)
+        raise RuntimeError("inalcanzable")
+
+    def run_url(self, run_id: int) -> str:
+        return f"{self.host}/jobs/runs/{run_id}"
+
+    async def run_now(self, job_id: int, notebook_params: Dict[str, str]) -> int:
+        data = await self._call("POST", "/api/2.2/jobs/run-now",
+                                json={"job_id": job_id, "notebook_params": notebook_params})
+        return data["run_id"]
+
+    async def get_state(self, run_id: int) -> Dict[str, Any]:
+        data = await self._call("GET", "/api/2.2/jobs/runs/get", params={"run_id": run_id})
+        return data["state"]
+
+    async def list_active(self, job_id: int) -> Dict[int, Dict[str, Any]]:
+        """run_id → state de las ejecuciones activas del job (paginado)."""
+        out: Dict[int, Dict[str, Any]] = {}
+        params: Dict[str, Any] = {"job_id": job_id, "active_only": "true", "limit": 25}
+        while True:
+            data = await self._call("GET", "/api/2.2/jobs/runs/list", params=params)
+            for run in data.get("runs", []):
+                out[run["run_id"]] = run.get("state", {})
+            token = data.get("next_page_token")
+            if not (data.get("has_more") and token):
+                return out
+            params["page_token"] = token
+
+    async def get_output(self, run_id: int) -> str:
+        data = await self._call("GET", "/api/2.1/jobs/runs/get-output", params={"run_id": run_id})
+        return data.get("notebook_output", {}).get("result", "(sin resultado)")
+
+    # ---- archivos (staging remoto) ----
+
+    async def upload(self, local: Path, remote: str, block_size: int = 1 << 20) -> str:
+        """Sube 'local' a 'remote' (dbfs:/… o /Volumes/…) sin cargarlo entero en memoria."""
+        if remote.startswith("/Volumes/"):
+            async def body() -> AsyncIterator[bytes]:
+                f = await asyncio.to_thread(open, local, "rb")
+                try:
+                    while chunk := await asyncio.to_thread(f.read, block_size):
+                        yield chunk
+                finally:
+                    f.close()
+            r = await self._http.put(f"/api/2.0/fs/files{remote}", params={"overwrite": "true"},
+                                     content=body(), headers={"Content-Type": "application/octet-stream"})
+            r.raise_for_status()
+            return remote
+
+        path = remote.removeprefix("dbfs:")
+        handle = (await self._call("POST", "/api/2.0/dbfs/create",
+                                   json={"path": path, "overwrite": True}))["handle"]
+        f = await asyncio.to_thread(open, local, "rb")
+        try:
+            # add-block admite como máximo 1 MB por llamada
+            while block := await asyncio.to_thread(f.read, block_size):
+                await self._call("POST", "/api/2.0/dbfs/add-block",
+                                 json={"handle": handle, "data": base64.b64encode(block).decode()})
+        finally:
+            f.close()
+            await self._call("POST", "/api/2.0/dbfs/close", json={"handle": handle})
+        return remote
+
+    async def delete(self, remote: str) -> None:
+        if remote.startswith("/Volumes/"):
+            r = await self._http.delete(f"/api/2.0/fs/files{remote}")
+            if r.status_code != 404:
+                r.raise_for_status()
+            return
+        await self._call("POST", "/api/2.0/dbfs/delete", json={"path": remote.removeprefix("dbfs:")})
+
+    async def aclose(self) -> None:
+        await self._http.aclose()
+
+class RunPoller:
+    """
+    Espera a que terminen las ejecuciones con un único bucle de polling.
+    - wait(job_id, run_id) → state final (o TimeoutError).
+    - Cada ronda: 1 llamada runs/list por job; las que ya no están activas se
+      confirman con runs/get. El intervalo crece (factor) hasta max_interval y
+      vuelve al mínimo cuando llega una ejecución nueva.
+    """
+
+    def __init__(self, client: DatabricksClient, *, min_interval: float = 1.0,
+                 max_interval: float = 15.0, factor: float = 1.6, jitter: float = 0.2) -> None:
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.factor = factor
+        self.jitter = jitter
+        # run_id → [job_id, fut, t0, nº de rondas de polling]
+        self._pending: Dict[int, List[Any]] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    async def wait(self, job_id: int, run_id: int, timeout: Optional[float] = None) -> Dict[str, Any]:
+        entry = self._pending.get(run_id)
+        if entry is None:
+            entry = self._pending[run_id] = [job_id, asyncio.get_running_loop().create_future(),
+                                             time.monotonic(), 0]
+            self._wake.set()
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._loop(), name="dbx-run-poller")
+        return await asyncio.wait_for(asyncio.shield(entry[1]), timeout)
+
+    async def _loop(self) -> None:
+        delay = self.min_interval
+        while self._pending:
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), delay * random.uniform(1 - self.jitter, 1 + self.jitter))
+                delay = self.min_interval          # ejecución nueva → vuelve al mínimo
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self._poll_once()
+            except Exception as e:
+                log.warning("Polling Databricks falló: %s", e)
+            delay = min(delay * self.factor, self.max_interval)
+
+    async def _poll_once(self) -> None:
+        # descarta esperas canceladas/expiradas
+        for run_id, (_, fut, _, _) in list(self._pending.items()):
+            if fut.done():
+                self._pending.pop(run_id, None)
+        for entry in self._pending.values():
+            entry[3] += 1
+        job_ids = {entry[0] for entry in self._pending.values()}
+        active: Dict[int, Dict[str, Any]] = {}
+        for states in await asyncio.gather(*(self.client.list_active(j) for j in job_ids)):
+            active.update(states)
+
+        gone = [run_id for run_id in self._pending if run_id not in active]
+        states = await asyncio.gather(*(self.client.get_state(r) for r in gone), return_exceptions=True)
+        for run_id, state in zip(gone, states):
+            if isinstance(state, Exception):
+                continue
+            if state.get("life_cycle_state") in TERMINAL_STATES:
+                _, fut, t0, polls = self._pending.pop(run_id)
+                metrics.observe("databricks_run_wait_seconds", time.monotonic() - t0)
+                metrics.observe("databricks_polls_per_run", polls, buckets=metrics.COUNT_BUCKETS)
+                if not fut.done():
+                    fut.set_result(state)
+
+    async def aclose(self) -> None:
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        for entry in self._pending.values():
+            entry[1].cancel()
+        self._pending.clear()
+
+_clients: Dict[str, DatabricksClient] = {}
+_pollers: Dict[str, RunPoller] = {}
+
+def get_client(host: str, token: str) -> DatabricksClient:
+    """Un cliente (y por tanto un pool de conexiones) por host."""
+    host = host.rstrip("/")
+    if host not in _clients:
+        _clients[host] = DatabricksClient(host, token)
+    return _clients[host]
+
+def get_poller(host: str, token: str) -> RunPoller:
+    host = host.rstrip("/")
+    if host not in _pollers:
+        _pollers[host] = RunPoller(get_client(host, token))
+    return _pollers[host]
+
+async def aclose_all() -> None:
+    """Para los pollers y cierra los pools HTTP creados por get_poller()/get_client() (apagado)."""
+    pollers, clients = list(_pollers.values()), list(_clients.values())
+    _pollers.clear()
+    _clients.clear()
+    for poller in pollers:
+        await poller.aclose()
+    for client in clients:
+        await client.aclose()
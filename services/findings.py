@@ -0,0 +1,52 @@
+# services/findings.py
+# ─────────────────────────────────────────────────────────────────────────────
+# Hallazgos fila a fila de cada auditoría (tabla audit_findings):
+# - encode(): Findings → bloques comprimidos (en un hilo). El tope por regla
+#   (AUDIT_FINDINGS_MAX_PER_RULE) ya lo aplica Findings al recogerlos.
+# - page(): una página de hallazgos de una regla decodificando solo sus bloques.
+# - Retención: cada _PURGE_EVERY auditorías guardadas se borran los hallazgos
+#   más antiguos que AUDIT_FINDINGS_RETENTION_DAYS y, si la tabla supera
+#   AUDIT_FINDINGS_MAX_BYTES, los de las auditorías más antiguas (+ incremental_vacuum).
+# ─────────────────────────────────────────────────────────────────────────────
+
+import asyncio, logging, os
+from typing import List, Optional, Tuple
+
+from db import sqlite_store as store
+from engine.findings import BLOCK_SIZE, MAX_PER_RULE, Findings, decode_block, encode_blocks
+
+log = logging.getLogger(__name__)
+
+FINDINGS_MAX_PER_RULE = MAX_PER_RULE
+FINDINGS_RETENTION = float(os.getenv("AUDIT_FINDINGS_RETENTION_DAYS", "90")) * 86400
+FINDINGS_MAX_BYTES = int(os.getenv("AUDIT_FINDINGS_MAX_BYTES", str(1_000_000_000)))
+PAGE_SIZE = 20
+_PURGE_EVERY = 50   # auditorías con hallazgos entre pasadas de retención
+
+_saved = 0
+
+async def encode(findings: Optional[Findings]) -> Optional[List[tuple]]:
+    """Bloques para store.save_audit(findings=...), o None si no hay hallazgos."""
+    if not findings:
+        return None
+    return await asyncio.to_thread(encode_blocks, findings, FINDINGS_MAX_PER_RULE)
+
+async def saved() -> None:
+    """Avisar tras guardar una auditoría con hallazgos: aplica la retención de vez en cuando."""
+    global _saved
+    _saved += 1
+    if _saved % _PURGE_EVERY == 0:
+        n = await store.get_store().purge_findings(FINDINGS_RETENTION, FINDINGS_MAX_BYTES)
+        if n:
+            log.info("Retención de hallazgos: %d bloques borrados", n)
+
+async def page(audit_id: int, rule: str, page_no: int) -> List[Tuple[int, str]]:
+    """[(línea, tx_id)] de la página page_no (0 = primera) de una regla."""
+    start = page_no * PAGE_SIZE
+    first, last = start // BLOCK_SIZE, (start + PAGE_SIZE - 1) // BLOCK_SIZE
+    rows: List[Tuple[int, str]] = []
+    base = first * BLOCK_SIZE
+    for _block, _n, codec, data in await store.get_store().findings_blocks(audit_id, rule, first, last):
+        lines, txs = await asyncio.to_thread(decode_block, data, codec)
+        rows.extend(zip(lines, txs))
+    return rows[start - base:start - base + PAGE_SIZE]
@@ -0,0 +1,16 @@
+# services/hooks.py
+# Encadena callbacks de ciclo de vida de PTB (post_init / post_stop / post_shutdown)
+# sin pisar los que ya estén registrados por otros módulos.
+
+from typing import Awaitable, Callable
+
+def add_hook(app, name: str, fn: Callable[[object], Awaitable[None]]) -> None:
+    """Añade 'fn(app)' al hook 'name' de la Application, después de los existentes."""
+    prev = getattr(app, name)
+
+    async def chained(application) -> None:
+        if prev:
+            await prev(application)
+        await fn(application)
+
+    setattr(app, name, chained)
@@ -0,0 +1,269 @@
+# services/jobs.py
+# ─────────────────────────────────────────────────────────────────────────────
+# Cola de auditorías en segundo plano:
+# - El handler solo encola (submit) y responde al momento; N workers procesan.
+# - Límites: concurrencia global (= nº workers), por chat (per_chat) y tamaño
+#   máximo de la cola (maxsize → QueueFull).
+# - Estado persistido en SQLite (audit_jobs): queued → running → done/failed.
+#   Al arrancar, resume() re-encola lo que quedó pendiente (con varios workers
+#   webhook, solo los chats que enruta a este proceso: config.worker_shard()).
+# - Lotes: un worker puede reclamar (claim) otros jobs pendientes compatibles
+#   para procesarlos junto al suyo (p.ej. varios CSV en un único run de
+#   Databricks) y cerrarlos después con finish().
+# - Jobs aplazados: si process() lanza Deferred (p.ej. el run de Databricks sigue
+#   en curso), el job queda 'running' en SQLite, libera su worker y vuelve a la
+#   cola pasados unos segundos (o al reanudar tras un reinicio).
+# - Reparto justo entre chats (WFQ, self-clocked): cada job listo lleva una
+#   etiqueta de fin = max(reloj virtual, última etiqueta de su chat) + coste/peso
+#   y los workers sacan siempre la menor → un chat que sube 50 archivos no deja
+#   sin turno a los demás; coste (p.ej. por tamaño) y peso por chat configurables.
+# - Posición y espera estimada (media móvil de la duración de los jobs).
+# ─────────────────────────────────────────────────────────────────────────────
+
+import asyncio, heapq, itertools, logging, math, time
+from collections import defaultdict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from config import worker_shard
+from db import sqlite_store as store
+from services import metrics
+
+log = logging.getLogger(__name__)
+
+Job = Dict[str, Any]   # fila de audit_jobs (id, chat_id, file_name, file_path, status, run_id…)
+
+class QueueFull(Exception):
+    """La cola de auditorías ha alcanzado su tamaño máximo."""
+
+class Deferred(Exception):
+    """process() no ha terminado el job pero sigue vivo fuera: se reintenta en 'delay' s."""
+    def __init__(self, delay: float) -> None:
+        super().__init__(f"aplazado {delay:.0f} s")
+        self.delay = delay
+
+class AuditQueue:
+    def __init__(self, process: Callable[[Job], Awaitable[None]], *, workers: int = 4,
+                 per_chat: int = 1, maxsize: int = 100, cost: Optional[Callable[[Job], float]] = None,
+                 weights: Optional[Dict[int, float]] = None) -> None:
+        self.process = process
+        self.workers = workers
+        self.per_chat = per_chat
+        self.maxsize = maxsize
+        self.cost = cost or (lambda job: 1.0)
+        self.weights = weights or {}
+        self._ready: List[Tuple[float, int, Job]] = []   # heap (etiqueta de fin, orden, job)
+        self._seq = itertools.count()
+        self._vtime = 0.0                                  # etiqueta del último job servido
+        self._finish: Dict[int, float] = {}                # chat → última etiqueta asignada
+        self._avg_seconds: Optional[float] = None          # duración media de un job (EWMA)
+        self._wake = asyncio.Event()
+        self._waiting: Dict[int, Deque[Job]] = defaultdict(deque)   # chats al límite
+        self._active: Dict[int, int] = defaultdict(int)              # listos + en curso por chat
+        self._backlog = 0
+        self._enqueued: Dict[int, float] = {}                         # job id → monotonic
+        self._claimed: Dict[int, bool] = {}                           # reclamados → ¿cuenta en _active?
+        self._timers: Dict[int, asyncio.TimerHandle] = {}             # aplazados → reintento
+        self._tasks: List[asyncio.Task] = []
+
+    def __len__(self) -> int:
+        return self._backlog
+
+    def submit(self, job: Job, force: bool = False) -> int:
+        """Encola un job ya registrado en SQLite. Devuelve su posición (1 = siguiente)."""
+        if self._backlog >= self.maxsize and not force:
+            raise QueueFull()
+        self._backlog += 1
+        self._enqueued[job["id"]] = time.monotonic()
+        metrics.set_gauge("audit_queue_backlog", self._backlog)
+        chat_id = job["chat_id"]
+        if self._active[chat_id] < self.per_chat:
+            self._active[chat_id] += 1
+            self._push(job)
+        else:
+            self._waiting[chat_id].append(job)
+        return next(i for i, j in enumerate(self._order(), 1) if j is job)
+
+    def _push(self, job: Job) -> float:
+        chat_id = job["chat_id"]
+        start = max(self._vtime, self._finish.get(chat_id, 0.0))
+        tag = self._finish[chat_id] = start + self.cost(job) / self.weights.get(chat_id, 1.0)
+        heapq.heappush(self._ready, (tag, next(self._seq), job))
+        self._wake.set()
+        return tag
+
+    def eta(self, position: int) -> Optional[float]:
+        """Segundos estimados hasta el resultado del job en 'position' (None sin historial)."""
+        if self._avg_seconds is None:
+            return None
+        return math.ceil(position / self.workers) * self._avg_seconds
+
+    def _order(self) -> List[Job]:
+        """Orden previsto de servicio: listos por etiqueta y, para los que esperan hueco
+        en su chat, la etiqueta que recibirían si entrasen ahora uno tras otro."""
+        entries = list(self._ready)
+        for chat_id, waiting in self._waiting.items():
+            tag = self._finish.get(chat_id, 0.0)
+            for job in waiting:
+                tag = max(self._vtime, tag) + self.cost(job) / self.weights.get(chat_id, 1.0)
+                entries.append((tag, next(self._seq), job))
+        return [job for _, _, job in sorted(entries, key=lambda e: e[:2])]
+
+    def positions(self, chat_id: int) -> List[Tuple[Job, int]]:
+        """(job, posición prevista) de los jobs de un chat que aún no han empezado."""
+        return [(job, i) for i, job in enumerate(self._order(), 1) if job["chat_id"] == chat_id]
+
+    def _release(self, chat_id: int, counted: bool = True) -> None:
+        self._backlog -= 1
+        metrics.set_gauge("audit_queue_backlog", self._backlog)
+        if not counted:   # reclamado de la espera de su chat: no ocupaba hueco en _active
+            return
+        waiting = self._waiting.get(chat_id)
+        if waiting:
+            self._push(waiting.popleft())
+            if not waiting:
+                del self._waiting[chat_id]
+            return
+        self._active[chat_id] -= 1
+        if self._active[chat_id] <= 0:
+            del self._active[chat_id]
+            if self._finish.get(chat_id, 0.0) <= self._vtime:   # sin deuda pendiente: se olvida
+                self._finish.pop(chat_id, None)
+
+    def claim(self, match: Callable[[Job], bool], limit: int,
+              chat_id: Optional[int] = None) -> List[Job]:
+        """Saca de la cola, sin esperar, hasta 'limit' jobs pendientes que cumplan 'match'
+        (solo de 'chat_id' o de cualquier chat) para procesarlos junto al job en curso.
+        Cada uno debe cerrarse después con finish()."""
+        out: List[Job] = []
+        ok = lambda job: (chat_id is None or job["chat_id"] == chat_id) and match(job)
+
+        def take(dq: Deque[Job], counted: bool) -> None:
+            for job in list(dq):
+                if len(out) >= limit:
+                    return
+                if ok(job):
+                    dq.remove(job)
+                    self._claimed[job["id"]] = counted
+                    out.append(job)
+
+        for entry in sorted(self._ready):   # listos: en orden de turno
+            if len(out) >= limit:
+                break
+            if ok(entry[2]):
+                self._ready.remove(entry)
+                self._claimed[entry[2]["id"]] = True
+                out.append(entry[2])
+        heapq.heapify(self._ready)
+        for cid in ([chat_id] if chat_id is not None else list(self._waiting)):
+            waiting = self._waiting.get(cid)
+            if waiting:
+                take(waiting, False)
+                if not waiting:
+                    del self._waiting[cid]
+        now = time.monotonic()
+        for job in out:
+            metrics.observe("audit_queue_wait_seconds", now - self._enqueued.pop(job["id"], now))
+        return out
+
+    async def finish(self, job: Job, error: Optional[str] = None) -> None:
+        """Cierra un job obtenido con claim(): estado final en SQLite y hueco en la cola."""
+        if error is None:
+            await store.update_job(job["id"], "done")
+        else:
+            await store.update_job(job["id"], "failed", error=error[:500])
+        self._release(job["chat_id"], self._claimed.pop(job["id"], True))
+
+    def defer(self, job: Job, delay: float) -> None:
+        """Como finish() para un job reclamado que sigue vivo fuera: queda 'running' y vuelve en 'delay' s."""
+        self._release(job["chat_id"], self._claimed.pop(job["id"], True))
+        self._later(job, delay)
+
+    def _later(self, job: Job, delay: float) -> None:
+        def again() -> None:
+            self._timers.pop(job["id"], None)
+            self.submit(job, force=True)
+        self._timers[job["id"]] = asyncio.get_running_loop().call_later(delay, again)
+
+    async def _next(self) -> Job:
+        while not self._ready:
+            self._wake.clear()
+            await self._wake.wait()
+        self._vtime, _, job = heapq.heappop(self._ready)
+        return job
+
+    async def _worker(self, n: int) -> None:
+        while True:
+            job = await self._next()
+            t0 = time.monotonic()
+            metrics.observe("audit_queue_wait_seconds",
+                            t0 - self._enqueued.pop(job["id"], t0))
+            status = "failed"
+            try:
+                await store.update_job(job["id"], "running")
+                await self.process(job)
+                await store.update_job(job["id"], "done")
+                status = "done"
+            except Deferred as e:
+                status = "deferred"     # sigue 'running' en SQLite (con su run_id)
+                self._later(job, e.delay)
+            except asyncio.CancelledError:
+                status = "cancelled"
+                raise                   # apagado: queda 'running' y se reanuda al arrancar
+            except Exception as e:
+                log.exception("Job de auditoría %s falló", job["id"])
+                await store.update_job(job["id"], "failed", error=str(e)[:500])
+            finally:
+                elapsed = time.monotonic() - t0
+                metrics.observe("audit_job_seconds", elapsed, status=status)
+                if status == "done":
+                    self._avg_seconds = elapsed if self._avg_seconds is None else \
+                        0.8 * self._avg_seconds + 0.2 * elapsed
+                self._release(job["chat_id"])
+
+    async def start(self) -> None:
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(i), name=f"audit-worker-{i}")
+                           for i in range(self.workers)]
+
+    async def resume(self) -> int:
+        """Re-encola los jobs pendientes de una ejecución anterior."""
+        index, total = worker_shard()
+        jobs = [j for j in await store.pending_jobs() if j["chat_id"] % total == index]
+        for job in jobs:
+            self.submit(job, force=True)   # ya aceptados antes: no cuentan contra maxsize
+        if jobs:
+            log.info("Reanudados %d jobs de auditoría pendientes", len(jobs))
+        return len(jobs)
+
+    async def stop(self) -> None:
+        for h in self._timers.values():   # los aplazados siguen 'running': se reanudan al arrancar
+            h.cancel()
+        self._timers.clear()
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+_queue: Optional[AuditQueue] = None
+
+def get_queue() -> Optional[AuditQueue]:
+    return _queue
+
+def install(app, process: Callable[[Job], Awaitable[None]], **limits) -> AuditQueue:
+    """Crea la cola, la deja en app.bot_data y la arranca/para con la Application."""
+    from services.hooks import add_hook
+    global _queue
+    _queue = AuditQueue(process, **limits)
+    app.bot_data["audit_queue"] = _queue
+
+    async def _on_init(_app) -> None:
+        store.init()
+        await _queue.start()
+        await _queue.resume()
+
+    async def _on_stop(_app) -> None:
+        await _queue.stop()
+
+    add_hook(app, "post_init", _on_init)
+    add_hook(app, "post_stop", _on_stop)
+    return _queue
@@ -0,0 +1,191 @@
+# services/metrics.py
+# ─────────────────────────────────────────────────────────────────────────────
+# Métricas en proceso, baratas para dejarlas activas en producción:
+# - Histogramas de buckets fijos (latencias) y contadores, con etiquetas.
+# - instrument_app(app): envuelve TODOS los handlers registrados (latencia por comando).
+# - instrumented_request(): HTTPXRequest que mide cada llamada a la Bot API.
+# - Databricks (services/databricks.py), SQLite (db/sqlite_store.py) y la cola de
+#   auditorías (services/jobs.py) registran aquí sus tiempos.
+# - Exposición: formato Prometheus (render()) por HTTP en METRICS_PORT y /stats.
+# ─────────────────────────────────────────────────────────────────────────────
+
+import bisect, functools, logging, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+log = logging.getLogger(__name__)
+
+# Buckets (segundos) de 1 ms a 10 min, ~x2.5 entre escalones
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets=LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)    # último = +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Cuantil aproximado (límite superior del bucket que lo contiene)."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= target:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+_hists: Dict[Tuple[str, Labels], Histogram] = {}
+_counters: Dict[Tuple[str, Labels], float] = {}
+_gauges: Dict[Tuple[str, Labels], float] = {}
+_lock = threading.Lock()
+
+def _key(name: str, labels: Dict[str, object]) -> Tuple[str, Labels]:
+    return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def observe(name: str, value: float, buckets=LATENCY_BUCKETS, **labels) -> None:
+    key = _key(name, labels)
+    h = _hists.get(key)
+    if h is None:
+        with _lock:
+            h = _hists.setdefault(key, Histogram(buckets))
+    h.observe(value)
+
+def inc(name: str, n: float = 1, **labels) -> None:
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    _gauges[_key(name, labels)] = value
+
+class timed:
+    """Context manager (sync) que observa la duración del bloque en 'name'."""
+    __slots__ = ("name", "labels", "t0")
+
+    def __init__(self, name: str, **labels) -> None:
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self) -> "timed":
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.labels["status"] = "error"
+        observe(self.name, time.perf_counter() - self.t0, **self.labels)
+
+def gauge(name: str, **labels) -> Optional[float]:
+    return _gauges.get(_key(name, labels))
+
+def histograms(name: str) -> List[Tuple[Dict[str, str], Histogram]]:
+    return [(dict(labels), h) for (n, labels), h in _hists.items() if n == name]
+
+# ---- formato Prometheus ----
+
+def _fmt_labels(labels: Labels, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in items) + "}"
+
+def render() -> str:
+    out: List[str] = []
+    for (name, labels), value in sorted(_counters.items()):
+        out.append(f"{name}{_fmt_labels(labels)} {value}")
+    for (name, labels), value in sorted(_gauges.items()):
+        out.append(f"{name}{_fmt_labels(labels)} {value}")
+    for (name, labels), h in sorted(_hists.items(), key=lambda kv: kv[0]):
+        acc = 0
+        for bound, c in zip(list(h.buckets) + ["+Inf"], h.counts):
+            acc += c
+            out.append(f"{name}_bucket{_fmt_labels(labels, ('le', str(bound)))} {acc}")
+        out.append(f"{name}_sum{_fmt_labels(labels)} {h.sum}")
+        out.append(f"{name}_count{_fmt_labels(labels)} {h.count}")
+    return "\n".join(out) + "\n"
+
+def serve(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """Expone GET /metrics en un hilo aparte (no toca el event loop)."""
+    class H(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            body = render().encode() if self.path.startswith("/metrics") else b"not found"
+            self.send_response(200 if self.path.startswith("/metrics") else 404)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), H)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    log.info("Métricas Prometheus en http://%s:%d/metrics", host, port)
+    return server
+
+# ---- integración con PTB ----
+
+def _wrap(callback, name: str):
+    @functools.wraps(callback)
+    async def instrumented(update, context):
+        t0 = time.perf_counter()
+        status = "ok"
+        try:
+            return await callback(update, context)
+        except Exception as e:
+            # ApplicationHandlerStop (p.ej. admisión) corta el update a propósito: no es un error
+            status = "stop" if type(e).__name__ == "ApplicationHandlerStop" else "error"
+            raise
+        finally:
+            observe("bot_handler_seconds", time.perf_counter() - t0, handler=name, status=status)
+    instrumented.__instrumented__ = True
+    return instrumented
+
+def _handler_name(h) -> str:
+    commands = getattr(h, "commands", None)
+    if commands:
+        return "/" + sorted(commands)[0]
+    return getattr(h.callback, "__name__", type(h).__name__)
+
+def instrument_app(app) -> None:
+    """Envuelve el callback de cada handler ya registrado (llamar tras registrar todos)."""
+    for handlers in app.handlers.values():
+        for h in handlers:
+            if not getattr(h.callback, "__instrumented__", False):
+                h.callback = _wrap(h.callback, _handler_name(h))
+
+def instrumented_request(connection_pool_size: int = 256, **kwargs):
+    """HTTPXRequest que mide cada llamada a la Bot API (por método)."""
+    from telegram.request import HTTPXRequest
+
+    class InstrumentedRequest(HTTPXRequest):
+        async def do_request(self, url: str, method: str, *args, **kw):
+            api_method = url.rsplit("/", 1)[-1]
+            t0 = time.perf_counter()
+            status = "error"
+            try:
+                code, payload = await super().do_request(url, method, *args, **kw)
+                status = str(code)
+                return code, payload
+            finally:
+                observe("telegram_api_seconds", time.perf_counter() - t0, method=api_method, status=status)
+
+    return InstrumentedRequest(connection_pool_size=connection_pool_size, **kwargs)
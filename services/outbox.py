@@ -0,0 +1,212 @@
+# services/outbox.py
+# ─────────────────────────────────────────────────────────────────────────────
+# Mensajes salientes a Telegram:
+# - RateLimiter (extensión BaseRateLimiter de PTB): TODAS las llamadas del bot
+#   con chat_id pasan por un bucket de tokens global (~30 msg/s, repartido entre
+#   los workers webhook) y otro por chat (1 msg/s en privados, 20/min en grupos).
+#   Los turnos se reservan en orden (FIFO), así el caudal es el máximo permitido
+#   sin ráfagas que acaben en 429. Si aun así llega un RetryAfter, se pausa el
+#   bucket del chat (o el global) ese tiempo, se reduce su ritmo a la mitad (se
+#   recupera poco a poco con cada envío) y se reintenta.
+# - split_text()/send(): textos largos troceados en límites limpios (≤ 4096).
+# - progress(): un mensaje de estado por clave (p.ej. un job) que se edita in
+#   situ; las actualizaciones que aún no han salido se fusionan (solo va la última).
+# ─────────────────────────────────────────────────────────────────────────────
+
+import asyncio, logging, os, time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from telegram.error import BadRequest, RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from config import worker_shard
+from services import metrics
+
+log = logging.getLogger(__name__)
+
+GLOBAL_RATE = float(os.getenv("TG_GLOBAL_RATE", "30"))          # msg/s (todo el bot)
+CHAT_RATE = float(os.getenv("TG_CHAT_RATE", "1"))               # msg/s por chat privado
+GROUP_RATE = float(os.getenv("TG_GROUP_RATE_PER_MIN", "20")) / 60
+MAX_RETRIES = int(os.getenv("TG_MAX_RETRIES", "5"))
+MAX_LEN = 4096               # límite de texto de sendMessage / editMessageText
+
+class TokenBucket:
+    """Bucket de tokens con reserva: reserve() descuenta ya y devuelve cuánto esperar."""
+    __slots__ = ("nominal", "rate", "burst", "tokens", "stamp", "paused_until")
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.nominal = self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> float:
+        # 'now' puede ser algo anterior a stamp (tomado antes de crear el bucket): no descuenta
+        elapsed = max(0.0, now - self.stamp)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.stamp += elapsed
+        return elapsed
+
+    def reserve(self, now: float) -> float:
+        elapsed = self._refill(now)
+        self.tokens -= 1
+        if self.rate < self.nominal:      # tras un 429 recupera el ritmo nominal en ~30 s
+            self.rate = min(self.nominal, self.rate + elapsed * self.nominal / 30)
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.paused_until - now)
+
+    def take(self, now: float) -> float:
+        """Sin reserva: coge un token si lo hay (→ 0) o devuelve cuánto falta para el siguiente."""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def pause(self, seconds: float, now: float) -> None:
+        if now >= self.paused_until:      # un 429 por pausa: los reintentos en vuelo no cuentan
+            self.rate = max(self.rate / 2, self.nominal / 16)
+        self.paused_until = max(self.paused_until, now + seconds)
+        self.tokens = min(self.tokens, 0.0)
+
+    def idle(self, now: float) -> bool:
+        return now >= self.paused_until and self.tokens + (now - self.stamp) * self.rate >= self.burst
+
+class RateLimiter(BaseRateLimiter):
+    """Throttling previo (global + por chat) y reintento ante RetryAfter."""
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 group_rate: float = GROUP_RATE, max_retries: int = MAX_RETRIES) -> None:
+        rate = global_rate / worker_shard()[1]     # cada worker webhook, su parte
+        self.global_bucket = TokenBucket(rate, rate)
+        self.chat_rate, self.group_rate = chat_rate, group_rate
+        self.max_retries = max_retries
+        self._chats: Dict[Any, TokenBucket] = {}
+        self._sweep_at = 0.0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self._chats.clear()
+
+    def _chat_bucket(self, chat_id: Any, now: float) -> TokenBucket:
+        if now >= self._sweep_at:   # olvida chats inactivos (su bucket estaría lleno)
+            self._chats = {k: b for k, b in self._chats.items() if not b.idle(now)}
+            self._sweep_at = now + 60
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            group = isinstance(chat_id, str) or chat_id < 0
+            rate = self.group_rate if group else self.chat_rate
+            # Grupos: ráfaga de unos pocos mensajes; privados: ~1/s sostenido con algo de ráfaga
+            bucket = self._chats[chat_id] = TokenBucket(rate, 3.0)
+        return bucket
+
+    async def _acquire(self, chat_id: Any) -> None:
+        t0 = time.monotonic()
+        # primero el turno del chat y después el global: esperar al chat no gasta turnos globales
+        wait = self._chat_bucket(chat_id, t0).reserve(t0)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        now = time.monotonic()
+        wait = self.global_bucket.reserve(now)
+        if wait > 0:
+            await asyncio.sleep(wait)
+        metrics.observe("telegram_send_wait_seconds", time.monotonic() - t0)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                await self._acquire(chat_id)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                metrics.inc("telegram_retry_after_total", endpoint=endpoint)
+                if attempt >= self.max_retries:
+                    raise
+                delay = float(e.retry_after)
+                log.warning("429 en %s (chat %s): reintento en %.0f s", endpoint, chat_id, delay)
+                now = time.monotonic()
+                if chat_id is not None:
+                    self._chat_bucket(chat_id, now).pause(delay, now)
+                else:
+                    self.global_bucket.pause(delay, now)
+                    await asyncio.sleep(delay)
+
+# ---- troceado de textos largos ----
+
+def split_text(text: str, limit: int = MAX_LEN) -> List[str]:
+    """Trozos ≤ limit cortando por párrafo, línea, coma o espacio (en ese orden)."""
+    chunks = []
+    while len(text) > limit:
+        window = text[:limit]
+        for sep in ("\n\n", "\n", ", ", " "):
+            cut = window.rfind(sep)
+            if cut > limit // 2:
+                cut += len(sep)
+                break
+        else:
+            cut = limit
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip("\n")
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
+async def send(bot, chat_id: int, text: str, **kwargs):
+    """send_message troceado: reply_markup va en el último trozo. Devuelve el último Message."""
+    markup = kwargs.pop("reply_markup", None)
+    chunks = split_text(text)
+    msg = None
+    for i, chunk in enumerate(chunks):
+        last = i == len(chunks) - 1
+        msg = await bot.send_message(chat_id, chunk, reply_markup=markup if last else None, **kwargs)
+        kwargs.pop("reply_to_message_id", None)    # solo el primero responde al original
+    return msg
+
+# ---- mensajes de progreso editados in situ ----
+
+@dataclass
+class _Progress:
+    chat_id: int
+    message_id: Optional[int] = None
+    sent: Optional[str] = None
+    pending: Optional[str] = None
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+
+_progress: Dict[Any, _Progress] = {}
+
+async def progress(bot, chat_id: int, key: Any, text: str, **kwargs) -> None:
+    """Muestra 'text' como estado de 'key': la 1ª vez envía, después edita ese mensaje."""
+    slot = _progress.get(key)
+    if slot is None:
+        slot = _progress[key] = _Progress(chat_id)
+    slot.pending = text[:MAX_LEN]
+    async with slot.lock:
+        text, slot.pending = slot.pending, None
+        if text is None or text == slot.sent:     # ya salió en una llamada posterior
+            return
+        if slot.message_id is None:
+            msg = await bot.send_message(chat_id, text, **kwargs)
+            slot.message_id = msg.message_id
+        else:
+            try:
+                await bot.edit_message_text(text, chat_id=chat_id, message_id=slot.message_id)
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    raise
+        slot.sent = text
+
+async def finish(bot, chat_id: int, key: Any, text: str, **kwargs):
+    """Resultado final de 'key': mensaje nuevo (notifica al usuario); el de progreso queda como está."""
+    slot = _progress.pop(key, None)
+    if slot is not None:
+        slot.pending = None
+    return await send(bot, chat_id, text, **kwargs)
+
+def drop(key: Any) -> None:
+    """Olvida el mensaje de progreso de 'key' (job terminado sin pasar por finish)."""
+    _progress.pop(key, None)
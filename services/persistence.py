@@ -0,0 +1,172 @@
+# services/persistence.py
+# ─────────────────────────────────────────────────────────────────────────────
+# Persistencia de PTB (BasePersistence) sobre db/sqlite_store.py, tabla ptb_state:
+# - chat_data, user_data, conversaciones (y callback_data si se activa) sobreviven
+#   a reinicios. bot_data no se guarda por defecto: la app guarda ahí objetos de
+#   ejecución (cola de auditorías…).
+# - Lecturas: PTB carga todo en memoria al arrancar (get_*); después no se lee disco.
+#   Las get_* llegan en Application.initialize(), antes de post_init: abren ellas la
+#   base (store.init en un hilo) para no hacer DDL/migraciones en el bucle de eventos.
+# - Escrituras write-behind: update_*/drop_* solo anotan la entrada como sucia
+#   (O(1), PTB ya pasa una copia). Cada PERSISTENCE_FLUSH_DELAY se serializa en
+#   un hilo lo pendiente y va a SQLite en una sola transacción; las entradas cuyo
+#   pickle no ha cambiado no se reescriben.
+# - Webhook con N workers: cada chat lo atiende siempre el mismo worker, así que
+#   chat_data no se pisa entre procesos; user_data/conversaciones por usuario en
+#   chats de workers distintos → gana la última escritura.
+# ─────────────────────────────────────────────────────────────────────────────
+
+import asyncio, json, logging, os, pickle, time
+from typing import Any, Dict, Optional, Set, Tuple
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from db import sqlite_store as store
+from services import metrics
+
+log = logging.getLogger(__name__)
+
+# PTB llama a update_* para los chats/usuarios tocados cada UPDATE_INTERVAL s
+UPDATE_INTERVAL = float(os.getenv("PERSISTENCE_INTERVAL", "5"))
+FLUSH_DELAY = float(os.getenv("PERSISTENCE_FLUSH_DELAY", "0.05"))   # agrupa las llamadas de una pasada
+
+_DROP = object()   # marca de borrado en _dirty
+Key = Tuple[str, str]
+
+def _conv_key(key: tuple) -> str:
+    return json.dumps(list(key))
+
+class SQLitePersistence(BasePersistence):
+    """BasePersistence con caché en memoria y escritura diferida por lotes en SQLite."""
+
+    def __init__(self, store_data: Optional[PersistenceInput] = None,
+                 update_interval: float = UPDATE_INTERVAL) -> None:
+        super().__init__(store_data or PersistenceInput(bot_data=False, callback_data=False),
+                         update_interval)
+        self._dirty: Dict[Key, Any] = {}
+        self._saved: Dict[Key, bytes] = {}   # último pickle escrito: evita reescribir lo que no cambia
+        self._conversations: Dict[str, Dict[tuple, object]] = {}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self._lock = asyncio.Lock()
+
+    # ---- carga (una vez, en Application.initialize) ----
+
+    async def _load(self, kind: str) -> Dict[str, Any]:
+        await asyncio.to_thread(store.init)   # idempotente; la 1ª vez abre y migra
+        rows = await store.get_store().state_load(kind)
+        out = {}
+        for key, data in rows:
+            self._saved[kind, key] = data
+            out[key] = pickle.loads(data)
+        return out
+
+    async def get_chat_data(self) -> Dict[int, Any]:
+        return {int(k): v for k, v in (await self._load("chat")).items()}
+
+    async def get_user_data(self) -> Dict[int, Any]:
+        return {int(k): v for k, v in (await self._load("user")).items()}
+
+    async def get_bot_data(self) -> Any:
+        return (await self._load("bot")).get("", {})
+
+    async def get_callback_data(self) -> Optional[Any]:
+        return (await self._load("callback")).get("")
+
+    async def get_conversations(self, name: str) -> Dict[tuple, object]:
+        convs = self._conversations[name] = {
+            tuple(json.loads(k)): v for k, v in (await self._load(f"conv:{name}")).items()}
+        return dict(convs)
+
+    # ---- escritura diferida ----
+
+    def _mark(self, key: Key, value: Any) -> None:
+        self._dirty[key] = value
+        if self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(FLUSH_DELAY, self._spawn_flush)
+
+    def _spawn_flush(self) -> None:
+        self._timer = None
+        task = asyncio.create_task(self._flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _encode(self, dirty: Dict[Key, Any]) -> Tuple[list, list]:
+        """En un hilo: pickle de lo pendiente, descartando lo que no ha cambiado desde la última escritura."""
+        puts, drops = [], []
+        for key, value in dirty.items():
+            if value is _DROP:
+                drops.append(key)
+                continue
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            if self._saved.get(key) != data:
+                puts.append((*key, data))
+        return puts, drops
+
+    async def _flush(self) -> None:
+        async with self._lock:   # un lote cada vez: se escriben en orden
+            dirty, self._dirty = self._dirty, {}
+            if not dirty:
+                return
+            t0 = time.perf_counter()
+            try:
+                puts, drops = await asyncio.to_thread(self._encode, dirty)
+                if puts or drops:
+                    await store.get_store().state_save(puts, drops)
+            except Exception:
+                log.exception("No se pudo guardar el estado de PTB (%d entradas)", len(dirty))
+                for key, value in dirty.items():   # se reintenta con la siguiente pasada
+                    self._dirty.setdefault(key, value)
+                return
+            for kind, key, data in puts:
+                self._saved[kind, key] = data
+            for key in drops:
+                self._saved.pop(key, None)
+            metrics.observe("persistence_flush_seconds", time.perf_counter() - t0)
+            metrics.observe("persistence_flush_rows", len(puts) + len(drops), buckets=metrics.COUNT_BUCKETS)
+
+    async def update_chat_data(self, chat_id: int, data: Any) -> None:
+        self._mark(("chat", str(chat_id)), data)
+
+    async def update_user_data(self, user_id: int, data: Any) -> None:
+        self._mark(("user", str(user_id)), data)
+
+    async def update_bot_data(self, data: Any) -> None:
+        self._mark(("bot", ""), data)
+
+    async def update_callback_data(self, data: Any) -> None:
+        self._mark(("callback", ""), data)
+
+    async def update_conversation(self, name: str, key: tuple, new_state: Optional[object]) -> None:
+        convs = self._conversations.setdefault(name, {})
+        if new_state is None:
+            if key in convs:
+                del convs[key]
+                self._mark((f"conv:{name}", _conv_key(key)), _DROP)
+        elif convs.get(key) != new_state:
+            convs[key] = new_state
+            self._mark((f"conv:{name}", _conv_key(key)), new_state)
+
+    async def drop_chat_data(self, chat_id: int) -> None:
+        self._mark(("chat", str(chat_id)), _DROP)
+
+    async def drop_user_data(self, user_id: int) -> None:
+        self._mark(("user", str(user_id)), _DROP)
+
+    # los datos solo cambian en este proceso: nada que refrescar
+    async def refresh_chat_data(self, chat_id: int, chat_data: Any) -> None:
+        pass
+
+    async def refresh_user_data(self, user_id: int, user_data: Any) -> None:
+        pass
+
+    async def refresh_bot_data(self, bot_data: Any) -> None:
+        pass
+
+    async def flush(self) -> None:
+        """Application.shutdown: escribe ya lo pendiente (la base de datos se cierra después)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._flush()
@@ -0,0 +1,126 @@
+# services/retention.py
+# ─────────────────────────────────────────────────────────────────────────────
+# Retención y mantenimiento de data/bot.db (tarea en segundo plano):
+# - Cada AUDIT_COMPACT_INTERVAL s, las auditorías más antiguas que
+#   AUDIT_RETENTION_DAYS o por encima de las AUDIT_MAX_PER_CHAT más recientes de
+#   su chat salen de audits a archivos de solo-añadir comprimidos:
+#     <AUDIT_ARCHIVE_DIR>/audits-AAAA-MM.jsonl.gz (mes UTC de created_at)
+#   Cada lote es un miembro gzip nuevo con una fila JSON por auditoría → el archivo
+#   se lee entero con zcat / gzip.open (ver iter_archive). Primero se escribe y
+#   sincroniza el archivo y luego se borra en SQLite: tras una caída a medias una
+#   fila puede quedar archivada dos veces (mismo id), nunca perderse.
+#   Los agregados de /trends no se tocan: siguen contando lo archivado; para
+#   recalcularlos hay que sumar los archivos (rebuild_rollups de este módulo).
+# - En la misma pasada: retención de hallazgos y de la caché de resultados,
+#   incremental_vacuum y checkpoint TRUNCATE del WAL.
+# - Cada AUDIT_CHECKPOINT_INTERVAL s, checkpoint PASSIVE (el -wal no crece entre pasadas).
+# - En webhook con varios workers solo lo hace el worker 0.
+# ─────────────────────────────────────────────────────────────────────────────
+
+import asyncio, gzip, json, logging, os, time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional
+
+from config import worker_shard
+from db import sqlite_store as store
+from services import metrics
+
+log = logging.getLogger(__name__)
+
+RETENTION_DAYS = float(os.getenv("AUDIT_RETENTION_DAYS", "365"))     # 0 = sin límite de edad
+MAX_PER_CHAT = int(os.getenv("AUDIT_MAX_PER_CHAT", "5000"))         # 0 = sin tope por chat
+ARCHIVE_DIR = Path(os.getenv("AUDIT_ARCHIVE_DIR", str(store.DB_DIR / "archive")))
+COMPACT_INTERVAL = float(os.getenv("AUDIT_COMPACT_INTERVAL", "3600"))
+CHECKPOINT_INTERVAL = float(os.getenv("AUDIT_CHECKPOINT_INTERVAL", "300"))
+BATCH = 2000            # auditorías por lote (una transacción corta cada uno)
+VACUUM_PAGES = 4000     # páginas devueltas al sistema por pasada
+
+def _append(rows: List[Dict[str, Any]]) -> None:
+    """Añade las filas a los archivos de su mes (un miembro gzip por archivo y lote) y sincroniza."""
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+    by_month: Dict[str, List[Dict[str, Any]]] = {}
+    for r in rows:
+        by_month.setdefault(time.strftime("%Y-%m", time.gmtime(r["created_at"])), []).append(r)
+    for month, items in by_month.items():
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in items).encode("utf-8")
+        with open(ARCHIVE_DIR / f"audits-{month}.jsonl.gz", "ab") as f:
+            f.write(gzip.compress(data, compresslevel=9, mtime=0))
+            f.flush()
+            os.fsync(f.fileno())
+
+def iter_archive(chat_id: Optional[int] = None) -> Iterator[Dict[str, Any]]:
+    """Auditorías archivadas (de la más antigua a la más reciente), opcionalmente de un chat."""
+    for path in sorted(ARCHIVE_DIR.glob("audits-*.jsonl.gz")):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                row = json.loads(line)
+                if chat_id is None or row["chat_id"] == chat_id:
+                    yield row
+
+async def rebuild_rollups(chat_id: Optional[int] = None) -> None:
+    """Recalcula los agregados de /trends desde audits más las auditorías archivadas."""
+    await store.get_store().rebuild_rollups(chat_id, iter_archive(chat_id))
+
+async def compact(max_age: Optional[float] = None, per_chat: Optional[int] = None) -> Dict[str, Any]:
+    """Una pasada completa: archivo + retenciones + vacuum + checkpoint. Devuelve un resumen."""
+    from services.cache import CACHE_DB_MAX_BYTES, CACHE_TTL
+    from services.findings import FINDINGS_MAX_BYTES, FINDINGS_RETENTION
+    max_age = RETENTION_DAYS * 86400 if max_age is None else max_age
+    per_chat = MAX_PER_CHAT if per_chat is None else per_chat
+    st = store.get_store()
+    t0 = time.perf_counter()
+    archived = 0
+    while True:
+        rows = await st.archive_candidates(max_age, per_chat, BATCH)
+        if not rows:
+            break
+        await asyncio.to_thread(_append, rows)
+        archived += await st.delete_audits([r["id"] for r in rows])
+    blocks = await st.purge_findings(FINDINGS_RETENTION, FINDINGS_MAX_BYTES)
+    evicted = await st.cache_evict(CACHE_TTL, CACHE_DB_MAX_BYTES)
+    await st.incremental_vacuum(VACUUM_PAGES)   # no-op en bases sin auto_vacuum: se reutilizan las páginas
+    busy, wal_pages, _ = await st.checkpoint("TRUNCATE")
+    stats = await st.db_stats()
+
+    metrics.inc("audits_archived_total", archived)
+    metrics.set_gauge("sqlite_db_bytes", stats["bytes"])
+    metrics.set_gauge("sqlite_free_bytes", stats["free_bytes"])
+    metrics.set_gauge("audits_rows", stats["audits"])
+    metrics.observe("db_compact_seconds", time.perf_counter() - t0)
+    out = {"archived": archived, "findings_blocks": blocks, "cache_evicted": evicted,
+           "checkpoint_busy": bool(busy), "wal_pages": wal_pages, **stats}
+    if archived or blocks or evicted:
+        log.info("Compactación: %s", out)
+    return out
+
+async def _loop() -> None:
+    last_compact = time.monotonic()
+    while True:
+        await asyncio.sleep(CHECKPOINT_INTERVAL)
+        try:
+            if time.monotonic() - last_compact >= COMPACT_INTERVAL:
+                last_compact = time.monotonic()
+                await compact()
+            else:
+                await store.get_store().checkpoint("PASSIVE")
+        except Exception:
+            log.exception("Fallo en el mantenimiento de la base de datos")
+
+def install(app) -> None:
+    """Arranca/para la tarea de mantenimiento con la Application (solo en el worker 0)."""
+    from services.hooks import add_hook
+    if worker_shard()[0] != 0:
+        return
+    task: Optional[asyncio.Task] = None
+
+    async def _on_init(_app) -> None:
+        nonlocal task
+        task = asyncio.create_task(_loop())
+
+    async def _on_stop(_app) -> None:
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    add_hook(app, "post_init", _on_init)
+    add_hook(app, "post_stop", _on_stop)
@@ -0,0 +1,185 @@
+# services/staging.py
+# ─────────────────────────────────────────────────────────────────────────────
+# Área de staging para CSV grandes (sustituto local de DBFS / Volumes):
+# - La descarga de Telegram se escribe por trozos directamente a <id>.csv.gz,
+#   comprimiendo y calculando sha256 al vuelo → memoria plana sea cual sea el tamaño.
+# - Nada de read_bytes() ni base64 del archivo completo.
+# - Con un servidor Bot API local (archivos > 20 MB) file_path es una ruta local
+#   y se copia por trozos igual.
+# - Pre-chequeo con el primer trozo (engine/preflight.py): un CSV ilegible o sin
+#   las columnas obligatorias se rechaza sin descargar el resto; si viene en
+#   latin-1/cp1252 o con ';' se guarda ya normalizado a UTF-8 con comas. Si la
+#   muestra parecía UTF-8, el resto también se valida (Normalizer en modo paso).
+# ─────────────────────────────────────────────────────────────────────────────
+
+import asyncio, gzip, hashlib, logging, os, time, uuid
+from pathlib import Path
+from typing import AsyncIterator, Iterable, Optional
+from urllib.parse import quote, urlsplit, urlunsplit
+import httpx
+
+from engine import preflight
+from services import metrics
+
+log = logging.getLogger(__name__)
+
+STAGING_DIR = Path(os.getenv("AUDIT_STAGING_DIR", "tmp/staging"))
+CHUNK_SIZE = 1 << 20          # 1 MiB por trozo
+GZIP_LEVEL = 5                # buen equilibrio velocidad/ratio para CSV
+
+_http: Optional[httpx.AsyncClient] = None
+
+def _client() -> httpx.AsyncClient:
+    global _http
+    if _http is None:
+        _http = httpx.AsyncClient(timeout=httpx.Timeout(60.0, read=300.0), follow_redirects=True)
+    return _http
+
+class StagedFile:
+    """CSV comprimido en staging + metadatos (del CSV ya normalizado) y resultado del pre-chequeo."""
+
+    def __init__(self, path: Path, raw_size: int, sha256: str,
+                 checked: Optional[preflight.Preflight] = None) -> None:
+        self.path = path
+        self.raw_size = raw_size
+        self.sha256 = sha256
+        self.preflight = checked
+
+    @property
+    def gz_size(self) -> int:
+        return self.path.stat().st_size
+
+class _GzipSink:
+    """Escribe trozos crudos (normalizados si hay 'normalizer') → gzip en disco, con hash y contador."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._raw = open(path, "wb")
+        self._gz = gzip.GzipFile(fileobj=self._raw, mode="wb", compresslevel=GZIP_LEVEL, mtime=0)
+        self._sha = hashlib.sha256()
+        self.size = 0
+        self.normalizer: Optional[preflight.Normalizer] = None
+
+    def _put(self, data: bytes) -> None:
+        self._sha.update(data)
+        self._gz.write(data)
+        self.size += len(data)
+
+    def write(self, chunk: bytes) -> None:
+        self._put(self.normalizer.feed(chunk) if self.normalizer else chunk)
+
+    def close(self) -> str:
+        if self.normalizer:
+            self._put(self.normalizer.flush())
+        self._gz.close()
+        self._raw.close()
+        return self._sha.hexdigest()
+
+    def abort(self) -> None:
+        try:
+            self._gz.close()
+            self._raw.close()
+        finally:
+            self.path.unlink(missing_ok=True)
+
+async def _local_chunks(path: str) -> AsyncIterator[bytes]:
+    f = await asyncio.to_thread(open, path, "rb")
+    try:
+        while chunk := await asyncio.to_thread(f.read, CHUNK_SIZE):
+            yield chunk
+    finally:
+        f.close()
+
+async def _http_chunks(url: str) -> AsyncIterator[bytes]:
+    async with _client().stream("GET", url) as r:
+        r.raise_for_status()
+        async for chunk in r.aiter_bytes(CHUNK_SIZE):
+            yield chunk
+
+def _check(head: bytes, size: Optional[int]) -> preflight.Preflight:
+    try:
+        checked = preflight.inspect(head, size)
+    except ValueError:
+        metrics.inc("csv_preflight_total", result="rejected")
+        raise
+    metrics.inc("csv_preflight_total", result="normalized" if checked.normalize else "ok")
+    return checked
+
+async def stage_chunks(chunks: AsyncIterator[bytes], name: str, max_bytes: Optional[int] = None,
+                       size: Optional[int] = None, check: bool = True) -> StagedFile:
+    """Consume un iterador de trozos y lo deja comprimido en STAGING_DIR.
+    Con check, el primer trozo pasa por el pre-chequeo (ValueError → se corta la descarga)."""
+    STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    path = STAGING_DIR / f"{uuid.uuid4().hex}_{Path(name).stem}.csv.gz"
+    sink = _GzipSink(path)
+    checked = None
+    try:
+        async for chunk in chunks:
+            if check and checked is None:   # milisegundos: solo los primeros HEAD_BYTES
+                checked = _check(chunk, size)
+                if checked.normalize or checked.encoding == "utf-8":
+                    sink.normalizer = preflight.Normalizer(checked)
+            await asyncio.to_thread(sink.write, chunk)   # gzip + sha fuera del event loop
+            if max_bytes and sink.size > max_bytes:
+                raise ValueError(f"archivo mayor que el máximo permitido ({max_bytes // 1_000_000} MB)")
+        if check and checked is None:
+            _check(b"", 0)   # descarga vacía
+        digest = await asyncio.to_thread(sink.close)
+        if sink.normalizer and sink.normalizer.encoding != checked.encoding:
+            log.info("%s: UTF-8 solo en la muestra, convertido como %s", name, sink.normalizer.encoding)
+            metrics.inc("csv_preflight_total", result="reencoded")
+            checked.encoding = sink.normalizer.encoding
+    except BaseException:
+        await asyncio.to_thread(sink.abort)
+        raise
+    finally:
+        if hasattr(chunks, "aclose"):
+            await chunks.aclose()   # corta ya la descarga HTTP si se rechaza a medias
+    return StagedFile(path, sink.size, digest, checked)
+
+def _file_url(tg_file) -> str:
+    """URL de descarga con la API pública de PTB: get_file() ya deja file_path absoluto;
+    si viene relativo se antepone base_file_url del bot. Ruta codificada (tildes, espacios)."""
+    url = str(tg_file.file_path)
+    if not urlsplit(url).scheme:
+        url = f"{tg_file.get_bot().base_file_url}/{url.lstrip('/')}"
+    parts = urlsplit(url)
+    return urlunsplit(parts._replace(path=quote(parts.path)))
+
+async def stage_telegram_file(tg_file, name: str, max_bytes: Optional[int] = None) -> StagedFile:
+    """Descarga en streaming un telegram.File al área de staging."""
+    src = str(tg_file.file_path)
+    if os.path.isfile(src):   # servidor Bot API local (--local)
+        chunks = _local_chunks(src)
+    else:
+        chunks = _http_chunks(_file_url(tg_file))
+    return await stage_chunks(chunks, name, max_bytes, size=tg_file.file_size)
+
+def iter_gzip_chunks(path: Path, size: int = CHUNK_SIZE) -> Iterable[bytes]:
+    """Trozos del CSV original (descomprimido) de un archivo en staging."""
+    with gzip.open(path, "rb") as f:
+        while chunk := f.read(size):
+            yield chunk
+
+def staged_digest(path: Path) -> tuple[str, int]:
+    """sha256 y tamaño del CSV original a partir del .gz (jobs antiguos sin metadatos)."""
+    sha, n = hashlib.sha256(), 0
+    for chunk in iter_gzip_chunks(path):
+        sha.update(chunk)
+        n += len(chunk)
+    return sha.hexdigest(), n
+
+def sweep(keep: Iterable[str], older_than: float = 3600) -> int:
+    """Borra restos de staging que no pertenecen a jobs pendientes."""
+    if not STAGING_DIR.exists():
+        return 0
+    keep = {str(Path(p)) for p in keep}
+    cutoff = time.time() - older_than
+    removed = 0
+    for p in STAGING_DIR.iterdir():
+        if str(p) not in keep and p.stat().st_mtime < cutoff:
+            p.unlink(missing_ok=True)
+            removed += 1
+    if removed:
+        log.info("Staging: %d archivos huérfanos eliminados", removed)
+    return removed
@@ -0,0 +1,36 @@
+# tests/test_admission.py
+# ─────────────────────────────────────────────────────────────────────────────
+# services/admission.py + TokenBucket (services/outbox.py): ráfaga, espera hasta
+# el siguiente token y un 'now' anterior a la creación del bucket.
+#   python -m pytest -q tests/test_admission.py
+# ─────────────────────────────────────────────────────────────────────────────
+
+import time
+
+import pytest
+
+from services.admission import Admission
+from services.outbox import TokenBucket
+
+def test_burst_then_wait():
+    adm = Admission({"audit": (0.5, 2.0)})
+    now = time.monotonic() + 1
+    assert adm.admit("audit", 1, now) == 0.0
+    assert adm.admit("audit", 1, now) == 0.0
+    assert adm.admit("audit", 1, now) == pytest.approx(2.0)
+    assert adm.admit("audit", 2, now) == 0.0        # cada chat, su bucket
+    assert adm.admit("audit", 1, now + 2) == 0.0
+
+def test_now_before_bucket_creation_is_not_a_debt():
+    # check_update toma 'now' antes de que _bucket() cree el bucket: con un ritmo
+    # alto, el tiempo "negativo" vaciaba el bucket y rechazaba el primer CSV
+    adm = Admission({"audit": (1e9, 1.0)})
+    now = time.monotonic() - 0.01
+    assert adm.admit("audit", 1, now) == 0.0
+
+def test_reserve_never_goes_back_in_time():
+    b = TokenBucket(10.0, 1.0)
+    t = b.stamp
+    assert b.reserve(t - 5) == 0.0
+    assert b.stamp == t
+    assert b.reserve(t) == pytest.approx(0.1)
@@ -0,0 +1,38 @@
+# tests/test_columnar.py
+# ─────────────────────────────────────────────────────────────────────────────
+# engine/columnar.py: mismo resumen y hallazgos que el motor streaming con las
+# reglas comunes; una regla extra del registro cambia rules_version().
+#   python -m pytest -q tests/test_columnar.py
+# ─────────────────────────────────────────────────────────────────────────────
+
+import pytest
+
+pytest.importorskip("numpy")
+
+from engine import columnar, csv_audit, rules
+from engine.csv_audit import RULES_VERSION
+from engine.findings import Findings
+from test_parallel import _ledger, _rows, _strip
+
+def test_same_as_streaming(tmp_path):
+    path = _ledger(tmp_path / "ledger.csv")
+    want, got = Findings(max_per_rule=None), Findings(max_per_rule=None)
+    expected = csv_audit.audit_path(path, findings=want)
+    summary = columnar.audit_path(path, findings=got)
+    assert summary["backend"] == "columnar" and summary["rules_version"] == RULES_VERSION
+    assert _strip(summary) == _strip(expected)
+    assert _rows(got) == _rows(want)
+
+def test_extra_rule_changes_version(tmp_path, monkeypatch):
+    monkeypatch.setattr(rules, "RULES", dict(rules.RULES))
+
+    @rules.rule("negative_amounts")
+    def negative_amounts(lg):
+        return columnar.lines_result(lg, (lg.debit < 0) | (lg.credit < 0))
+
+    path = tmp_path / "neg.csv"
+    path.write_text("tx_id,date,account,debit,credit\n1,2025-01-02,700,-5,0\n1,2025-01-02,430,0,-5\n")
+    summary = columnar.audit_path(path)
+    assert columnar.rules_version() == f"{RULES_VERSION}+negative_amounts"
+    assert summary["rules_version"] == columnar.rules_version()
+    assert summary["negative_amounts"] == {"count": 2, "lines": [2, 3]}
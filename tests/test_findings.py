@@ -0,0 +1,59 @@
+# tests/test_findings.py
+# ─────────────────────────────────────────────────────────────────────────────
+# engine/findings.py: ida y vuelta de encode_block/decode_block (zlib y zstd),
+# troceado en bloques de encode_blocks y tope por regla al recoger (Findings).
+#   python -m pytest -q tests/test_findings.py
+# ─────────────────────────────────────────────────────────────────────────────
+
+import pytest
+
+from engine import findings as fd
+from engine.findings import BLOCK_SIZE, Findings, decode_block, encode_block, encode_blocks
+
+CODECS = ["zlib", pytest.param("zstd", marks=pytest.mark.skipif(
+    fd.zstandard is None, reason="sin zstandard"))]
+
+@pytest.mark.parametrize("codec", CODECS)
+@pytest.mark.parametrize("lines,txs", [
+    ([], []),
+    ([7], [""]),
+    ([2, 2, 3, 1_000_000, 4_000_000_000], ["T1", "T1", "ñandú", "", "x" * 300]),
+])
+def test_block_round_trip(codec, lines, txs):
+    assert decode_block(encode_block(lines, txs, codec), codec) == (lines, txs)
+
+def test_encode_blocks_splits_sorted_rules():
+    f = Findings(max_per_rule=None)
+    n = BLOCK_SIZE * 2 + 5
+    f.extend("duplicates_tx", range(n, 0, -1), (f"T{i}" for i in range(n, 0, -1)))
+    f.add("invalid_date", 9, "A")
+    rows = encode_blocks(f, codec="zlib")
+    assert [(r[0], r[1], r[2], r[3]) for r in rows] == [
+        ("invalid_date", 0, 1, 9),
+        ("duplicates_tx", 0, BLOCK_SIZE, 1),
+        ("duplicates_tx", 1, BLOCK_SIZE, BLOCK_SIZE + 1),
+        ("duplicates_tx", 2, 5, 2 * BLOCK_SIZE + 1),
+    ]
+    lines, txs = decode_block(rows[-1][5], "zlib")
+    assert lines == list(range(2 * BLOCK_SIZE + 1, n + 1))
+    assert txs == [f"T{i}" for i in lines]
+
+def test_cap_while_collecting():
+    f = Findings(max_per_rule=3)
+    f.extend("required_nulls", iter(range(10)), iter(str(i) for i in range(10)))
+    f.add("required_nulls", 99, "x")
+    assert f.counts() == {"required_nulls": 3} and f.room("required_nulls") == 0
+    assert f.room("invalid_date") == 3
+    other = Findings(max_per_rule=None)
+    other.extend("invalid_date", [1, 2, 3, 4], ["a", "b", "c", "d"])
+    f.merge(other, offset=100)
+    assert list(f.rules["invalid_date"][0]) == [101, 102, 103]
+    assert Findings(max_per_rule=None).room("x") is None
+
+def test_engine_summary_counts_beyond_cap():
+    from engine.csv_audit import audit_bytes
+    rows = "".join(f"{i},fecha-mala,700,1,1\n" for i in range(50))
+    f = Findings(max_per_rule=4)
+    summary = audit_bytes(("tx_id,date,account,debit,credit\n" + rows).encode(), f)
+    assert summary["invalid_date"]["count"] == 50
+    assert list(f.rules["invalid_date"][0]) == [2, 3, 4, 5]
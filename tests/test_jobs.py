@@ -0,0 +1,97 @@
+# tests/test_jobs.py
+# ─────────────────────────────────────────────────────────────────────────────
+# services/jobs.py: etiquetas WFQ, orden de servicio y posiciones previstas de
+# AuditQueue (sin workers: se sirve a mano con _next()) y jobs aplazados (Deferred)
+# con una base SQLite temporal.
+#   python -m pytest -q tests/test_jobs.py
+# ─────────────────────────────────────────────────────────────────────────────
+
+import asyncio
+
+import pytest
+
+from services.jobs import AuditQueue, Deferred, QueueFull
+
+def _job(job_id: int, chat_id: int, size: int = 1) -> dict:
+    return {"id": job_id, "chat_id": chat_id, "size": size}
+
+async def _noop(job):
+    pass
+
+def _served(q: AuditQueue, n: int) -> list:
+    async def serve():
+        return [(await q._next())["id"] for _ in range(n)]
+    return asyncio.run(serve())
+
+def test_busy_chat_does_not_starve_others():
+    q = AuditQueue(_noop, per_chat=1)
+    assert [q.submit(_job(i, 1)) for i in (1, 2, 3)] == [1, 2, 3]
+    assert q.submit(_job(4, 2)) == 2           # detrás del primero del chat 1, no del último
+    assert [(j["id"], p) for j, p in q.positions(1)] == [(1, 1), (2, 3), (3, 4)]
+    assert [(j["id"], p) for j, p in q.positions(2)] == [(4, 2)]
+    assert len(q) == 4
+
+def test_service_order_follows_finish_tags():
+    q = AuditQueue(_noop, per_chat=10)
+    for i in (1, 2, 3):
+        q.submit(_job(i, 1))
+    for i in (4, 5):
+        q.submit(_job(i, 2))
+    assert [tag for tag, _, _ in sorted(q._ready)] == [1, 1, 2, 2, 3]
+    assert _served(q, 5) == [1, 4, 2, 5, 3]
+
+def test_weight_and_cost():
+    q = AuditQueue(_noop, per_chat=10, weights={2: 2.0}, cost=lambda job: job["size"])
+    q.submit(_job(1, 1, size=4))
+    for i in (2, 3, 4):
+        q.submit(_job(i, 2, size=2))         # peso 2: etiquetas 1, 2, 3
+    assert _served(q, 4) == [2, 3, 4, 1]
+
+def test_late_chat_starts_at_virtual_time():
+    q = AuditQueue(_noop, per_chat=10)
+    for i in (1, 2, 3):
+        q.submit(_job(i, 1))
+    assert _served(q, 2) == [1, 2]
+    q.submit(_job(4, 2))                      # no arrastra "crédito" del tiempo sin cola
+    assert q.positions(2)[0][1] == 2
+
+def test_maxsize_and_eta():
+    q = AuditQueue(_noop, workers=2, maxsize=2)
+    q.submit(_job(1, 1))
+    q.submit(_job(2, 2))
+    with pytest.raises(QueueFull):
+        q.submit(_job(3, 3))
+    q.submit(_job(3, 3), force=True)
+    assert q.eta(3) is None
+    q._avg_seconds = 10.0
+    assert q.eta(1) == 10.0 and q.eta(3) == 20.0
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    from db import sqlite_store as store
+    monkeypatch.setattr(store, "_store", store.SQLiteStore(tmp_path / "bot.db"))
+    yield store
+    store.close()
+
+def test_deferred_job_keeps_running_and_comes_back(db):
+    calls = []
+
+    async def process(job):
+        calls.append(job["id"])
+        if len(calls) == 1:
+            raise Deferred(0.05)   # el run remoto sigue en curso
+
+    async def scenario():
+        job_id = await db.create_job(1, "a.csv", "/tmp/a.csv.gz")
+        q = AuditQueue(process, workers=1)
+        await q.start()
+        q.submit({"id": job_id, "chat_id": 1})
+        await asyncio.sleep(0.02)
+        assert len(q) == 0 and q._timers        # liberó el worker; espera su reintento
+        assert [j["status"] for j in await db.pending_jobs()] == ["running"]
+        await asyncio.sleep(0.1)
+        await q.stop()
+        return job_id, await db.pending_jobs()
+
+    job_id, pending = asyncio.run(scenario())
+    assert calls == [job_id, job_id] and pending == []
@@ -0,0 +1,64 @@
+# tests/test_parallel.py
+# ─────────────────────────────────────────────────────────────────────────────
+# engine/parallel.py: con trozos pequeños (transacciones y duplicados que cruzan
+# trozos) el resumen y los hallazgos son los mismos que los del motor streaming,
+# en el mismo proceso (workers=1) y con el pool compartido (forkserver/spawn).
+#   python -m pytest -q tests/test_parallel.py
+# ─────────────────────────────────────────────────────────────────────────────
+
+import gzip, random
+
+import pytest
+
+from engine import csv_audit, parallel
+from engine.findings import Findings
+
+def _ledger(path, rows: int = 3000, seed: int = 7):
+    rnd = random.Random(seed)
+    out = ["tx_id,date,account,debit,credit,desc"]
+    for i in range(rows):
+        tx = f"T{i // 3}"
+        date = rnd.choice(["2025-01-02", "2025-02-30", "", "2025-03-01"])
+        amount = rnd.choice(["10", "10.5", "", "1.234,56"])
+        line = f"{tx},{date},{rnd.choice(['700', '430', ''])},{amount},0,fila {i}"
+        out.append(line)
+        if rnd.random() < 0.05:
+            out.append(line)                              # duplicado exacto
+        if rnd.random() < 0.01:
+            out.append(f"T{rnd.randrange(i // 3 + 1)},2025-01-02,700,0,5,tarde")  # tx repartida
+    path.write_text("\n".join(out) + "\n", encoding="utf-8")
+    return path
+
+def _strip(summary: dict) -> dict:
+    return {k: v for k, v in summary.items() if k not in ("backend", "engine")}
+
+def _rows(f: Findings) -> list:
+    return [(rule, lines, txs) for rule, lines, txs in f.sorted_rules()]
+
+@pytest.fixture(scope="module")
+def ledger(tmp_path_factory):
+    path = _ledger(tmp_path_factory.mktemp("par") / "ledger.csv")
+    want = Findings(max_per_rule=None)
+    return path, csv_audit.audit_path(path, findings=want), want
+
+@pytest.mark.parametrize("chunk_bytes", [1 << 12, 10_007, 1 << 20])
+def test_same_as_streaming_in_process(ledger, chunk_bytes):
+    path, expected, want = ledger
+    got = Findings(max_per_rule=None)
+    summary = parallel.audit_path(path, workers=1, chunk_bytes=chunk_bytes, findings=got)
+    assert summary["backend"] == "parallel"
+    assert _strip(summary) == _strip(expected)
+    assert _rows(got) == _rows(want)
+
+def test_same_as_streaming_with_pool(ledger, tmp_path):
+    path, expected, want = ledger
+    gz = tmp_path / "ledger.csv.gz"
+    gz.write_bytes(gzip.compress(path.read_bytes()))
+    got = Findings(max_per_rule=None)
+    try:
+        summary = parallel.audit_path(gz, workers=2, chunk_bytes=1 << 13, findings=got)
+    finally:
+        parallel.shutdown_pool()
+    assert _strip(summary) == _strip(expected)
+    assert _rows(got) == _rows(want)
+    assert not [p for p in tmp_path.iterdir() if p != gz]   # el .csv temporal se borra
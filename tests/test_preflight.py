@@ -0,0 +1,62 @@
+# tests/test_preflight.py
+# ─────────────────────────────────────────────────────────────────────────────
+# engine/preflight.py: _complete() con comillas y Normalizer.feed() troceando en
+# cualquier byte (separador ';', cp1252, UTF-8 en modo paso, cambio a cp1252 y
+# rechazo de archivos que mezclan codificaciones).
+#   python -m pytest -q tests/test_preflight.py
+# ─────────────────────────────────────────────────────────────────────────────
+
+import pytest
+
+from engine.preflight import HEAD_BYTES, Normalizer, _complete, inspect
+
+HEADER = "tx_id,date,account,debit,credit,desc\n"
+
+def _ledger(rows: int, desc: str = "Venta", sep: str = ",") -> str:
+    lines = [HEADER.replace(",", sep)]
+    for i in range(rows):
+        lines.append(sep.join([str(i), "2025-01-02", "700", "0", "100", f'"{desc} {i}"']) + "\n")
+    return "".join(lines)
+
+def _run(data: bytes, step: int) -> tuple[bytes, Normalizer]:
+    """Normaliza 'data' en trozos de 'step' bytes (la muestra es el primer trozo)."""
+    norm = Normalizer(inspect(data[:HEAD_BYTES], len(data)))
+    out = b"".join(norm.feed(data[i:i + step]) for i in range(0, len(data), step))
+    return out + norm.flush(), norm
+
+def test_complete_skips_newlines_inside_quotes():
+    text = 'a,b\n1,"dos\nlíneas"\n2,"abierto\n'
+    assert text[:_complete(text)] == 'a,b\n1,"dos\nlíneas"\n'
+    assert _complete('1,"sin cerrar\n') == 0
+
+@pytest.mark.parametrize("step", [1, 7, 4096])
+def test_semicolon_cp1252_to_utf8_commas(step):
+    src = _ledger(50, desc="Año, cañón", sep=";")
+    out, norm = _run(src.encode("cp1252"), step)
+    assert norm.encoding == "cp1252"
+    assert out.decode("utf-8") == _ledger(50, desc="Año, cañón")
+
+@pytest.mark.parametrize("step", [1, 5, 4096])
+def test_utf8_passthrough_keeps_bytes(step):
+    data = _ledger(50, desc="Pingüino €").encode("utf-8")
+    out, norm = _run(data, step)
+    assert norm.passthrough and out == data
+
+@pytest.mark.parametrize("step", [1, 3, 1 << 16])
+def test_ascii_sample_then_cp1252_switches(step):
+    head = _ledger(HEAD_BYTES // 30)                       # solo ASCII en la muestra
+    data = (head + _ledger(10, desc="Señal")[len(HEADER):]).encode("cp1252")
+    out, norm = _run(data, step)
+    assert norm.encoding == "cp1252" and not norm.passthrough
+    assert out.decode("utf-8") == data.decode("cp1252")
+
+def test_mixed_utf8_and_cp1252_is_rejected():
+    head = _ledger(HEAD_BYTES // 30, desc="Año").encode("utf-8")
+    data = head + _ledger(10, desc="Año")[len(HEADER):].encode("cp1252")
+    with pytest.raises(ValueError, match="mezcla"):
+        _run(data, 1 << 16)
+
+def test_truncated_utf8_at_end_is_rejected():
+    data = _ledger(5, desc="Año").encode("utf-8") + "ñ".encode("utf-8")[:1]
+    with pytest.raises(ValueError):
+        _run(data, 1 << 16)
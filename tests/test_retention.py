@@ -0,0 +1,60 @@
+# tests/test_retention.py
+# ─────────────────────────────────────────────────────────────────────────────
+# services/retention.py: compact() archiva auditorías sin cambiar /trends, y
+# rebuild_rollups() recalcula los mismos agregados sumando lo archivado (también
+# si una fila quedó archivada dos veces tras una caída a medias).
+#   python -m pytest -q tests/test_retention.py
+# ─────────────────────────────────────────────────────────────────────────────
+
+import asyncio
+
+import pytest
+
+from db import sqlite_store as store
+from services import retention
+
+def _summary(errors: int) -> dict:
+    return {"invalid_date": {"count": errors, "lines": []}, "duplicates_tx": {"count": 0, "lines": []},
+            "unbalanced_tx": {"count": 1, "tx_ids": []}, "required_nulls": {"count": 0, "lines": []}}
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, "_store", store.SQLiteStore(tmp_path / "bot.db"))
+    monkeypatch.setattr(retention, "ARCHIVE_DIR", tmp_path / "archive")
+    yield store.get_store()
+    store.close()
+
+def _seed(s: store.SQLiteStore) -> None:
+    async def seed():
+        for i in range(200):
+            await s.save_audit(1 + i % 2, f"f{i % 7}.csv", _summary(i % 3), None, None)
+        await s.save_audit(1, "roto.csv", "no es json", None, None)   # resumen sin formato
+    asyncio.run(seed())
+
+def _trends(s: store.SQLiteStore, chat_id: int) -> dict:
+    return asyncio.run(s.trends(chat_id, days=400, weeks=60, top=50))
+
+def test_compact_then_rebuild_keeps_totals(db):
+    _seed(db)
+    before = {c: _trends(db, c) for c in (1, 2)}
+    out = asyncio.run(retention.compact(max_age=0, per_chat=20))
+    assert out["archived"] == 161 and out["audits"] == 40
+    assert {c: _trends(db, c) for c in (1, 2)} == before
+
+    asyncio.run(retention.rebuild_rollups(1))
+    assert _trends(db, 1) == before[1]
+    asyncio.run(retention.rebuild_rollups())
+    assert {c: _trends(db, c) for c in (1, 2)} == before
+    assert before[1]["total"]["audits"] == 101 and before[1]["total"]["unparsed"] == 1
+
+def test_rebuild_counts_rows_archived_twice_once(db):
+    _seed(db)
+    before = _trends(db, 2)
+    rows = asyncio.run(db.archive_candidates(0, 30, 1000))
+    retention._append(rows)
+    retention._append(rows)                       # caída antes de borrar: se reintenta
+    asyncio.run(retention.rebuild_rollups(2))     # y aún siguen en audits
+    assert _trends(db, 2) == before
+    asyncio.run(db.delete_audits([r["id"] for r in rows]))
+    asyncio.run(retention.rebuild_rollups(2))
+    assert _trends(db, 2) == before
@@ -0,0 +1,65 @@
+# tests/test_store_paging.py
+# ─────────────────────────────────────────────────────────────────────────────
+# db/sqlite_store.py: SELECT de /audits (_page_sql) y paginación keyset de
+# page_audits() sobre una base temporal: filtros, cursores en ambos sentidos
+# y planes que usan los índices (sin ordenar en memoria).
+#   python -m pytest -q tests/test_store_paging.py
+# ─────────────────────────────────────────────────────────────────────────────
+
+import asyncio
+
+import pytest
+
+from db.sqlite_store import SQLiteStore, _page_sql
+
+def _summary(errors: int) -> dict:
+    return {"invalid_date": {"count": errors, "lines": []}, "duplicates_tx": {"count": 0, "lines": []},
+            "unbalanced_tx": {"count": 0, "tx_ids": []}, "required_nulls": {"count": 0, "lines": []}}
+
+@pytest.fixture
+def db(tmp_path):
+    s = SQLiteStore(tmp_path / "bot.db").start()
+
+    async def seed():
+        for i in range(12):   # 12 auditorías del chat 1 (impares con errores) y 3 de otro chat
+            await s.save_audit(1, f"f{i % 3}.csv", _summary(i % 2), None, None)
+        for i in range(3):
+            await s.save_audit(2, "otro.csv", _summary(0), None, None)
+    asyncio.run(seed())
+    yield s
+    s.close()
+
+def _page(s: SQLiteStore, **kw):
+    rows, more = asyncio.run(s.page_audits(1, **kw))
+    return [r["id"] for r in rows], more
+
+def test_sql_shape():
+    sql, params = _page_sql("a.csv", 10.0, None, False, (5.0, 3), None, 6, 1)
+    assert "errors=0" in sql and "ORDER BY created_at DESC, id DESC" in sql
+    assert params == [1, "a.csv", 10.0, 5.0, 3, 6]
+    sql, params = _page_sql(None, None, 20.0, True, None, (5.0, 3), 6, 1)
+    assert "errors>0" in sql and "created_at<?" in sql and "ASC" in sql
+    assert params == [1, 20.0, 5.0, 3, 6]
+
+def test_keyset_pages_both_directions(db):
+    first, more = _page(db, limit=5)
+    assert first == [12, 11, 10, 9, 8] and more
+    rows = asyncio.run(db.page_audits(1, limit=5))[0]
+    cursor = (rows[-1]["created_at"], rows[-1]["id"])
+    second, _ = _page(db, limit=5, before=cursor)
+    assert second == [7, 6, 5, 4, 3]
+    rows = asyncio.run(db.page_audits(1, limit=5, before=cursor))[0]
+    back, more = _page(db, limit=5, after=(rows[0]["created_at"], rows[0]["id"]))
+    assert back == first and not more
+
+def test_filters(db):
+    assert _page(db, limit=20, has_errors=True)[0] == [12, 10, 8, 6, 4, 2]
+    assert _page(db, limit=20, has_errors=False)[0] == [11, 9, 7, 5, 3, 1]
+    assert _page(db, limit=20, file_name="f0.csv")[0] == [10, 7, 4, 1]
+
+@pytest.mark.parametrize("has_errors,index", [
+    (None, "idx_audits_chat_page"), (True, "idx_audits_chat_errors"), (False, "idx_audits_chat_ok")])
+def test_plans_use_indexes(db, has_errors, index):
+    sql, params = _page_sql(None, None, None, has_errors, (1e18, 0), None, 6, 1)
+    plan = " ".join(r[-1] for r in db.read_sync(lambda con: con.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()))
+    assert index in plan and "TEMP B-TREE" not in plan
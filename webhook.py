@@ -0,0 +1,196 @@
+# webhook.py
+# ─────────────────────────────────────────────────────────────────────────────
+# Modo webhook con escalado horizontal (alternativa a `python app.py` en polling):
+# - Un servidor ASGI (uvicorn) recibe los updates de Telegram en WEBHOOK_PATH.
+# - Los reparte entre N procesos worker por afinidad de chat (chat_id % N), así
+#   cada chat se procesa siempre en el mismo proceso y en orden.
+# - Cada worker construye la misma Application que app.py (mismos handlers) y
+#   comparte con los demás el estado en SQLite (WAL) y la cola audit_jobs.
+#
+# Uso:
+#   WEBHOOK_URL=https://bot.example.com WEBHOOK_WORKERS=4 python webhook.py
+# Variables: WEBHOOK_URL (obligatoria), WEBHOOK_PATH (/telegram), WEBHOOK_SECRET,
+#            WEBHOOK_HOST (0.0.0.0), WEBHOOK_PORT (8080), WEBHOOK_WORKERS (nº CPUs),
+#            WEBHOOK_QUEUE_MAX (updates pendientes por worker antes de responder 503)
+# ─────────────────────────────────────────────────────────────────────────────
+
+import asyncio, json, logging, multiprocessing as mp, os, queue, secrets
+from typing import Any, Dict, List, Optional
+
+from config import setup_logging, load_token
+
+log = logging.getLogger("webhook")
+
+def chat_key(update: Dict[str, Any]) -> int:
+    """Clave de afinidad: chat del update (o usuario, o update_id si no hay ninguno)."""
+    for value in update.values():
+        if not isinstance(value, dict):
+            continue
+        chat = value.get("chat") or (value.get("message") or {}).get("chat")
+        if chat:
+            return int(chat["id"])
+        user = value.get("from") or value.get("user")
+        if user:
+            return int(user["id"])
+    return int(update.get("update_id", 0))
+
+# ---- worker ----
+
+async def _serve_worker(application, updates: "mp.Queue") -> None:
+    from telegram import Update
+
+    loop = asyncio.get_running_loop()
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    try:
+        while True:
+            raw = await loop.run_in_executor(None, updates.get)
+            if raw is None:
+                break
+            update = Update.de_json(json.loads(raw), application.bot)
+            await application.update_queue.put(update)   # procesado secuencial → orden por chat
+    finally:
+        if application.running:
+            await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+def _worker_main(index: int, total: int, updates: "mp.Queue") -> None:
+    os.environ["BOT_WORKER_INDEX"] = str(index)
+    os.environ["BOT_WORKERS"] = str(total)
+    import app as bot
+    try:   # misma Application (handlers, hooks) que en polling
+        asyncio.run(_serve_worker(bot.create_app(), updates))
+    except KeyboardInterrupt:
+        pass
+
+# ---- reparto por chat ----
+
+class ChatRouter:
+    """N procesos worker, cada uno con su cola; un chat siempre va al mismo worker."""
+
+    def __init__(self, workers: int, maxsize: int = 1000) -> None:
+        self.workers = workers
+        self.maxsize = maxsize
+        self._ctx = mp.get_context("spawn")
+        self._queues: List["mp.Queue"] = []
+        self._procs: List[Optional[mp.Process]] = []
+
+    def _spawn(self, i: int) -> None:
+        p = self._ctx.Process(target=_worker_main, args=(i, self.workers, self._queues[i]),
+                              name=f"bot-worker-{i}", daemon=False)
+        p.start()
+        self._procs[i] = p
+
+    def start(self) -> None:
+        self._queues = [self._ctx.Queue(self.maxsize) for _ in range(self.workers)]
+        self._procs = [None] * self.workers
+        for i in range(self.workers):
+            self._spawn(i)
+
+    def dispatch(self, raw: bytes, update: Dict[str, Any]) -> bool:
+        """Encola el update en su worker. False si está saturado (Telegram reintentará)."""
+        i = chat_key(update) % self.workers
+        if not self._procs[i].is_alive():
+            log.warning("Worker %d caído (exit=%s); relanzando", i, self._procs[i].exitcode)
+            self._spawn(i)
+        try:
+            self._queues[i].put_nowait(raw)
+            return True
+        except queue.Full:
+            return False
+
+    def stop(self, timeout: float = 30.0) -> None:
+        for q in self._queues:
+            q.put(None)
+        for p in self._procs:
+            if p is not None:
+                p.join(timeout)
+                if p.is_alive():
+                    p.terminate()
+
+# ---- ASGI ----
+
+class WebhookApp:
+    """App ASGI mínima: POST <path> (updates) y GET /healthz."""
+
+    def __init__(self, router: ChatRouter, secret: str, path: str) -> None:
+        self.router = router
+        self.secret = secret.encode()
+        self.path = path
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            while (await receive())["type"] != "lifespan.shutdown":
+                await send({"type": "lifespan.startup.complete"})
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+        if scope["type"] != "http":
+            return
+        if scope["method"] == "GET" and scope["path"] == "/healthz":
+            return await self._reply(send, 200, b"ok")
+        if scope["method"] != "POST" or scope["path"] != self.path:
+            return await self._reply(send, 404, b"not found")
+        headers = dict(scope["headers"])
+        if not secrets.compare_digest(headers.get(b"x-telegram-bot-api-secret-token", b""), self.secret):
+            return await self._reply(send, 403, b"forbidden")
+
+        body = bytearray()
+        while True:
+            msg = await receive()
+            body += msg.get("body", b"")
+            if not msg.get("more_body"):
+                break
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return await self._reply(send, 400, b"bad json")
+        if not self.router.dispatch(bytes(body), update):
+            return await self._reply(send, 503, b"busy")
+        await self._reply(send, 200, b"")
+
+    @staticmethod
+    async def _reply(send, status: int, body: bytes) -> None:
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"text/plain"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+async def _set_webhook(token: str, url: str, secret: str) -> None:
+    from telegram import Bot, Update
+    async with Bot(token) as bot:
+        await bot.set_webhook(url, secret_token=secret, allowed_updates=Update.ALL_TYPES)
+    log.info("Webhook registrado en %s", url)
+
+def main() -> None:
+    setup_logging("INFO")
+    token = load_token()
+    base = os.getenv("WEBHOOK_URL", "").rstrip("/")
+    if not base:
+        raise RuntimeError("Falta WEBHOOK_URL (URL pública https del bot)")
+    path = os.getenv("WEBHOOK_PATH", "/telegram")
+    secret = os.getenv("WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+    workers = int(os.getenv("WEBHOOK_WORKERS", "0")) or (os.cpu_count() or 1)
+
+    try:
+        import uvicorn
+    except ImportError:
+        raise RuntimeError("El modo webhook necesita uvicorn (pip install uvicorn)")
+
+    router = ChatRouter(workers, int(os.getenv("WEBHOOK_QUEUE_MAX", "1000")))
+    router.start()
+    try:
+        asyncio.run(_set_webhook(token, base + path, secret))
+        uvicorn.run(WebhookApp(router, secret, path),
+                    host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+                    port=int(os.getenv("WEBHOOK_PORT", "8080")),
+                    log_level="warning")
+    finally:
+        router.stop()
+
+if __name__ == "__main__":
+    main()